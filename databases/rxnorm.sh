@@ -18,26 +18,9 @@ if [ ! -e rxnorm.db ]; then
 		exit 1
 	fi
 	
-	# init the database
-	cat "$1/scripts/mysql/Table_scripts_mysql_rxn.sql" | sqlite3 rxnorm.db
-	
-	# convert RRF files (strip last pipe and remove quote (") characters, those are giving SQLite troubles)
-	if [ ! -e "$1/rrf/RXNREL.pipe" ]; then
-		current=$(pwd)
-		cd "$1/rrf"
-		echo "->  Converting RRF files for SQLite"
-		for f in *.RRF; do
-			sed -e 's/.$//' -e 's/"//g' "$f" > "${f%RRF}pipe"
-		done
-		cd $current
-	fi
-	
-	# import tables
-	for f in "$1/rrf/"*.pipe; do
-		table=$(basename ${f%.pipe})
-		echo "->  Importing $table"
-		sqlite3 rxnorm.db ".import '$f' '$table'"
-	done
+	# import tables, typed and streamed straight from the RRF files
+	echo "->  Importing RRF files"
+	python3 "$(dirname "$0")/../rrfimporter.py" "$1/rrf" rxnorm.db || exit 1
 	
 	# create an NDC table
 	echo "->  Creating extra tables"
@@ -30,68 +30,19 @@ if [ ! -e umls.db ]; then
 		exit 1
 	fi
 	
-	# convert RRF files (strip last pipe and remove quote (") characters, those are giving SQLite troubles)
-	if [ ! -e "$1/META/MRDEF.pipe" ]; then
-		current=$(pwd)
-		cd "$1/META"
-		echo "-> Converting RRF files for SQLite"
-		for f in MRCONSO.RRF MRDEF.RRF MRSTY.RRF; do
-			sed -e 's/.$//' -e 's/"//g' "$f" > "${f%RRF}pipe"
-		done
-		cd $current
-	fi
-	
-	# init the database for MRDEF
+	# import tables, typed and streamed straight from the RRF files; set
+	# UMLS_RELATIONS=1 to also import relationships (MRREL) and, if present,
+	# the hierarchies (MRHIER)
 	# table structure here: http://www.ncbi.nlm.nih.gov/books/NBK9685/
-	sqlite3 umls.db "CREATE TABLE MRDEF (
-		CUI varchar,
-		AUI varchar,
-		ATUI varchar,
-		SATUI varchar,
-		SAB varchar,
-		DEF text,
-		SUPPRESS varchar,
-		CVF varchar
-	)"
-	
-	# init the database for MRCONSO
-	sqlite3 umls.db "CREATE TABLE MRCONSO (
-		CUI varchar,
-		LAT varchar,
-		TS varchar,
-		LUI varchar,
-		STT varchar,
-		SUI varchar,
-		ISPREF varchar,
-		AUI varchar,
-		SAUI varchar,
-		SCUI varchar,
-		SDUI varchar,
-		SAB varchar,
-		TTY varchar,
-		CODE varchar,
-		STR text,
-		SRL varchar,
-		SUPPRESS varchar,
-		CVF varchar
-	)"
-	
-	# init the database for MRSTY
-	sqlite3 umls.db "CREATE TABLE MRSTY (
-		CUI varchar,
-		TUI varchar,
-		STN varchar,
-		STY text,
-		ATUI varchar,
-		CVF varchar
-	)"
-	
-	# import tables
-	for f in "$1/META/"*.pipe; do
-		table=$(basename ${f%.pipe})
-		echo "-> Importing $table"
-		sqlite3 umls.db ".import '$f' '$table'"
-	done
+	tables="MRCONSO MRDEF MRSTY"
+	if [ -n "$UMLS_RELATIONS" ] && [ "$UMLS_RELATIONS" != "0" ]; then
+		tables="$tables MRREL"
+		if [ -e "$1/META/MRHIER.RRF" ]; then
+			tables="$tables MRHIER"
+		fi
+	fi
+	echo "-> Importing RRF files"
+	python3 "$(dirname "$0")/../rrfimporter.py" "$1/META" umls.db $tables || exit 1
 	
 	# create indexes
 	echo "-> Creating indexes"
@@ -102,13 +53,41 @@ if [ ! -e umls.db ]; then
 	sqlite3 umls.db "CREATE INDEX X_TS_MRCONSO ON MRCONSO (TS);"
 	sqlite3 umls.db "CREATE INDEX X_CUI_MRSTY ON MRSTY (CUI);"
 	sqlite3 umls.db "CREATE INDEX X_TUI_MRSTY ON MRSTY (TUI);"
+	case "$tables" in *MRREL*)
+		sqlite3 umls.db "CREATE INDEX X_CUI1_MRREL ON MRREL (CUI1, REL);"
+	esac
+	case "$tables" in *MRHIER*)
+		sqlite3 umls.db "CREATE INDEX X_CUI_MRHIER ON MRHIER (CUI);"
+		sqlite3 umls.db "CREATE INDEX X_AUI_MRHIER ON MRHIER (AUI);"
+	esac
+	
+	# create a normalized semantic type table, one row per concept and type
+	echo "-> Creating semantic type table"
+	sqlite3 umls.db "CREATE TABLE concept_sty (CUI TEXT, TUI TEXT, PRIMARY KEY (CUI, TUI)) WITHOUT ROWID"
+	sqlite3 umls.db "INSERT OR IGNORE INTO concept_sty SELECT CUI, TUI FROM MRSTY ORDER BY CUI, TUI"
+	sqlite3 umls.db "CREATE INDEX X_TUI_concept_sty ON concept_sty (TUI, CUI)"
 	
-	# create faster lookup table
+	# create faster lookup table, joining semantic types aggregated per concept in one pass
 	echo "-> Creating fast lookup table"
-	sqlite3 umls.db "CREATE TABLE descriptions AS SELECT CUI, LAT, SAB, TTY, STR FROM MRCONSO WHERE LAT = 'ENG' AND TS = 'P' AND ISPREF = 'Y'"
-	sqlite3 umls.db "ALTER TABLE descriptions ADD COLUMN STY TEXT"
+	sqlite3 umls.db "CREATE TABLE descriptions AS
+		SELECT MRCONSO.CUI AS CUI, LAT, SAB, TTY, STR, sty.STY AS STY
+		FROM MRCONSO LEFT JOIN (
+			SELECT CUI, GROUP_CONCAT(TUI, '|') AS STY FROM concept_sty GROUP BY CUI
+		) AS sty ON sty.CUI = MRCONSO.CUI
+		WHERE LAT = 'ENG' AND TS = 'P' AND ISPREF = 'Y'"
 	sqlite3 umls.db "CREATE INDEX X_CUI_desc ON descriptions (CUI)"
-	sqlite3 umls.db "UPDATE descriptions SET STY = (SELECT GROUP_CONCAT(MRSTY.TUI, '|') FROM MRSTY WHERE MRSTY.CUI = descriptions.CUI GROUP BY MRSTY.CUI)"
+	
+	# create the code mapping table, see `UMLS.build_code_map()`
+	echo "-> Creating code mapping table"
+	python3 "$(dirname "$0")/../umls.py" --code-map umls.db || exit 1
+	
+	# create the normalized name index, see `UMLS.build_normalized_index()`
+	echo "-> Creating normalized name index"
+	python3 "$(dirname "$0")/../umls.py" --normalized-index umls.db || exit 1
+	
+	# create the full-text index for name searches, see `UMLS.build_search_index()`
+	echo "-> Creating search index"
+	python3 "$(dirname "$0")/../umls.py" --search-index umls.db || exit 1
 else
 	echo "=> umls.db already exists"
 fi
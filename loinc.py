@@ -4,19 +4,175 @@
 #  LOINC import and lookup utilities
 
 
+import re
 import sys
 import os.path
 import logging
+import collections
+
+from sqlite import SQLite			# for py-umls standalone
 
 
 class LOINCLookup(object):
-	pass
+	""" LOINC lookup """
+	
+	sqlite = None
+	cache_size = 10000		# number of codes whose rows and replacements we keep around
+	
+	# the columns returned for every code
+	columns = ('LOINC_NUM', 'LONG_COMMON_NAME', 'SHORTNAME', 'COMPONENT', 'SYSTEM', 'CLASS', 'STATUS')
+	
+	def __init__(self, database=None):
+		self.sqlite = SQLite.get(database or LOINC.database_path())
+		self._cache = collections.OrderedDict()
+		self._has_search_index = False
+	
+	def lookup_code(self, loinc_num):
+		""" Returns a dict with the `columns` of the given LOINC code, None
+		if the code is unknown.
+		"""
+		return self.lookup_code_many([loinc_num])[0]
+	
+	def lookup_code_meaning(self, loinc_num):
+		""" Returns the long common name of the given LOINC code, an empty
+		string if it is unknown.
+		"""
+		found = self.lookup_code(loinc_num)
+		return found['LONG_COMMON_NAME'] if found else ''
+	
+	def lookup_code_many(self, loinc_nums):
+		""" Batch variant of `lookup_code`, returning a list aligned with
+		`loinc_nums`; codes not in our LRU cache are looked up together.
+		"""
+		sql = 'SELECT {} FROM loinc WHERE LOINC_NUM IN ({{}})'.format(', '.join(self.__class__.columns))
+		def fetch(codes):
+			found = dict((code, None) for code in codes)
+			for res in self.sqlite.executeIn(sql, codes):
+				found[res[0]] = dict(zip(self.__class__.columns, res))
+			return found
+		return self._cached_many('code', loinc_nums, fetch)
+	
+	def lookup_replacement(self, loinc_num):
+		""" Follows MAP_TO entries of deprecated codes to the codes that
+		replace them, which may themselves be deprecated and replaced.
+		
+		:returns: A list of the codes that end the replacement chains, the
+			code itself if it has no replacement
+		"""
+		return self.lookup_replacement_many([loinc_num])[0]
+	
+	def lookup_replacement_many(self, loinc_nums):
+		""" Batch variant of `lookup_replacement`, returning a list aligned
+		with `loinc_nums`; every step along the chains is one query for all
+		codes.
+		"""
+		def fetch(codes):
+			# collect MAP_TO edges level by level
+			maps_to = {}
+			frontier = set(codes)
+			while len(frontier) > 0:
+				for code in frontier:
+					maps_to[code] = []
+				for res in self.sqlite.executeIn('SELECT LOINC, MAP_TO FROM map_to WHERE LOINC IN ({})', list(frontier)):
+					maps_to[res[0]].append(res[1])
+				frontier = set(target for code in frontier for target in maps_to[code] if target not in maps_to)
+			
+			# resolve chains, guarding against cycles
+			found = {}
+			for code in codes:
+				ends = []
+				seen = set([code])
+				stack = [code]
+				while len(stack) > 0:
+					current = stack.pop()
+					targets = [target for target in maps_to[current] if target not in seen]
+					if 0 == len(maps_to[current]):
+						if current not in ends:
+							ends.append(current)
+					seen.update(targets)
+					stack.extend(reversed(targets))
+				found[code] = ends
+			return found
+		return self._cached_many('map', loinc_nums, fetch)
+	
+	def has_search_index(self):
+		""" Whether the database contains the full-text index built by
+		:meth:`LOINC.build_search_index`; checked until it is found.
+		"""
+		if not self._has_search_index:
+			self._has_search_index = self.sqlite.hasTable('loinc_fts')
+		return self._has_search_index
+	
+	def search(self, text, loinc_class=None, system=None, scale=None, limit=20, offset=0):
+		""" Searches long common names, short names, components and related
+		names for all of the given words, each matching as a prefix, so
+		"gluc ur" finds "Glucose [Mass/volume] in Urine by Test strip". Uses
+		the full-text index built by :meth:`LOINC.build_search_index`.
+		
+		:param str loinc_class: Only return codes of this CLASS, e.g. "CHEM"
+		:param str system: Only return codes of this SYSTEM, e.g. "Ser/Plas"
+		:param str scale: Only return codes of this SCALE_TYP, e.g. "Qn"
+		:param int limit: The maximum number of results to return
+		:param int offset: The number of results to skip, for paging
+		:returns: A list of dicts with the `columns` of the codes found, best
+			matches first
+		"""
+		words = re.findall(r'\w+', text or '')
+		if 0 == len(words):
+			return []
+		if not self.has_search_index():
+			raise Exception('LOINC search needs the full-text index, run `LOINC.build_search_index()` first')
+		
+		match = ' '.join('"{}"*'.format(word) for word in words)
+		sql = '''SELECT {}
+			FROM loinc_fts JOIN loinc ON loinc.rowid = loinc_fts.rowid
+			WHERE loinc_fts MATCH ?'''.format(', '.join('loinc.' + col for col in self.__class__.columns))
+		params = [match]
+		for column, value in (('CLASS', loinc_class), ('SYSTEM', system), ('SCALE_TYP', scale)):
+			if value is not None:
+				sql += ' AND loinc.{} = ?'.format(column)
+				params.append(value)
+		sql += ' ORDER BY bm25(loinc_fts, {}) LIMIT ? OFFSET ?'.format(', '.join(str(weight) for weight in LOINC.search_weights))
+		params.extend([limit, offset])
+		
+		return [dict(zip(self.__class__.columns, res)) for res in self.sqlite.execute(sql, params)]
+	
+	def _cached_many(self, kind, loinc_nums, fetch):
+		""" Looks up the `kind` results of all codes through our LRU cache,
+		calling `fetch` with a list of the codes not in the cache, which must
+		return a dict of code to result.
+		"""
+		cache = self._cache
+		results = {}
+		for code in loinc_nums:
+			if code is None or code in results:
+				continue
+			key = (kind, code)
+			if key in cache:
+				cache.move_to_end(key)
+				results[code] = cache[key]
+		missing = [code for code in collections.OrderedDict.fromkeys(loinc_nums) if code is not None and code not in results]
+		if len(missing) > 0:
+			fetched = fetch(missing)
+			for code in missing:
+				results[code] = cache[(kind, code)] = fetched[code]
+			while len(cache) > self.cache_size:
+				cache.popitem(last=False)
+		return [results[code] if code is not None else None for code in loinc_nums]
 
 
 class LOINC(object):
 	""" Class that helps with setting up a local LOINC SQLite database.
 	"""
 	
+	# bm25 weights of the LONG_COMMON_NAME, SHORTNAME, COMPONENT and
+	# RELATEDNAMES2 columns of the full-text index
+	search_weights = (10.0, 5.0, 5.0, 1.0)
+	
+	@classmethod
+	def database_path(cls):
+		return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases/loinc.db')
+	
 	@classmethod
 	def check_database(cls):
 		""" Check if our database is in place and if not, prompts to create it.
@@ -25,14 +181,17 @@ class LOINC(object):
 		Reads LOINC from CSV files and create an SQLite database, if needed.
 		"""
 		
-		dbpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases/loinc.db')
+		dbpath = cls.database_path()
 		if not os.path.exists(dbpath):
 			raise Exception("The LOINC database at {} does not exist. Run the script `loinc.py`."
 				.format(dbpath))
 	
 	@classmethod
-	def import_from_files(cls, dirpath):
+	def import_from_files(cls, dirpath, dbpath=None):
 		""" Imports LOINC from the downloaded CSV files.
+		
+		:param str dbpath: The database to import into, defaults to
+			`databases/loinc.db`
 		"""
 		import sqlite
 		import csvimporter
@@ -42,7 +201,7 @@ class LOINC(object):
 			'map_to.csv': 'map_to',
 			'source_organization.csv': 'sources'
 		}
-		dbpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases/loinc.db')
+		dbpath = dbpath or cls.database_path()
 		
 		# import
 		for csvfile, table in mapping.items():
@@ -56,6 +215,26 @@ class LOINC(object):
 		sql_handle.execute('CREATE INDEX x_loinc_num_loinc ON loinc (LOINC_NUM)')
 		sql_handle.execute('CREATE INDEX x_shortname_loinc ON loinc (SHORTNAME)')
 		sql_handle.execute('CREATE INDEX x_long_common_name_loinc ON loinc (LONG_COMMON_NAME)')
+		sql_handle.execute('CREATE INDEX x_loinc_map_to ON map_to (LOINC)')
+		
+		print("Creating full-text index")
+		cls.build_search_index(sql_handle)
+	
+	@classmethod
+	def build_search_index(cls, sqlite):
+		""" Creates `loinc_fts`, a full-text index over the names and the
+		component of all codes in `loinc`, with prefix indexes so that
+		as-you-type searches are fast. Replaces an existing index.
+		
+		:param sqlite: The :class:`SQLite` instance of the LOINC database
+		"""
+		sqlite.execute('DROP TABLE IF EXISTS loinc_fts')
+		sqlite.execute('''CREATE VIRTUAL TABLE loinc_fts USING fts5(
+				LONG_COMMON_NAME, SHORTNAME, COMPONENT, RELATEDNAMES2,
+				content='loinc', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+			)''')
+		sqlite.execute("INSERT INTO loinc_fts (loinc_fts) VALUES ('rebuild')")
+		sqlite.commit()
 
 
 
@@ -77,5 +256,17 @@ if '__main__' == __name__:
 			print("Provide the path to the directory containing the LOINC CSV files as first argument.")
 			print("Download the LOINC Table File in CSV format (free registration required) here:")
 			print("http://loinc.org/downloads/loinc")
+			sys.exit(1)
+	else:
+		# databases imported before there was a full-text index get it once
+		sqlite = SQLite.get(LOINC.database_path())
+		if not sqlite.hasTable('loinc_fts'):
+			print("Creating full-text index")
+			LOINC.build_search_index(sqlite)
 	
-	# TODO: lookup examples
+	# examples
+	look = LOINCLookup()
+	code = '2345-7'
+	print('LOINC code "{0}":  {1}'.format(code, look.lookup_code_meaning(code)))
+	text = 'glucose ser'
+	print('LOINC search "{0}":  {1}'.format(text, [res['LOINC_NUM'] for res in look.search(text, limit=5)]))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	LOINC unit testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import shutil
+import tempfile
+import unittest
+from loinc import *
+
+
+LOINC_CSV = [
+	'"LOINC_NUM","COMPONENT","PROPERTY","TIME_ASPCT","SYSTEM","SCALE_TYP","METHOD_TYP","CLASS","STATUS","SHORTNAME","LONG_COMMON_NAME","RELATEDNAMES2"',
+	'"2345-7","Glucose","MCnc","Pt","Ser/Plas","Qn","","CHEM","ACTIVE","Glucose SerPl-mCnc","Glucose [Mass/volume] in Serum or Plasma","Glu; Gluc; Glucoseur; Level; Mass concentration"',
+	'"2339-0","Glucose","MCnc","Pt","Bld","Qn","","CHEM","ACTIVE","Glucose Bld-mCnc","Glucose [Mass/volume] in Blood","Glu; Gluc; Glucoseur; Whole blood; Not serum"',
+	'"5792-7","Glucose","MCnc","Pt","Urine","Qn","Test strip","UA","ACTIVE","Glucose Ur Strip-mCnc","Glucose [Mass/volume] in Urine by Test strip","Glu; Gluc; UA; Urinalysis"',
+	'"25428-4","Glucose","MCnc","Pt","Urine","Ord","Test strip","UA","ACTIVE","Glucose Ur Ql Strip","Glucose [Presence] in Urine by Test strip","Glu; Gluc; UA; Urinalysis; Screen"',
+	'"1000-1","Old glucose","MCnc","Pt","Ser/Plas","Qn","","CHEM","DEPRECATED","Old Glucose","Old glucose in Serum or Plasma",""',
+	'"1000-2","Older glucose","MCnc","Pt","Ser/Plas","Qn","","CHEM","DEPRECATED","Older Glucose","Older glucose in Serum or Plasma",""',
+	'"1000-3","Cyclic","MCnc","Pt","Ser/Plas","Qn","","CHEM","DEPRECATED","Cyclic","Cyclic replacement",""',
+	'"1000-4","Cyclic","MCnc","Pt","Ser/Plas","Qn","","CHEM","DEPRECATED","Cyclic","Cyclic replacement",""',
+]
+MAP_TO_CSV = [
+	'"LOINC","MAP_TO","COMMENT"',
+	'"1000-2","1000-1","Chained"',
+	'"1000-1","2345-7","Use the serum or plasma code"',
+	'"1000-1","2339-0","Or the blood code"',
+	'"1000-3","1000-4",""',
+	'"1000-4","1000-3",""',
+]
+SOURCES_CSV = [
+	'"ID","COPYRIGHT_ID","NAME","COPYRIGHT","TERMS_OF_USE","URL"',
+]
+
+
+class LOINCLookupTest(unittest.TestCase):
+	""" Test :class:`LOINCLookup` on a database imported from fixture CSVs.
+	"""
+	
+	@classmethod
+	def setUpClass(cls):
+		cls.tmpdir = tempfile.mkdtemp()
+		for name, lines in (('loinc.csv', LOINC_CSV), ('map_to.csv', MAP_TO_CSV), ('source_organization.csv', SOURCES_CSV)):
+			with open(os.path.join(cls.tmpdir, name), 'w', encoding='utf-8') as handle:
+				handle.write('\n'.join(lines) + '\n')
+		cls.db_path = os.path.join(cls.tmpdir, 'loinc.db')
+		LOINC.import_from_files(cls.tmpdir, cls.db_path)
+	
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.tmpdir)
+	
+	def lookup(self):
+		return LOINCLookup(self.db_path)
+	
+	def test_lookup_code(self):
+		look = self.lookup()
+		found = look.lookup_code('2345-7')
+		self.assertEqual('Glucose [Mass/volume] in Serum or Plasma', found['LONG_COMMON_NAME'])
+		self.assertEqual('Glucose', found['COMPONENT'])
+		self.assertEqual('Ser/Plas', found['SYSTEM'])
+		self.assertIsNone(look.lookup_code('0000-0'))
+		self.assertEqual('Glucose [Mass/volume] in Blood', look.lookup_code_meaning('2339-0'))
+		self.assertEqual('', look.lookup_code_meaning('0000-0'))
+	
+	def test_lookup_code_many(self):
+		look = self.lookup()
+		found = look.lookup_code_many(['5792-7', '0000-0', None, '5792-7', '2339-0'])
+		self.assertEqual(5, len(found))
+		self.assertEqual('Urine', found[0]['SYSTEM'])
+		self.assertIsNone(found[1])
+		self.assertIsNone(found[2])
+		self.assertEqual(found[0], found[3])
+		self.assertEqual('Bld', found[4]['SYSTEM'])
+	
+	def test_cache(self):
+		look = self.lookup()
+		look.cache_size = 2
+		look.lookup_code_many(['2345-7', '2339-0', '5792-7'])
+		self.assertEqual([('code', '2339-0'), ('code', '5792-7')], list(look._cache.keys()))
+		look.lookup_code('2339-0')
+		self.assertEqual([('code', '5792-7'), ('code', '2339-0')], list(look._cache.keys()))
+	
+	def test_lookup_replacement(self):
+		look = self.lookup()
+		self.assertEqual(['2345-7'], look.lookup_replacement('2345-7'))
+		self.assertEqual(['2345-7', '2339-0'], sorted(look.lookup_replacement('1000-1'), reverse=True))
+		self.assertEqual(['2345-7', '2339-0'], sorted(look.lookup_replacement('1000-2'), reverse=True))
+		self.assertEqual([], look.lookup_replacement('1000-3'))
+		self.assertEqual([['2345-7', '2339-0'], ['5792-7']], [sorted(res, reverse=True) for res in look.lookup_replacement_many(['1000-2', '5792-7'])])
+	
+	def codes(self, results):
+		return [res['LOINC_NUM'] for res in results]
+	
+	def test_search(self):
+		look = self.lookup()
+		self.assertEqual([], look.search(' - '))
+		self.assertEqual({'5792-7', '25428-4'}, set(self.codes(look.search('gluc ur'))))
+		self.assertEqual(['2339-0'], self.codes(look.search('whole blood')))
+		self.assertEqual(['25428-4'], self.codes(look.search('urinalysis screen')))
+		
+		# the index is looked up once, not for every search
+		queries = []
+		look.sqlite.handle.set_trace_callback(queries.append)
+		look.search('glucose')
+		look.sqlite.handle.set_trace_callback(None)
+		self.assertEqual([], [q for q in queries if 'sqlite_master' in q])
+	
+	def test_search_ranking(self):
+		""" Matches in names must rank above matches in related names.
+		"""
+		found = self.codes(self.lookup().search('serum'))
+		self.assertEqual({'2345-7', '1000-1', '1000-2'}, set(found[:3]))
+		self.assertEqual(['2339-0'], found[3:])
+	
+	def test_search_filters(self):
+		look = self.lookup()
+		self.assertEqual({'2345-7', '2339-0', '1000-1', '1000-2'}, set(self.codes(look.search('glucose', loinc_class='CHEM'))))
+		self.assertEqual(['25428-4'], self.codes(look.search('glucose', scale='Ord')))
+		self.assertEqual(['2339-0'], self.codes(look.search('glu', system='Bld', loinc_class='CHEM')))
+		everything = self.codes(look.search('glucose'))
+		self.assertEqual(6, len(everything))
+		self.assertEqual(everything[2:4], self.codes(look.search('glucose', limit=2, offset=2)))
+
+
+if '__main__' == __name__:
+	unittest.main()
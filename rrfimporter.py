@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Streaming importer for UMLS and RxNorm RRF files.
+
+import os
+import sys
+import mmap
+import time
+import logging
+import sqlite3
+import multiprocessing
+
+
+# columns and types of the RRF files we know, see
+# http://www.ncbi.nlm.nih.gov/books/NBK9685/ and
+# http://www.nlm.nih.gov/research/umls/rxnorm/docs/rxnormfiles.html
+RRF_SCHEMAS = {
+	# UMLS
+	'MRCONSO': (('CUI', 'TEXT'), ('LAT', 'TEXT'), ('TS', 'TEXT'), ('LUI', 'TEXT'), ('STT', 'TEXT'), ('SUI', 'TEXT'),
+		('ISPREF', 'TEXT'), ('AUI', 'TEXT'), ('SAUI', 'TEXT'), ('SCUI', 'TEXT'), ('SDUI', 'TEXT'), ('SAB', 'TEXT'),
+		('TTY', 'TEXT'), ('CODE', 'TEXT'), ('STR', 'TEXT'), ('SRL', 'INTEGER'), ('SUPPRESS', 'TEXT'), ('CVF', 'INTEGER')),
+	'MRDEF': (('CUI', 'TEXT'), ('AUI', 'TEXT'), ('ATUI', 'TEXT'), ('SATUI', 'TEXT'), ('SAB', 'TEXT'), ('DEF', 'TEXT'),
+		('SUPPRESS', 'TEXT'), ('CVF', 'INTEGER')),
+	'MRSTY': (('CUI', 'TEXT'), ('TUI', 'TEXT'), ('STN', 'TEXT'), ('STY', 'TEXT'), ('ATUI', 'TEXT'), ('CVF', 'INTEGER')),
+	'MRREL': (('CUI1', 'TEXT'), ('AUI1', 'TEXT'), ('STYPE1', 'TEXT'), ('REL', 'TEXT'), ('CUI2', 'TEXT'), ('AUI2', 'TEXT'),
+		('STYPE2', 'TEXT'), ('RELA', 'TEXT'), ('RUI', 'TEXT'), ('SRUI', 'TEXT'), ('SAB', 'TEXT'), ('SL', 'TEXT'),
+		('RG', 'TEXT'), ('DIR', 'TEXT'), ('SUPPRESS', 'TEXT'), ('CVF', 'INTEGER')),
+	'MRHIER': (('CUI', 'TEXT'), ('AUI', 'TEXT'), ('CXN', 'INTEGER'), ('PAUI', 'TEXT'), ('SAB', 'TEXT'), ('RELA', 'TEXT'),
+		('PTR', 'TEXT'), ('HCD', 'TEXT'), ('CVF', 'INTEGER')),
+	
+	# RxNorm
+	'RXNCONSO': (('RXCUI', 'TEXT'), ('LAT', 'TEXT'), ('TS', 'TEXT'), ('LUI', 'TEXT'), ('STT', 'TEXT'), ('SUI', 'TEXT'),
+		('ISPREF', 'TEXT'), ('RXAUI', 'TEXT'), ('SAUI', 'TEXT'), ('SCUI', 'TEXT'), ('SDUI', 'TEXT'), ('SAB', 'TEXT'),
+		('TTY', 'TEXT'), ('CODE', 'TEXT'), ('STR', 'TEXT'), ('SRL', 'INTEGER'), ('SUPPRESS', 'TEXT'), ('CVF', 'INTEGER')),
+	'RXNREL': (('RXCUI1', 'TEXT'), ('RXAUI1', 'TEXT'), ('STYPE1', 'TEXT'), ('REL', 'TEXT'), ('RXCUI2', 'TEXT'),
+		('RXAUI2', 'TEXT'), ('STYPE2', 'TEXT'), ('RELA', 'TEXT'), ('RUI', 'TEXT'), ('SRUI', 'TEXT'), ('SAB', 'TEXT'),
+		('SL', 'TEXT'), ('DIR', 'TEXT'), ('RG', 'TEXT'), ('SUPPRESS', 'TEXT'), ('CVF', 'INTEGER')),
+	'RXNSAT': (('RXCUI', 'TEXT'), ('LUI', 'TEXT'), ('SUI', 'TEXT'), ('RXAUI', 'TEXT'), ('STYPE', 'TEXT'), ('CODE', 'TEXT'),
+		('ATUI', 'TEXT'), ('SATUI', 'TEXT'), ('ATN', 'TEXT'), ('SAB', 'TEXT'), ('ATV', 'TEXT'), ('SUPPRESS', 'TEXT'),
+		('CVF', 'INTEGER')),
+	'RXNSTY': (('RXCUI', 'TEXT'), ('TUI', 'TEXT'), ('STN', 'TEXT'), ('STY', 'TEXT'), ('ATUI', 'TEXT'), ('CVF', 'INTEGER')),
+	'RXNSAB': (('VCUI', 'TEXT'), ('RCUI', 'TEXT'), ('VSAB', 'TEXT'), ('RSAB', 'TEXT'), ('SON', 'TEXT'), ('SF', 'TEXT'),
+		('SVER', 'TEXT'), ('VSTART', 'TEXT'), ('VEND', 'TEXT'), ('IMETA', 'TEXT'), ('RMETA', 'TEXT'), ('SLC', 'TEXT'),
+		('SCC', 'TEXT'), ('SRL', 'INTEGER'), ('TFR', 'INTEGER'), ('CFR', 'INTEGER'), ('CXTY', 'TEXT'), ('TTYL', 'TEXT'),
+		('ATNL', 'TEXT'), ('LAT', 'TEXT'), ('CENC', 'TEXT'), ('CURVER', 'TEXT'), ('SABIN', 'TEXT'), ('SSN', 'TEXT'),
+		('SCIT', 'TEXT')),
+	'RXNDOC': (('DOCKEY', 'TEXT'), ('VALUE', 'TEXT'), ('TYPE', 'TEXT'), ('EXPL', 'TEXT')),
+	'RXNCUICHANGES': (('RXAUI', 'TEXT'), ('CODE', 'TEXT'), ('SAB', 'TEXT'), ('TTY', 'TEXT'), ('STR', 'TEXT'),
+		('OLD_RXCUI', 'TEXT'), ('NEW_RXCUI', 'TEXT')),
+	'RXNCUI': (('cui1', 'TEXT'), ('ver_start', 'TEXT'), ('ver_end', 'TEXT'), ('cardinality', 'INTEGER'), ('cui2', 'TEXT')),
+	'RXNATOMARCHIVE': (('RXAUI', 'TEXT'), ('AUI', 'TEXT'), ('STR', 'TEXT'), ('ARCHIVE_TIMESTAMP', 'TEXT'),
+		('CREATED_TIMESTAMP', 'TEXT'), ('UPDATED_TIMESTAMP', 'TEXT'), ('CODE', 'TEXT'), ('IS_BRAND', 'TEXT'),
+		('LAT', 'TEXT'), ('LAST_RELEASED', 'TEXT'), ('SAUI', 'TEXT'), ('VSAB', 'TEXT'), ('RXCUI', 'TEXT'),
+		('SAB', 'TEXT'), ('TTY', 'TEXT'), ('MERGED_TO_RXCUI', 'TEXT')),
+}
+
+# relaxed durability while loading: a failed import is simply run again
+LOAD_PRAGMAS = (
+	'PRAGMA journal_mode = OFF',
+	'PRAGMA synchronous = OFF',
+	'PRAGMA locking_mode = EXCLUSIVE',
+	'PRAGMA temp_store = MEMORY',
+	'PRAGMA cache_size = -256000',
+)
+
+
+class RRFImporter(object):
+	""" Imports RRF files, the pipe-separated format of UMLS and RxNorm, into
+	SQLite.
+	
+	Files are streamed line by line, optionally memory-mapped, and inserted
+	in chunks into tables typed according to `RRF_SCHEMAS`, so no converted
+	copies of the files are needed. When importing several files with more
+	than one process, every file is loaded into a separate database by its
+	own process; these are then attached to the target database and merged.
+	"""
+	
+	def __init__(self, directory, tables=None, use_mmap=False, chunk_size=50000):
+		""" Prepares to import the RRF files in `directory`.
+		
+		:param tables: The names of the tables to import, e.g. ["MRCONSO"];
+			defaults to every file in `directory` with a known schema
+		:param bool use_mmap: Whether to memory-map files instead of reading
+			them through a buffer
+		"""
+		self.directory = directory
+		self.use_mmap = use_mmap
+		self.chunk_size = chunk_size
+		
+		if tables is None:
+			tables = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.RRF') and name[:-4] in RRF_SCHEMAS)
+		for table in tables:
+			if table not in RRF_SCHEMAS:
+				raise Exception('There is no schema for RRF table "{}"'.format(table))
+			if not os.path.exists(self.filepath_for(table)):
+				raise Exception('The RRF file for "{}" is missing at {}'.format(table, self.filepath_for(table)))
+		self.tables = tables
+	
+	def filepath_for(self, table):
+		return os.path.join(self.directory, '{}.RRF'.format(table))
+	
+	def import_to(self, dbpath, processes=None):
+		""" Imports all our tables into the database at `dbpath`; tables
+		must not exist yet.
+		
+		:param int processes: How many files to load in parallel, defaults
+			to the number of CPUs
+		:returns: A dict with the number of rows imported per table
+		"""
+		assert dbpath
+		processes = min(processes or os.cpu_count() or 1, len(self.tables))
+		if processes < 2:
+			return dict((table, _load_table(self, table, dbpath)) for table in self.tables)
+		
+		# load into one database per table, then merge; parts left over by an
+		# interrupted run are removed first, ours also when loading fails
+		parts = dict((table, '{}.{}.part'.format(dbpath, table)) for table in self.tables)
+		_remove_files(parts.values())
+		try:
+			with multiprocessing.Pool(processes) as pool:
+				counts = pool.starmap(_load_table, [(self, table, parts[table]) for table in self.tables])
+			
+			handle = sqlite3.connect(dbpath)
+			try:
+				for pragma in LOAD_PRAGMAS:
+					handle.execute(pragma)
+				for table in self.tables:
+					start = time.time()
+					handle.execute("ATTACH DATABASE ? AS part", (parts[table],))
+					handle.execute(create_table_sql(table))
+					handle.execute('INSERT INTO main.{0} SELECT * FROM part.{0}'.format(table))
+					handle.commit()
+					handle.execute('DETACH DATABASE part')
+					os.remove(parts[table])
+					logging.info('Merged {} in {:.1f} s'.format(table, time.time() - start))
+			finally:
+				handle.close()
+		finally:
+			_remove_files(parts.values())
+		return dict(zip(self.tables, counts))
+	
+	def rows(self, table):
+		""" Generator yielding the rows of the RRF file for `table` as
+		lists, with empty INTEGER fields as None.
+		"""
+		columns = RRF_SCHEMAS[table]
+		num = len(columns)
+		integers = [i for i, col in enumerate(columns) if 'INTEGER' == col[1]]
+		for i, line in enumerate(self.lines(self.filepath_for(table))):
+			row = line.rstrip('\r\n').split('|')
+			if len(row) < num:
+				raise Exception('Line {} of {} has {} instead of {} fields'.format(i + 1, self.filepath_for(table), len(row), num))
+			del row[num:]				# lines end with a pipe
+			for idx in integers:
+				if '' == row[idx]:
+					row[idx] = None
+			yield row
+	
+	def lines(self, filepath):
+		with open(filepath, 'rb') as handle:
+			if self.use_mmap and os.path.getsize(filepath) > 0:
+				with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+					for line in iter(mapped.readline, b''):
+						yield line.decode('utf-8')
+			else:
+				for line in handle:
+					yield line.decode('utf-8')
+
+
+def create_table_sql(table):
+	""" The CREATE TABLE statement for the RRF table `table`. """
+	columns = ',\n\t'.join('{} {}'.format(name, kind) for name, kind in RRF_SCHEMAS[table])
+	return 'CREATE TABLE {} (\n\t{}\n)'.format(table, columns)
+
+
+def _remove_files(paths):
+	for path in paths:
+		if os.path.exists(path):
+			os.remove(path)
+
+
+def _load_table(importer, table, dbpath):
+	""" Loads one RRF file into a new table in the database at `dbpath`,
+	returns the number of rows. Module-level so it can run in worker
+	processes.
+	"""
+	start = time.time()
+	handle = sqlite3.connect(dbpath)
+	try:
+		for pragma in LOAD_PRAGMAS:
+			handle.execute(pragma)
+		handle.execute(create_table_sql(table))
+		sql = 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(RRF_SCHEMAS[table])))
+		
+		num = 0
+		chunk = []
+		for row in importer.rows(table):
+			chunk.append(row)
+			if len(chunk) >= importer.chunk_size:
+				handle.executemany(sql, chunk)
+				num += len(chunk)
+				chunk = []
+		handle.executemany(sql, chunk)
+		num += len(chunk)
+		handle.commit()
+	finally:
+		handle.close()
+	
+	elapsed = max(time.time() - start, 0.001)
+	logging.info('{} rows imported into {} in {:.1f} s, {:,.0f} rows/s'.format(num, table, elapsed, num / elapsed))
+	return num
+
+
+# running this as a script imports RRF files
+if '__main__' == __name__:
+	logging.basicConfig(level=logging.INFO)
+	args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+	if len(args) < 2:
+		print('Usage: rrfimporter.py [--mmap] [--processes=N] <rrf directory> <database> [TABLE ...]')
+		sys.exit(1)
+	
+	processes = None
+	for arg in sys.argv[1:]:
+		if arg.startswith('--processes='):
+			processes = int(arg.split('=', 1)[1])
+	
+	importer = RRFImporter(args[0], tables=args[2:] or None, use_mmap='--mmap' in sys.argv)
+	importer.import_to(args[1], processes=processes)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	RRF importer testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from rrfimporter import RRFImporter
+
+
+MRCONSO = [
+	'C0002962|ENG|P|L0002962|PF|S0011512|Y|A0027667||||MTH|PN|NOCODE|Angina Pectoris|0|N|256|',
+	'C0002962|ENG|P|L0002962|VO|S1887386|Y|A2881573|||D000787|MSH|MH|D000787|"Angina" Pectoris|0|N||',
+]
+MRSTY = [
+	'C0002962|T184|A2.2.2|Sign or Symptom|AT17659148|256|',
+]
+
+
+class RRFImporterTest(unittest.TestCase):
+	""" Test :class:`RRFImporter`.
+	"""
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		for name, lines in (('MRCONSO', MRCONSO), ('MRSTY', MRSTY), ('MRUNKNOWN', ['a|b|'])):
+			with open(os.path.join(self.tmpdir, name + '.RRF'), 'w', encoding='utf-8') as handle:
+				handle.write('\n'.join(lines) + '\n')
+		self.db_path = os.path.join(self.tmpdir, 'umls.db')
+	
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+	
+	def check_database(self):
+		handle = sqlite3.connect(self.db_path)
+		tables = [r[0] for r in handle.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+		self.assertEqual(['MRCONSO', 'MRSTY'], tables)
+		rows = list(handle.execute('SELECT STR, SRL, CVF, typeof(SRL), typeof(CVF) FROM MRCONSO ORDER BY AUI'))
+		self.assertEqual([('Angina Pectoris', 0, 256, 'integer', 'integer'), ('"Angina" Pectoris', 0, None, 'integer', 'null')], rows)
+		self.assertEqual(('T184', 256), handle.execute('SELECT TUI, CVF FROM MRSTY').fetchone())
+		handle.close()
+		self.assertEqual(['MRCONSO.RRF', 'MRSTY.RRF', 'MRUNKNOWN.RRF', 'umls.db'], sorted(os.listdir(self.tmpdir)))
+	
+	def test_import(self):
+		counts = RRFImporter(self.tmpdir).import_to(self.db_path, processes=1)
+		self.assertEqual({'MRCONSO': 2, 'MRSTY': 1}, counts)
+		self.check_database()
+	
+	def test_parallel_import(self):
+		""" Test loading into separate databases and merging, memory-mapped.
+		"""
+		counts = RRFImporter(self.tmpdir, use_mmap=True).import_to(self.db_path, processes=2)
+		self.assertEqual({'MRCONSO': 2, 'MRSTY': 1}, counts)
+		self.check_database()
+	
+	def test_failed_parallel_import(self):
+		""" Test that part databases are removed when a worker fails, as
+		are stale ones from an interrupted run.
+		"""
+		with open(os.path.join(self.tmpdir, 'MRSTY.RRF'), 'a', encoding='utf-8') as handle:
+			handle.write('C0004096|T047|\n')
+		with open(self.db_path + '.MRCONSO.part', 'w') as handle:
+			handle.write('stale')
+		with self.assertRaises(Exception):
+			RRFImporter(self.tmpdir).import_to(self.db_path, processes=2)
+		self.assertEqual([], [name for name in os.listdir(self.tmpdir) if name.endswith('.part')])
+	
+	def test_unknown_table(self):
+		with self.assertRaises(Exception):
+			RRFImporter(self.tmpdir, tables=['MRUNKNOWN'])
+		with self.assertRaises(Exception):
+			RRFImporter(self.tmpdir, tables=['MRDEF'])
+
+
+if '__main__' == __name__:
+	unittest.main()
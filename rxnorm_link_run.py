@@ -4,13 +4,69 @@
 #	Run this script to perform the RxNorm linking process and store the
 #	documents in a database or flat file.
 
+import io
 import os
 import sys
+import csv
+import json
+import zlib
+import queue
+import hashlib
 import logging
+import threading
 
 from rxnorm_link import runImport
 
 
+class _BackgroundWriter(object):
+	""" Calls `write` for every item `put()` into a bounded queue, on a
+	background thread. `put()` blocks while the queue is full, which gives
+	backpressure instead of unbounded memory growth.
+	
+	An exception raised by `write` stops further writes (remaining items are
+	drained and discarded so producers never block forever) and is re-raised
+	on the producing thread by the next `put()` or by `close()`.
+	"""
+	
+	_stop = object()
+	
+	def __init__(self, write, maxsize=4, name='doc-writer'):
+		self.write = write
+		self.queue = queue.Queue(maxsize=maxsize)
+		self.max_depth = 0
+		self.error = None
+		self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+		self.thread.start()
+	
+	def put(self, item):
+		self.raise_if_failed()
+		self.queue.put(item)
+		self.max_depth = max(self.max_depth, self.queue.qsize())
+	
+	def close(self):
+		""" Waits for all queued items to be written, then stops the thread.
+		"""
+		if self.thread.is_alive():
+			self.queue.put(self._stop)
+			self.thread.join()
+		self.raise_if_failed()
+	
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			if item is self._stop:
+				return
+			if self.error is None:
+				try:
+					self.write(item)
+				except Exception as e:
+					self.error = e
+	
+	def raise_if_failed(self):
+		if self.error is not None:
+			raise self.error
+
+
 class DocHandler(object):
 	""" Superclass for simple database import.
 	"""
@@ -108,101 +164,513 @@ class SQLiteDocHandler(DocHandler):
 
 class MongoDocHandler(DocHandler):
 	""" Handles documents for storage in MongoDB.
+	
+	Documents are collected into batches of `batch_size` and handed to a
+	background thread, which upserts them by rxcui with unordered bulk writes.
+	The linking loop only waits on MongoDB when `queue_size` batches are
+	already pending. Pass `client` to use something other than a
+	`pymongo.MongoClient` configured from the MONGO_* environment variables,
+	for example an in-process `mongomock.MongoClient`, and `replace_one` to
+	build the upsert operations with something other than
+	`pymongo.ReplaceOne`; pymongo is only imported if one of them is missing.
 	"""
 	
-	def __init__(self):
+	def __init__(self, client=None, batch_size=None, queue_size=None, replace_one=None):
 		super().__init__()
-		db_host = os.environ.get('MONGO_HOST')
-		db_host = db_host if db_host else 'localhost'
-		db_port = int(os.environ.get('MONGO_PORT'))
-		db_port = db_port if db_port else 27017
-		db_name = os.environ.get('MONGO_DB')
-		db_name = db_name if db_name else 'default'
-		db_bucket = os.environ.get('MONGO_BUCKET')
-		db_bucket = db_bucket if db_bucket else 'rxnorm'
+		db_name = os.environ.get('MONGO_DB') or 'default'
+		db_bucket = os.environ.get('MONGO_BUCKET') or 'rxnorm'
+		self.batch_size = batch_size or int(os.environ.get('MONGO_BATCH_SIZE') or 1000)
+		queue_size = queue_size or int(os.environ.get('MONGO_QUEUE_SIZE') or 4)
 		
-		import pymongo		# imported here so it's only imported when using Mongo
-		conn = pymongo.MongoClient(host=db_host, port=db_port)
-		db = conn[db_name]
+		if client is None or replace_one is None:
+			import pymongo		# imported here so it's only imported when using Mongo
+			replace_one = replace_one or pymongo.ReplaceOne
+		self._replace_one = replace_one
+		if client is None:
+			db_host = os.environ.get('MONGO_HOST') or 'localhost'
+			db_port = int(os.environ.get('MONGO_PORT') or 27017)
+			
+			# authenticate
+			db_user = os.environ.get('MONGO_USER')
+			db_pass = os.environ.get('MONGO_PASS')
+			if db_user and db_pass:
+				client = pymongo.MongoClient(host=db_host, port=db_port,
+					username=db_user, password=db_pass, authSource=db_name)
+			else:
+				client = pymongo.MongoClient(host=db_host, port=db_port)
 		
-		# authenticate
-		db_user = os.environ.get('MONGO_USER')
-		db_pass = os.environ.get('MONGO_PASS')
-		if db_user and db_pass:
-			db.authenticate(db_user, db_pass)
+		self.mng = client[db_name][db_bucket]
+		self.mng.create_index('rxcui', unique=True)
+		self.mng.create_index('ndc')
+		self.mng.create_index([('label', 'text')])		# pymongo.TEXT
 		
-		self.mng = db[db_bucket]
-		self.mng.ensure_index('ndc')
-		self.mng.ensure_index('label', text=pymongo.TEXT)
+		self.writer = _BackgroundWriter(self._write, maxsize=queue_size, name='mongo-writer')
 	
 	def addDocument(self, doc):
+		if doc is None:
+			return
 		lbl = doc.get('label')
 		if lbl and len(lbl) > 1010:			# indexed, cannot be > 1024 in total
 			doc['fullLabel'] = lbl
 			doc['label'] = lbl[:1010]
 		
 		super().addDocument(doc)
-		if len(self.documents) > 50:
-			self._insertAndClear()
+		if len(self.documents) >= self.batch_size:
+			self._flush()
 	
 	def finalize(self):
-		self._insertAndClear()
+		try:
+			self._flush()
+		finally:
+			self.writer.close()
 	
-	def _insertAndClear(self):
+	def _flush(self):
+		""" Hands the current batch to the writer thread; the writer owns the
+		list from now on, so we start a new one instead of clearing it.
+		"""
 		if len(self.documents) > 0:
-			self.mng.insert(self.documents)
-			self.documents.clear()
+			self.writer.put(self.documents)
+			self.documents = []
+	
+	def _write(self, documents):
+		ops = [self._replace_one({'rxcui': doc.get('rxcui')}, doc, upsert=True) for doc in documents]
+		self.mng.bulk_write(ops, ordered=False)
 	
 	def __str__(self):
-		return "MongoDB at {}".format(self.mng)
+		return "MongoDB at {}".format(self.mng.full_name)
 
 
 class CSVHandler(DocHandler):
-	""" Handles CSV export. """
+	""" Handles CSV export.
 	
-	def __init__(self):
+	Rows are written with the `csv` module through a large write buffer,
+	list-valued properties are joined with ";". The output file, the columns
+	and the compression can be passed in or set via CSV_FILE, CSV_COLUMNS
+	(comma-separated column names) and CSV_COMPRESSION ("gzip" or "zstd",
+	inferred from a ".gz" or ".zst" file suffix if not given).
+	"""
+	
+	# column name and document property, in default output order
+	columns = (
+		('rxcui', 'rxcui'),
+		('tty', 'tty'),
+		('ndc', 'ndc'),
+		('name', 'label'),
+		('va_classes', 'drugClasses'),
+		('treating', 'treatmentIntents'),
+		('ingredients', 'ingredients'),
+		('generics', 'generics'),
+		('components', 'components'),
+		('mechanisms', 'mechanisms'),
+	)
+	
+	def __init__(self, csv_file=None, columns=None, compression=None, buffer_size=None):
 		super().__init__()
-		self.csv_file = 'rxnorm.csv'
-		self.csv_handle = open(self.csv_file, 'w')
-		self.csv_handle.write("rxcui,tty,ndc,name,va_classes,treating,ingredients\n")
+		self.csv_file = csv_file or os.environ.get('CSV_FILE') or 'rxnorm.csv'
+		
+		known = dict(self.__class__.columns)
+		columns = columns or os.environ.get('CSV_COLUMNS')
+		if isinstance(columns, str):
+			columns = [c.strip() for c in columns.split(',') if c.strip()]
+		columns = columns or [c for c, _ in self.__class__.columns]
+		unknown = [c for c in columns if c not in known]
+		if len(unknown) > 0:
+			raise Exception('Unsupported CSV column(s): {}'.format(', '.join(unknown)))
+		self.properties = [known[c] for c in columns]
+		
+		compression = compression or os.environ.get('CSV_COMPRESSION')
+		buffer_size = buffer_size or int(os.environ.get('CSV_BUFFER_SIZE') or 1024 * 1024)
+		self.csv_handle = _open_output(self.csv_file, compression, buffer_size)
+		self.writer = csv.writer(self.csv_handle)
+		self.writer.writerow(columns)
 	
 	def addDocument(self, doc):
-		self.csv_handle.write('{},"{}","{}","{}","{}","{}","{}"{}'.format(
-			doc.get('rxcui', '0'),
-			doc.get('tty', ''),
-			doc.get('ndc', ''),
-			doc.get('label', ''),
-			';'.join(doc.get('drugClasses') or []),
-			';'.join(doc.get('treatmentIntents') or []),
-			';'.join(doc.get('ingredients') or []),
-			"\n"
-		))
+		if doc is None:
+			return
+		row = []
+		for prop in self.properties:
+			val = doc.get(prop)
+			if val is None:
+				val = ''
+			elif isinstance(val, (list, tuple, set)):
+				val = ';'.join(str(v) for v in val)
+			row.append(val)
+		self.writer.writerow(row)
+	
+	def finalize(self):
+		self.csv_handle.close()
 	
 	def __str__(self):
 		return 'CSV file "{}"'.format(self.csv_file)
 
 
+def _open_output(path, compression=None, buffer_size=1024 * 1024):
+	""" Opens `path` for writing text, optionally streaming through gzip or
+	zstd compression. If `compression` is None it is inferred from the
+	".gz" or ".zst" suffix.
+	
+	:returns: A text file handle; closing it flushes the compressor and
+		closes the file
+	"""
+	if compression is None:
+		if path.endswith('.gz'):
+			compression = 'gzip'
+		elif path.endswith('.zst'):
+			compression = 'zstd'
+	
+	if not compression or 'none' == compression:
+		return open(path, 'w', encoding='utf-8', newline='', buffering=buffer_size)
+	
+	if 'gzip' == compression:
+		import gzip
+		stream = gzip.open(path, 'wb', compresslevel=6)
+	elif 'zstd' == compression:
+		import zstandard		# imported here so it's only needed when using zstd
+		stream = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+	else:
+		raise Exception('Unsupported compression: {}'.format(compression))
+	
+	buffered = io.BufferedWriter(stream, buffer_size=buffer_size)
+	return io.TextIOWrapper(buffered, encoding='utf-8', newline='')
+
+
+class ArrowDocHandler(DocHandler):
+	""" Writes documents to a columnar Parquet or Arrow IPC file.
+	
+	Documents are buffered and written as one row group (Parquet) or record
+	batch (Arrow) per `row_group_size` documents. List-valued properties
+	become native list columns; TTYs, drug classes, treatment intents and
+	mechanisms are dictionary-encoded. The Arrow IPC format is chosen for
+	".arrow", ".feather" and ".ipc" suffixes, Parquet otherwise. Needs
+	`pyarrow`; use :meth:`read_table` to load the result memory-mapped.
+	"""
+	
+	# document property, whether it's a list, whether to dictionary-encode
+	fields = (
+		('rxcui', False, False),
+		('tty', False, True),
+		('label', False, False),
+		('ndc', True, False),
+		('ingredients', True, False),
+		('treatmentIntents', True, True),
+		('drugClasses', True, True),
+		('generics', True, False),
+		('components', True, False),
+		('mechanisms', True, True),
+	)
+	
+	arrow_suffixes = ('.arrow', '.feather', '.ipc')
+	
+	def __init__(self, path=None, row_group_size=None, compression=None):
+		super().__init__()
+		import pyarrow			# imported here so it's only imported when exporting to Arrow
+		self.pa = pyarrow
+		self.path = path or os.environ.get('ARROW_FILE') or 'rxnorm.parquet'
+		self.row_group_size = row_group_size or int(os.environ.get('ARROW_ROW_GROUP_SIZE') or 65536)
+		self.is_ipc = self.path.endswith(self.__class__.arrow_suffixes)
+		
+		# dictionaries only ever grow, so Arrow IPC can write them as deltas
+		self.dictionaries = {}
+		columns = []
+		for name, is_list, is_dict in self.__class__.fields:
+			typ = pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if is_dict else pyarrow.string()
+			if is_dict:
+				self.dictionaries[name] = ({}, [])
+			columns.append(pyarrow.field(name, pyarrow.list_(typ) if is_list else typ))
+		self.schema = pyarrow.schema(columns)
+		
+		if self.is_ipc:
+			options = pyarrow.ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True)		# uncompressed by default, for zero-copy reads
+			self.writer = pyarrow.ipc.new_file(self.path, self.schema, options=options)
+		else:
+			import pyarrow.parquet
+			self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=compression or 'zstd')
+	
+	def addDocument(self, doc):
+		super().addDocument(doc)
+		if len(self.documents) >= self.row_group_size:
+			self._write_batch()
+	
+	def finalize(self):
+		self._write_batch()
+		self.writer.close()
+	
+	def _write_batch(self):
+		if 0 == len(self.documents):
+			return
+		pa = self.pa
+		arrays = []
+		for name, is_list, is_dict in self.__class__.fields:
+			if is_list:
+				offsets = [0]
+				flat = []
+				for doc in self.documents:
+					flat.extend(str(v) for v in doc.get(name) or [])
+					offsets.append(len(flat))
+				values = self._dictionary_array(name, flat) if is_dict else pa.array(flat, pa.string())
+				arrays.append(pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), values))
+			else:
+				vals = [None if doc.get(name) is None else str(doc.get(name)) for doc in self.documents]
+				arrays.append(self._dictionary_array(name, vals) if is_dict else pa.array(vals, pa.string()))
+		
+		batch = pa.record_batch(arrays, schema=self.schema)
+		if self.is_ipc:
+			self.writer.write_batch(batch)
+		else:
+			self.writer.write_batch(batch, row_group_size=len(self.documents))
+		self.documents = []
+	
+	def _dictionary_array(self, name, values):
+		lookup, dictionary = self.dictionaries[name]
+		indices = []
+		for val in values:
+			if val is None:
+				indices.append(None)
+				continue
+			idx = lookup.get(val)
+			if idx is None:
+				idx = lookup[val] = len(dictionary)
+				dictionary.append(val)
+			indices.append(idx)
+		pa = self.pa
+		return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(dictionary, pa.string()))
+	
+	@classmethod
+	def read_table(cls, path):
+		""" Loads a file written by this handler into a `pyarrow.Table`.
+		
+		Arrow IPC files are memory-mapped and read zero-copy, unless they were
+		written with `compression`. Parquet files are memory-mapped but need
+		decoding; dictionary-encoded columns are read back as dictionaries.
+		"""
+		import pyarrow
+		if path.endswith(cls.arrow_suffixes):
+			return pyarrow.ipc.open_file(pyarrow.memory_map(path)).read_all()
+		
+		import pyarrow.parquet
+		return pyarrow.parquet.read_table(path, memory_map=True)
+	
+	def __str__(self):
+		return '{} file "{}"'.format('Arrow' if self.is_ipc else 'Parquet', self.path)
+
+
+class NDJSONShardHandler(DocHandler):
+	""" Writes documents as newline-delimited JSON into `num_shards` files,
+	assigning each document to a shard by a stable hash of its rxcui.
+	
+	Every shard has its own writer thread fed through a bounded queue, so
+	serialization, compression and disk writes run concurrently with linking
+	and with each other. On `finalize()` a "manifest.json" listing each
+	shard's document count, byte size and SHA-256 is written next to them.
+	Configure via arguments or NDJSON_DIR, NDJSON_SHARDS, NDJSON_COMPRESSION
+	("gzip" or "zstd") and NDJSON_BATCH_SIZE.
+	"""
+	
+	def __init__(self, directory=None, num_shards=None, compression=None, batch_size=None, queue_size=4):
+		super().__init__()
+		self.directory = directory or os.environ.get('NDJSON_DIR') or 'rxnorm-ndjson'
+		self.num_shards = num_shards or int(os.environ.get('NDJSON_SHARDS') or 8)
+		self.compression = compression or os.environ.get('NDJSON_COMPRESSION') or None
+		self.batch_size = batch_size or int(os.environ.get('NDJSON_BATCH_SIZE') or 500)
+		suffix = {None: '', 'none': '', 'gzip': '.gz', 'zstd': '.zst'}.get(self.compression)
+		if suffix is None:
+			raise Exception('Unsupported compression: {}'.format(self.compression))
+		
+		os.makedirs(self.directory, exist_ok=True)
+		self.shards = []
+		for i in range(self.num_shards):
+			filename = 'rxnorm-{:03d}-of-{:03d}.ndjson{}'.format(i, self.num_shards, suffix)
+			shard = {
+				'file': filename,
+				'count': 0,
+				'handle': _open_output(os.path.join(self.directory, filename), self.compression or 'none'),
+				'pending': [],
+			}
+			write = lambda docs, shard=shard: self._write(shard, docs)
+			shard['writer'] = _BackgroundWriter(write, maxsize=queue_size, name='ndjson-writer-{}'.format(i))
+			self.shards.append(shard)
+	
+	def shard_for(self, rxcui):
+		""" The shard index for the given rxcui, stable across runs and
+		Python processes (unlike `hash()`).
+		"""
+		return zlib.crc32(str(rxcui).encode('utf-8')) % self.num_shards
+	
+	def addDocument(self, doc):
+		if doc is None:
+			return
+		shard = self.shards[self.shard_for(doc.get('rxcui', '0'))]
+		shard['pending'].append(doc)
+		if len(shard['pending']) >= self.batch_size:
+			shard['writer'].put(shard['pending'])
+			shard['pending'] = []
+	
+	def finalize(self):
+		""" Flushes and closes every shard, even if some of them failed, and
+		writes the manifest; re-raises the first writer error instead.
+		"""
+		error = None
+		for shard in self.shards:
+			try:
+				if len(shard['pending']) > 0:
+					shard['writer'].put(shard['pending'])
+					shard['pending'] = []
+				shard['writer'].put(None)		# closes the file and checksums it on the writer thread
+			except Exception as e:
+				error = error or e
+		for shard in self.shards:
+			try:
+				shard['writer'].close()
+			except Exception as e:
+				error = error or e
+			finally:
+				if not shard['handle'].closed:		# the writer failed before it got to close it
+					try:
+						shard['handle'].close()
+					except Exception as e:
+						error = error or e
+		if error is not None:
+			raise error
+		
+		manifest = {
+			'compression': self.compression,
+			'count': sum(s['count'] for s in self.shards),
+			'shards': [{k: s[k] for k in ('file', 'count', 'bytes', 'sha256')} for s in self.shards],
+		}
+		with open(os.path.join(self.directory, 'manifest.json'), 'w') as handle:
+			json.dump(manifest, handle, indent=2)
+	
+	def _write(self, shard, docs):
+		if docs is None:
+			shard['handle'].close()
+			shard['bytes'], shard['sha256'] = _file_digest(os.path.join(self.directory, shard['file']))
+			return
+		handle = shard['handle']
+		for doc in docs:
+			handle.write(json.dumps(doc, separators=(',', ':')))
+			handle.write('\n')
+		shard['count'] += len(docs)
+	
+	def __str__(self):
+		return 'NDJSON in {} shards at "{}"'.format(self.num_shards, self.directory)
+
+
+def _file_digest(path, chunk_size=1024 * 1024):
+	""" Returns a tuple with the size in bytes and the SHA-256 hex digest of
+	the file at `path`.
+	"""
+	sha = hashlib.sha256()
+	size = 0
+	with open(path, 'rb') as handle:
+		for chunk in iter(lambda: handle.read(chunk_size), b''):
+			sha.update(chunk)
+			size += len(chunk)
+	return size, sha.hexdigest()
+
+
+class WriteBehindDocHandler(DocHandler):
+	""" Wraps another handler and runs its `addDocument()` and `finalize()`
+	on a background thread, fed through a queue of at most `queue_size`
+	documents. `addDocument()` only blocks while that queue is full, so
+	computing documents and writing them overlap. Errors raised by the
+	wrapped handler are re-raised by the next `addDocument()` or by
+	`finalize()`, which waits for the queue to drain.
+	
+	Handlers holding thread-bound resources, like the sqlite3 connection of
+	:class:`SQLiteDocHandler`, must be passed as a class or other factory so
+	they are created on the writer thread.
+	"""
+	
+	def __init__(self, handler, queue_size=None):
+		super().__init__()
+		queue_size = queue_size or int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE') or 10000)
+		self.handler = handler if isinstance(handler, DocHandler) else None
+		self.writer = _BackgroundWriter(self._perform, maxsize=queue_size, name='write-behind')
+		
+		# create on the writer thread, but wait so errors surface right here
+		if self.handler is None:
+			created = threading.Event()
+			self.writer.put(('create', (handler, created)))
+			created.wait()
+			self.writer.raise_if_failed()
+	
+	@property
+	def queue_depth(self):
+		""" The number of documents currently waiting to be written. """
+		return self.writer.queue.qsize()
+	
+	@property
+	def max_queue_depth(self):
+		""" The highest queue depth seen so far; if this is close to the
+		queue size, the wrapped handler is the bottleneck.
+		"""
+		return self.writer.max_depth
+	
+	def addDocument(self, doc):
+		if doc is not None:
+			self.writer.put(('add', doc))
+	
+	def finalize(self):
+		try:
+			self.writer.put(('finalize', None))
+		finally:
+			self.writer.close()
+		logging.debug('Write-behind queue peaked at {} of {} documents'
+			.format(self.max_queue_depth, self.writer.queue.maxsize))
+	
+	def _perform(self, item):
+		action, arg = item
+		if 'add' == action:
+			self.handler.addDocument(arg)
+		elif 'finalize' == action:
+			self.handler.finalize()
+		elif 'create' == action:
+			factory, created = arg
+			try:
+				self.handler = factory()
+			finally:
+				created.set()
+	
+	def __str__(self):
+		return '{} (write-behind)'.format(self.handler)
+
+
 def runLinking(ex_type):
 	""" Create the desired handler and run import.
+	
+	Set the WRITE_BEHIND environment variable to wrap the handler in a
+	:class:`WriteBehindDocHandler`.
 	"""
-	handler = DebugDocHandler()
+	factory = DebugDocHandler
 	if ex_type is not None and len(ex_type) > 0:
-		try:
-			if 'mongo' == ex_type:
-				handler = MongoDocHandler()
-			elif 'couch' == ex_type:
-				# import couchbase
-				raise Exception('Couchbase not implemented')
-			elif 'csv' == ex_type:
-				handler = CSVHandler()
-			elif 'sqlite' == ex_type:
-				handler = SQLiteDocHandler()
-			else:
-				raise Exception('Unsupported export type: {}'.format(ex_type))
-		except Exception as e:
-			logging.error(e)
+		if 'mongo' == ex_type:
+			factory = MongoDocHandler
+		elif 'couch' == ex_type:
+			# import couchbase
+			logging.error('Couchbase not implemented')
+			sys.exit(1)
+		elif 'csv' == ex_type:
+			factory = CSVHandler
+		elif 'sqlite' == ex_type:
+			factory = SQLiteDocHandler
+		elif ex_type in ('parquet', 'arrow'):
+			default = 'rxnorm.arrow' if 'arrow' == ex_type else 'rxnorm.parquet'
+			factory = lambda: ArrowDocHandler(os.environ.get('ARROW_FILE') or default)
+		elif 'ndjson' == ex_type:
+			factory = NDJSONShardHandler
+		else:
+			logging.error('Unsupported export type: {}'.format(ex_type))
 			sys.exit(1)
 	
+	try:
+		if os.environ.get('WRITE_BEHIND', '0') not in ('', '0'):
+			handler = WriteBehindDocHandler(factory)
+		else:
+			handler = factory()
+	except Exception as e:
+		logging.error(e)
+		sys.exit(1)
+	
 	print('->  Processing to {}'.format(handler))
 	runImport(doc_handler=handler)
 
@@ -2,10 +2,15 @@
 
 # to make it simple we include the variables here instead of creating yet another file
 
-# export type, supported are: "csv", "mongo", "sqlite"
+# export type, supported are: "csv", "mongo", "sqlite", "parquet", "arrow",
+# "ndjson"
 # if run without setting a type will simply print to console
 export EXPORT_TYPE=
 
+# set to 1 to write documents on a background thread while linking continues
+export WRITE_BEHIND=
+export WRITE_BEHIND_QUEUE_SIZE=10000
+
 # MongoDB parameters
 export MONGO_HOST='localhost'
 export MONGO_PORT=27017
@@ -13,6 +18,22 @@ export MONGO_USER=
 export MONGO_PASS=
 export MONGO_DB=
 export MONGO_BUCKET='rxnorm'
+export MONGO_BATCH_SIZE=1000
+export MONGO_QUEUE_SIZE=4
+
+# CSV parameters; compression is "gzip", "zstd" or inferred from the suffix
+export CSV_FILE='rxnorm.csv'
+export CSV_COLUMNS=
+export CSV_COMPRESSION=
+
+# Parquet/Arrow parameters; ".arrow" files are written in Arrow IPC format
+export ARROW_FILE=
+export ARROW_ROW_GROUP_SIZE=65536
+
+# sharded NDJSON parameters; compression is "gzip" or "zstd"
+export NDJSON_DIR='rxnorm-ndjson'
+export NDJSON_SHARDS=8
+export NDJSON_COMPRESSION=
 
 # SQLite parameters
 export SQLITE_FILE='databases/rxnorm.db'
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	RxNorm linking document handler testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import csv
+import gzip
+import json
+import hashlib
+import tempfile
+import threading
+import unittest
+import importlib.util
+from rxnorm_link_run import *
+
+
+class FakeReplaceOne(object):
+	""" Records the arguments of a `pymongo.ReplaceOne` operation.
+	"""
+	def __init__(self, filter, replacement, upsert=False):
+		self.filter = filter
+		self.replacement = replacement
+		self.upsert = upsert
+
+
+class FakeCollection(object):
+	""" Minimal in-process stand-in for a MongoDB collection, keyed by rxcui.
+	"""
+	def __init__(self):
+		self.docs = {}
+		self.bulk_calls = 0
+		self.full_name = 'fake.rxnorm'
+	
+	def create_index(self, *args, **kwargs):
+		pass
+	
+	def bulk_write(self, ops, ordered=True):
+		self.bulk_calls += 1
+		for op in ops:
+			assert op.upsert
+			self.docs[op.filter['rxcui']] = op.replacement
+
+
+def fake_client(collection):
+	""" A client stand-in is anything that can be subscripted with the
+	database and then the collection name.
+	"""
+	return {'default': {'rxnorm': collection}}
+
+
+class MongoDocHandlerTest(unittest.TestCase):
+	""" Test :class:`MongoDocHandler`.
+	"""
+	def test_batched_upserts(self):
+		""" Test that documents arrive batched and are upserted by rxcui.
+		"""
+		coll = FakeCollection()
+		handler = MongoDocHandler(client=fake_client(coll), batch_size=3, replace_one=FakeReplaceOne)
+		for i in range(7):
+			handler.addDocument({'rxcui': str(i), 'label': 'Drug {}'.format(i)})
+		handler.addDocument({'rxcui': '1', 'label': 'Drug 1, again'})
+		handler.finalize()
+		
+		self.assertEqual(3, coll.bulk_calls)
+		self.assertEqual(7, len(coll.docs))
+		self.assertEqual('Drug 1, again', coll.docs['1']['label'])
+	
+	def test_write_errors_propagate(self):
+		""" Test that writer thread errors surface in `finalize()`.
+		"""
+		class FailingCollection(FakeCollection):
+			def bulk_write(self, ops, ordered=True):
+				raise IOError('connection lost')
+		
+		handler = MongoDocHandler(client=fake_client(FailingCollection()), batch_size=2, replace_one=FakeReplaceOne)
+		handler.addDocument({'rxcui': '1'})
+		handler.addDocument({'rxcui': '2'})
+		with self.assertRaises(IOError):
+			handler.finalize()
+
+
+
+class CSVHandlerTest(unittest.TestCase):
+	""" Test :class:`CSVHandler`.
+	"""
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+	
+	def tearDown(self):
+		self.tmpdir.cleanup()
+	
+	def test_quoting_and_lists(self):
+		""" Test that embedded quotes survive and lists are joined.
+		"""
+		path = os.path.join(self.tmpdir.name, 'rxnorm.csv')
+		handler = CSVHandler(path, columns=['rxcui', 'name', 'ndc', 'generics'])
+		handler.addDocument({'rxcui': '1', 'label': 'Aspirin "Bayer", 81 MG', 'ndc': ['00001', '00002'], 'generics': ['7']})
+		handler.addDocument({'rxcui': '2', 'label': 'Plain'})
+		handler.finalize()
+		
+		with open(path, newline='') as handle:
+			rows = list(csv.reader(handle))
+		self.assertEqual(['rxcui', 'name', 'ndc', 'generics'], rows[0])
+		self.assertEqual(['1', 'Aspirin "Bayer", 81 MG', '00001;00002', '7'], rows[1])
+		self.assertEqual(['2', 'Plain', '', ''], rows[2])
+	
+	def test_gzip(self):
+		""" Test compression inferred from the file suffix.
+		"""
+		path = os.path.join(self.tmpdir.name, 'rxnorm.csv.gz')
+		handler = CSVHandler(path, columns='rxcui,mechanisms')
+		handler.addDocument({'rxcui': '1', 'mechanisms': ['COX Inhibitors']})
+		handler.finalize()
+		
+		with gzip.open(path, 'rt', newline='') as handle:
+			rows = list(csv.reader(handle))
+		self.assertEqual([['rxcui', 'mechanisms'], ['1', 'COX Inhibitors']], rows)
+	
+	def test_unknown_column(self):
+		path = os.path.join(self.tmpdir.name, 'rxnorm.csv')
+		with self.assertRaises(Exception):
+			CSVHandler(path, columns=['rxcui', 'nonsense'])
+
+
+
+class NDJSONShardHandlerTest(unittest.TestCase):
+	""" Test :class:`NDJSONShardHandler`.
+	"""
+	def test_shards_and_manifest(self):
+		""" Test that all documents land in their shard and the manifest adds up.
+		"""
+		with tempfile.TemporaryDirectory() as tmpdir:
+			handler = NDJSONShardHandler(tmpdir, num_shards=3, compression='gzip', batch_size=4)
+			for i in range(50):
+				handler.addDocument({'rxcui': str(i), 'label': 'Drug {}'.format(i)})
+			handler.finalize()
+			
+			with open(os.path.join(tmpdir, 'manifest.json')) as handle:
+				manifest = json.load(handle)
+			self.assertEqual(50, manifest['count'])
+			self.assertEqual(3, len(manifest['shards']))
+			
+			seen = set()
+			for i, shard in enumerate(manifest['shards']):
+				path = os.path.join(tmpdir, shard['file'])
+				with open(path, 'rb') as handle:
+					self.assertEqual(shard['sha256'], hashlib.sha256(handle.read()).hexdigest())
+				with gzip.open(path, 'rt') as handle:
+					docs = [json.loads(line) for line in handle]
+				self.assertEqual(shard['count'], len(docs))
+				for doc in docs:
+					self.assertEqual(i, handler.shard_for(doc['rxcui']))
+					seen.add(doc['rxcui'])
+			self.assertEqual(50, len(seen))
+	
+	def test_write_errors_propagate(self):
+		""" Test that a failing shard surfaces in `finalize()` and that all
+		other shards are still closed intact, without a manifest.
+		"""
+		with tempfile.TemporaryDirectory() as tmpdir:
+			handler = NDJSONShardHandler(tmpdir, num_shards=3, compression='gzip', batch_size=2)
+			for i in range(30):
+				handler.addDocument({'rxcui': str(i), 'label': 'Drug {}'.format(i)})
+			handler.addDocument({'rxcui': '0', 'label': object()})		# cannot be serialized
+			with self.assertRaises(TypeError):
+				handler.finalize()
+			
+			failed = handler.shard_for('0')
+			self.assertFalse(os.path.exists(os.path.join(tmpdir, 'manifest.json')))
+			for i, shard in enumerate(handler.shards):
+				self.assertTrue(shard['handle'].closed)
+				self.assertFalse(shard['writer'].thread.is_alive())
+				if i != failed:
+					with gzip.open(os.path.join(tmpdir, shard['file']), 'rt') as handle:
+						self.assertEqual(shard['count'], len(handle.readlines()))
+
+
+class RecordingDocHandler(DocHandler):
+	""" Remembers documents and the thread it was created and called on.
+	"""
+	def __init__(self, fail_on=None):
+		super().__init__()
+		self.created_on = threading.current_thread()
+		self.threads = set()
+		self.fail_on = fail_on
+		self.finalized = False
+	
+	def addDocument(self, doc):
+		self.threads.add(threading.current_thread())
+		if self.fail_on is not None and doc.get('rxcui') == self.fail_on:
+			raise ValueError('cannot write {}'.format(self.fail_on))
+		super().addDocument(doc)
+	
+	def finalize(self):
+		self.finalized = True
+
+
+class WriteBehindDocHandlerTest(unittest.TestCase):
+	""" Test :class:`WriteBehindDocHandler`.
+	"""
+	def test_writes_in_order_on_background_thread(self):
+		inner = RecordingDocHandler()
+		handler = WriteBehindDocHandler(inner, queue_size=2)
+		for i in range(20):
+			handler.addDocument({'rxcui': str(i)})
+		handler.finalize()
+		
+		self.assertEqual([str(i) for i in range(20)], [d['rxcui'] for d in inner.documents])
+		self.assertTrue(inner.finalized)
+		self.assertNotIn(threading.current_thread(), inner.threads)
+		self.assertEqual(0, handler.queue_depth)
+		self.assertLessEqual(handler.max_queue_depth, 2)
+	
+	def test_factory_runs_on_writer_thread(self):
+		handler = WriteBehindDocHandler(RecordingDocHandler)
+		handler.addDocument({'rxcui': '1'})
+		handler.finalize()
+		self.assertIn(handler.handler.created_on, handler.handler.threads)
+	
+	def test_errors_propagate(self):
+		handler = WriteBehindDocHandler(RecordingDocHandler(fail_on='3'))
+		for i in range(5):
+			handler.addDocument({'rxcui': str(i)})
+		with self.assertRaises(ValueError):
+			handler.finalize()
+
+
+@unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class ArrowDocHandlerTest(unittest.TestCase):
+	""" Test :class:`ArrowDocHandler`.
+	"""
+	def test_roundtrip(self):
+		""" Test Parquet and Arrow IPC round trips over several row groups.
+		"""
+		docs = [
+			{'rxcui': '1', 'tty': 'SCD', 'label': 'One', 'ndc': ['00001', '00002'], 'drugClasses': ['[CN103] OPIOID ANALGESICS']},
+			{'rxcui': '2', 'tty': 'IN', 'label': 'Two'},
+			{'rxcui': '3', 'tty': 'SCD', 'label': 'Three', 'drugClasses': ['[CN103] OPIOID ANALGESICS', '[CN900] OTHER']},
+		]
+		with tempfile.TemporaryDirectory() as tmpdir:
+			for filename in ('rxnorm.parquet', 'rxnorm.arrow'):
+				path = os.path.join(tmpdir, filename)
+				handler = ArrowDocHandler(path, row_group_size=2)
+				for doc in docs:
+					handler.addDocument(dict(doc))
+				handler.finalize()
+				
+				rows = ArrowDocHandler.read_table(path).to_pylist()
+				self.assertEqual(['1', '2', '3'], [r['rxcui'] for r in rows])
+				self.assertEqual(['00001', '00002'], rows[0]['ndc'])
+				self.assertEqual([], rows[1]['drugClasses'])
+				self.assertEqual(docs[2]['drugClasses'], rows[2]['drugClasses'])
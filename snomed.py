@@ -6,11 +6,16 @@
 #	2014-01-20	Created by Pascal Pfiffner
 #
 
+import re
 import sys
 import os
-import csv
+import time
+import bisect
 import logging
+import weakref
+import contextlib
 
+from array import array
 from sqlite import SQLite			# for py-umls standalone
 
 
@@ -22,6 +27,12 @@ class SNOMED(object):
 	"""
 	sqlite_handle = None
 	
+	# names for the relationship types we look up, stored in `rel_text`
+	rel_texts = {
+		116680003: 'isa',
+		363698007: 'finding_site',
+	}
+	
 	@classmethod
 	def database_path(cls):
 		absolute = os.path.dirname(os.path.realpath(__file__))
@@ -41,15 +52,42 @@ class SNOMED(object):
 				.format(os.path.abspath(snomed_db)))
 	
 	@classmethod
-	def find_needed_files(cls, snomed_dir):
+	def check_delta_support(cls):
+		""" Raises if the database was imported before Delta releases could
+		be applied, i.e. lacks the description ids and effective times that
+		Delta rows are matched and ordered by.
+		"""
+		if cls.sqlite_handle is None:
+			cls.sqlite_handle = SQLite.get(cls.database_path())
+		needed = (('descriptions', ('description_id', 'effective_time')), ('relationships', ('effective_time',)))
+		for table, columns in needed:
+			existing = set(row[1] for row in cls.sqlite_handle.execute('PRAGMA table_info({})'.format(table)))
+			missing = [column for column in columns if column not in existing]
+			if len(existing) > 0 and len(missing) > 0:
+				raise Exception("The SNOMED {} table at {} lacks {}, which Delta releases need. Import a Snapshot or Full release into a new database with `snomed.py` first."
+					.format(table, os.path.abspath(cls.sqlite_handle.database), ', '.join(missing)))
+	
+	@classmethod
+	def find_needed_files(cls, snomed_dir, release=None):
+		""" Locates the RF2 description and relationship files.
+		
+		:param str release: "Snapshot" (only the current version of every
+			row) or "Full" (every historical version); by default Snapshot
+			files are used if present
+		:returns: A dict mapping table name to file path
+		"""
+		if release is None:
+			try:
+				return cls.find_needed_files(snomed_dir, 'Snapshot')
+			except Exception:
+				return cls.find_needed_files(snomed_dir, 'Full')
 		
 		# table to file mapping
 		prefixes = {
-			'descriptions': 'sct2_Description_Full-en_',
-			'relationships': 'sct2_Relationship_Full_'
+			'descriptions': 'sct2_Description_{}-en_'.format(release),
+			'relationships': 'sct2_Relationship_{}_'.format(release)
 		}
 		found = {}
-		snomed_dir = sys.argv[1]
 		
 		# try to find the files
 		for table, prefix in prefixes.items():
@@ -61,52 +99,105 @@ class SNOMED(object):
 		return found
 	
 	@classmethod
-	def import_from_files(cls, rx_map):
-		for table, filepath in rx_map.items():
-			num_query = 'SELECT COUNT(*) FROM {}'.format(table)
-			num_existing = cls.sqlite_handle.executeOne(num_query, ())[0]
-			if num_existing > 0:
-				continue
+	def import_from_files(cls, rx_map, active_only=False, delta=False):
+		""" Imports the files found by `find_needed_files`, keeping only the
+		latest version (by effectiveTime) of every row, so Full and Snapshot
+		files result in the same database.
+		
+		:param bool active_only: If True, rows whose latest version is
+			inactive are dropped, which makes for a considerably smaller
+			database
+		:param bool delta: If True, the files are RF2 Delta files that are
+			applied on top of the existing tables, see `did_import_delta`;
+			otherwise tables that already have rows are skipped
+		"""
+		if delta:
+			cls.check_delta_support()
+		
+		# import descriptions first, the isa closure follows relationships
+		for table in sorted(rx_map.keys()):
+			if not delta:
+				num_query = 'SELECT COUNT(*) FROM {}'.format(table)
+				num_existing = cls.sqlite_handle.executeOne(num_query, ())[0]
+				if num_existing > 0:
+					continue
 			
-			cls.import_csv_into_table(filepath, table)
+			cls.import_csv_into_table(rx_map[table], table, active_only=active_only, delta=delta)
 	
 	@classmethod
-	def import_csv_into_table(cls, snomed_file, table_name):
+	def import_csv_into_table(cls, snomed_file, table_name, chunk_size=50000, active_only=False, delta=False):
 		""" Import SNOMED CSV into our SQLite database.
-		The SNOMED CSV files can be parsed by Python's CSV parser with the
-		"excel-tab" flavor.
-		"""
+		The SNOMED RF2 files are tab-separated with a header row and without
+		quoting, so we split lines ourselves, which is faster than the csv
+		module and doesn't trip over quote characters in terms.
 		
+		Rows are inserted in chunks of `chunk_size` with `executemany` inside
+		one transaction, with journaling and syncing turned off for the
+		duration of the load. Rows are upserted by id, keeping the version with
+		the latest effectiveTime. Indexes are created afterwards, in
+		`did_import`.
+		
+		Delta files are staged into temporary tables and applied by
+		`did_import_delta`; since they update a database we want to keep, the
+		journal stays on for these.
+		"""
 		logging.debug('Importing SNOMED {} into snomed.db...'.format(table_name))
 		
-		# not yet imported, parse tab-separated file and import
-		with open(snomed_file, encoding='utf-8') as csv_handle:
-			cls.sqlite_handle.isolation_level = 'EXCLUSIVE'
-			sql = cls.insert_query_for(table_name)
-			reader = csv.reader(csv_handle, dialect='excel-tab')
-			i = 0
+		sql = cls.insert_query_for(table_name, delta)
+		start = time.time()
+		i = 0
+		with open(snomed_file, encoding='utf-8') as csv_handle, (contextlib.nullcontext() if delta else cls.bulk_loading()):
+			if 'descriptions' == table_name:
+				cls.setup_description_versions()
+			elif delta and 'relationships' == table_name:
+				cls.setup_relationship_versions()
+			next(csv_handle, None)			# first row is the header row
+			chunk = []
 			try:
-				for row in reader:
-					if i > 0:			# first row is the header row
-						
-						# execute SQL (we just ignore duplicates)
-						params = cls.insert_tuple_from_csv_row_for(table_name, row)
-						try:
-							cls.sqlite_handle.execute(sql, params)
-						except Exception as e:
-							sys.exit('Cannot insert {}: {}'.format(params, e))
-					i += 1
-				
-				# commit to file
-				cls.sqlite_handle.commit()
-				cls.did_import(table_name)
-				cls.sqlite_handle.isolation_level = None
-			
-			except csv.Error as e:
+				for line in csv_handle:
+					chunk.append(cls.insert_tuple_from_csv_row_for(table_name, line.rstrip('\r\n').split('\t')))
+					if len(chunk) >= chunk_size:
+						cls.sqlite_handle.executeMany(sql, chunk)
+						i += len(chunk)
+						chunk = []
+				cls.sqlite_handle.executeMany(sql, chunk)
+				i += len(chunk)
+			except (IndexError, ValueError) as e:
 				cls.sqlite_handle.rollback()
-				sys.exit('CSV error on line {}: {}'.format(reader.line_num, e))
-
-		logging.debug('{} concepts parsed'.format(i-1))
+				sys.exit('Malformed row on line {} of {}: {}'.format(i + len(chunk) + 2, snomed_file, e))
+			
+			# commit to file
+			cls.sqlite_handle.commit()
+			elapsed = max(time.time() - start, 0.001)
+			logging.info('{} rows parsed into {} in {:.1f} s, {:,.0f} rows/s'.format(i, table_name, elapsed, i / elapsed))
+			if delta:
+				cls.did_import_delta(table_name, active_only)
+			else:
+				cls.did_import(table_name, active_only)
+	
+	@classmethod
+	@contextlib.contextmanager
+	def bulk_loading(cls):
+		""" Context manager relaxing durability on our database: the rollback
+		journal and fsync are turned off and the page cache enlarged, which
+		speeds up bulk inserts considerably. A crash during the load leaves a
+		corrupt database, which we just delete and import again. The previous
+		settings are restored on exit.
+		"""
+		handle = cls.sqlite_handle
+		journal_mode = handle.executeOne('PRAGMA journal_mode', ())[0]
+		synchronous = handle.executeOne('PRAGMA synchronous', ())[0]
+		cache_size = handle.executeOne('PRAGMA cache_size', ())[0]
+		handle.execute('PRAGMA journal_mode = OFF')
+		handle.execute('PRAGMA synchronous = OFF')
+		handle.execute('PRAGMA cache_size = -256000')
+		try:
+			yield handle
+		finally:
+			handle.commit()
+			handle.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+			handle.execute('PRAGMA synchronous = {}'.format(synchronous))
+			handle.execute('PRAGMA cache_size = {}'.format(cache_size))
 
 
 	@classmethod
@@ -120,10 +211,12 @@ class SNOMED(object):
 		# descriptions
 		cls.sqlite_handle.create('descriptions', '''(
 				concept_id INTEGER PRIMARY KEY,
+				description_id INT,
 				lang TEXT,
 				term TEXT,
 				isa VARCHAR,
-				active INT
+				active INT,
+				effective_time INT
 			)''')
 		
 		# relationships
@@ -133,23 +226,70 @@ class SNOMED(object):
 				destination_id INT,
 				rel_type INT,
 				rel_text VARCHAR,
-				active INT
+				active INT,
+				effective_time INT
 			)''')
 	
 	@classmethod
-	def insert_query_for(cls, table_name):
-		""" Returns the insert query needed for the given table
+	def setup_description_versions(cls):
+		""" Creates the temporary table that descriptions are imported into.
+		
+		Our `descriptions` table holds one description per concept, but
+		versions of descriptions need to be told apart by description id;
+		`did_import` copies the latest versions over.
+		"""
+		cls.sqlite_handle.execute('''CREATE TEMP TABLE IF NOT EXISTS description_versions (
+				description_id INTEGER PRIMARY KEY,
+				concept_id INT,
+				lang TEXT,
+				term TEXT,
+				isa VARCHAR,
+				active INT,
+				effective_time INT
+			)''')
+	
+	@classmethod
+	def setup_relationship_versions(cls):
+		""" Creates the temporary table that relationships from Delta files
+		are staged in, before `did_import_delta` applies them.
+		"""
+		cls.sqlite_handle.execute('''CREATE TEMP TABLE IF NOT EXISTS relationship_versions (
+				relationship_id INTEGER PRIMARY KEY,
+				source_id INT,
+				destination_id INT,
+				rel_type INT,
+				rel_text VARCHAR,
+				active INT,
+				effective_time INT
+			)''')
+	
+	@classmethod
+	def insert_query_for(cls, table_name, delta=False):
+		""" Returns the insert query needed for the given table; rows already
+		present are only replaced by versions with a later effectiveTime.
+		Relationships from Delta files go into `relationship_versions`.
 		"""
 		if 'descriptions' == table_name:
-			return '''INSERT OR IGNORE INTO descriptions
-						(concept_id, lang, term, isa, active)
+			return '''INSERT INTO description_versions
+						(description_id, concept_id, lang, term, isa, active, effective_time)
 						VALUES
-						(?, ?, ?, ?, ?)'''
+						(?, ?, ?, ?, ?, ?, ?)
+						ON CONFLICT (description_id) DO UPDATE SET
+						concept_id = excluded.concept_id, lang = excluded.lang,
+						term = excluded.term, isa = excluded.isa,
+						active = excluded.active, effective_time = excluded.effective_time
+						WHERE excluded.effective_time > description_versions.effective_time'''
 		if 'relationships' == table_name:
-			return '''INSERT OR IGNORE INTO relationships
-						(relationship_id, source_id, destination_id, rel_type, active)
+			table = 'relationship_versions' if delta else 'relationships'
+			return '''INSERT INTO {0}
+						(relationship_id, source_id, destination_id, rel_type, rel_text, active, effective_time)
 						VALUES
-						(?, ?, ?, ?, ?)'''
+						(?, ?, ?, ?, ?, ?, ?)
+						ON CONFLICT (relationship_id) DO UPDATE SET
+						source_id = excluded.source_id, destination_id = excluded.destination_id,
+						rel_type = excluded.rel_type, rel_text = excluded.rel_text,
+						active = excluded.active, effective_time = excluded.effective_time
+						WHERE excluded.effective_time > {0}.effective_time'''.format(table)
 		return None
 	
 	@classmethod
@@ -161,30 +301,213 @@ class SNOMED(object):
 					isa = 'synonym'
 				elif '900000000000003001' == row[6]:
 					isa = 'full'
-			return (int(row[4]), row[5], row[7], isa, int(row[2]))
+			return (int(row[0]), int(row[4]), row[5], row[7], isa, int(row[2]), int(row[1]))
 		if 'relationships' == table_name:
-			return (int(row[0]), int(row[4]), int(row[5]), int(row[7]), int(row[2]))
+			rel_type = int(row[7])
+			return (int(row[0]), int(row[4]), int(row[5]), rel_type, cls.rel_texts.get(rel_type), int(row[2]), int(row[1]))
 		return None
 	
 	@classmethod
-	def did_import(cls, table_name):
+	def did_import(cls, table_name, active_only=False):
 		""" Allows us to set hooks after tables have been imported.
 		
-		Creates indexes and names `isa` and `finding_site` relationships.
+		Moves imported descriptions over from `description_versions`, drops
+		inactive rows if `active_only` is set and creates indexes; `isa` and
+		`finding_site` relationships have already been named from
+		`rel_texts` during import.
 		"""
-		# index descriptions
+		# fill and index descriptions, preferring active descriptions
 		if 'descriptions' == table_name:
 			print("----- DID IMPORT descriptions")
+			cls.sqlite_handle.execute('''INSERT OR IGNORE INTO descriptions
+				(concept_id, description_id, lang, term, isa, active, effective_time)
+				SELECT concept_id, description_id, lang, term, isa, active, effective_time
+				FROM description_versions {}
+				ORDER BY active DESC, description_id'''.format('WHERE active = 1' if active_only else ''))
+			cls.sqlite_handle.execute("DROP TABLE description_versions")
 			cls.sqlite_handle.execute("CREATE INDEX IF NOT EXISTS isa_index ON descriptions (isa)")
+			cls.build_search_index()
 		
-		# update and index relationships
+		# clean up and index relationships
 		if 'relationships' == table_name:
 			print("----- DID IMPORT relationships")
-			cls.sqlite_handle.execute("UPDATE relationships SET rel_text = 'isa' WHERE rel_type = 116680003")
-			cls.sqlite_handle.execute("UPDATE relationships SET rel_text = 'finding_site' WHERE rel_type = 363698007")
+			if active_only:
+				cls.sqlite_handle.execute("DELETE FROM relationships WHERE active = 0")
 			cls.sqlite_handle.execute("CREATE INDEX IF NOT EXISTS source_index ON relationships (source_id)")
 			cls.sqlite_handle.execute("CREATE INDEX IF NOT EXISTS destination_index ON relationships (destination_id)")
 			cls.sqlite_handle.execute("CREATE INDEX IF NOT EXISTS rel_text_index ON relationships (rel_text)")
+			cls.build_isa_closure()
+	
+	@classmethod
+	def did_import_delta(cls, table_name, active_only=False):
+		""" Applies a staged Delta file to the existing tables.
+		
+		Descriptions are upserted by concept following the rules of the
+		full import: a description replaces the one we hold if it is a newer
+		version of it, if it is active while ours isn't, or if it has the same
+		status and a lower id. The search index follows through its triggers.
+		Since we only keep one description per concept, a concept whose
+		description is inactivated without an active replacement in the
+		delta keeps the inactive one.
+		
+		Relationships are upserted by id and effectiveTime; if the database
+		has the is-a closure, it is updated for the concepts below changed
+		"isa" relationships via `update_isa_closure`.
+		"""
+		handle = cls.sqlite_handle
+		if 'descriptions' == table_name:
+			print("----- DID IMPORT DELTA descriptions")
+			# inactivations first, so active descriptions can replace them
+			handle.execute('''INSERT INTO descriptions
+				(concept_id, description_id, lang, term, isa, active, effective_time)
+				SELECT concept_id, description_id, lang, term, isa, active, effective_time
+				FROM description_versions WHERE true
+				ORDER BY active, description_id DESC
+				ON CONFLICT (concept_id) DO UPDATE SET
+				description_id = excluded.description_id, lang = excluded.lang,
+				term = excluded.term, isa = excluded.isa,
+				active = excluded.active, effective_time = excluded.effective_time
+				WHERE (excluded.description_id = descriptions.description_id AND excluded.effective_time > descriptions.effective_time)
+				OR (excluded.description_id != descriptions.description_id AND (excluded.active > descriptions.active
+					OR (excluded.active = descriptions.active AND excluded.description_id < descriptions.description_id)))''')
+			if active_only:
+				handle.execute("DELETE FROM descriptions WHERE active = 0")
+			handle.execute("DROP TABLE description_versions")
+			handle.commit()
+		
+		if 'relationships' == table_name:
+			print("----- DID IMPORT DELTA relationships")
+			# concepts whose "isa" parents change, before or after the update
+			handle.execute('CREATE TEMP TABLE isa_changed (concept_id INTEGER PRIMARY KEY)')
+			handle.execute('''INSERT OR IGNORE INTO isa_changed
+				SELECT source_id FROM relationship_versions WHERE rel_text = 'isa'
+				UNION
+				SELECT relationships.source_id FROM relationships JOIN relationship_versions USING (relationship_id)
+				WHERE relationships.rel_text = 'isa'
+			''')
+			handle.execute('''INSERT INTO relationships
+				(relationship_id, source_id, destination_id, rel_type, rel_text, active, effective_time)
+				SELECT relationship_id, source_id, destination_id, rel_type, rel_text, active, effective_time
+				FROM relationship_versions WHERE true
+				ON CONFLICT (relationship_id) DO UPDATE SET
+				source_id = excluded.source_id, destination_id = excluded.destination_id,
+				rel_type = excluded.rel_type, rel_text = excluded.rel_text,
+				active = excluded.active, effective_time = excluded.effective_time
+				WHERE excluded.effective_time > relationships.effective_time''')
+			if active_only:
+				handle.execute("DELETE FROM relationships WHERE active = 0")
+			handle.execute("DROP TABLE relationship_versions")
+			if handle.hasTable('isa_closure'):
+				cls.update_isa_closure('isa_changed')
+			handle.execute("DROP TABLE isa_changed")
+			handle.commit()
+	
+	@classmethod
+	def update_isa_closure(cls, changed_table):
+		""" Updates `isa_closure` after the "isa" relationships of the
+		concepts in `changed_table` (a table with a `concept_id` column)
+		changed: the closure rows of these concepts and of all their
+		descendants, before and after the change, are recomputed.
+		"""
+		handle = cls.sqlite_handle
+		start = time.time()
+		handle.execute('CREATE TEMP TABLE isa_affected (concept_id INTEGER PRIMARY KEY)')
+		handle.execute('''INSERT OR IGNORE INTO isa_affected
+			SELECT concept_id FROM {0}
+			UNION
+			SELECT descendant_id FROM isa_closure WHERE ancestor_id IN (SELECT concept_id FROM {0})'''.format(changed_table))
+		handle.execute('''INSERT OR IGNORE INTO isa_affected
+			WITH RECURSIVE descendants (concept_id) AS (
+				SELECT concept_id FROM {}
+				UNION
+				SELECT relationships.source_id
+				FROM descendants JOIN relationships ON relationships.destination_id = descendants.concept_id
+				WHERE relationships.rel_text = 'isa' AND relationships.active = 1
+			)
+			SELECT concept_id FROM descendants'''.format(changed_table))
+		handle.execute('DELETE FROM isa_closure WHERE descendant_id IN (SELECT concept_id FROM isa_affected)')
+		handle.execute('''INSERT INTO isa_closure (descendant_id, ancestor_id)
+			WITH RECURSIVE ancestors (descendant_id, ancestor_id) AS (
+				SELECT source_id, destination_id FROM relationships
+				WHERE rel_text = 'isa' AND active = 1 AND source_id IN (SELECT concept_id FROM isa_affected)
+				UNION
+				SELECT ancestors.descendant_id, relationships.destination_id
+				FROM ancestors JOIN relationships ON relationships.source_id = ancestors.ancestor_id
+				WHERE relationships.rel_text = 'isa' AND relationships.active = 1
+			)
+			SELECT descendant_id, ancestor_id FROM ancestors''')
+		num = handle.executeOne('SELECT COUNT(*) FROM isa_affected', ())[0]
+		handle.execute('DROP TABLE isa_affected')
+		logging.info('Updated the is-a closure of {} concepts in {:.1f} s'.format(num, time.time() - start))
+	
+	@classmethod
+	def build_search_index(cls):
+		""" Creates the `descriptions_fts` full-text index over description
+		terms, with prefix indexes so that as-you-type searches are fast,
+		plus triggers keeping it in sync with `descriptions`. Replaces an
+		existing index.
+		"""
+		if cls.sqlite_handle is None:
+			cls.sqlite_handle = SQLite.get(cls.database_path())
+		handle = cls.sqlite_handle
+		handle.execute('DROP TABLE IF EXISTS descriptions_fts')
+		handle.execute('''CREATE VIRTUAL TABLE descriptions_fts USING fts5(
+				term,
+				content='descriptions', content_rowid='concept_id',
+				tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+			)''')
+		handle.execute("INSERT INTO descriptions_fts (descriptions_fts) VALUES ('rebuild')")
+		
+		handle.execute('DROP TRIGGER IF EXISTS descriptions_fts_insert')
+		handle.execute('DROP TRIGGER IF EXISTS descriptions_fts_delete')
+		handle.execute('DROP TRIGGER IF EXISTS descriptions_fts_update')
+		handle.execute('''CREATE TRIGGER descriptions_fts_insert AFTER INSERT ON descriptions BEGIN
+				INSERT INTO descriptions_fts (rowid, term) VALUES (new.concept_id, new.term);
+			END''')
+		handle.execute('''CREATE TRIGGER descriptions_fts_delete AFTER DELETE ON descriptions BEGIN
+				INSERT INTO descriptions_fts (descriptions_fts, rowid, term) VALUES ('delete', old.concept_id, old.term);
+			END''')
+		handle.execute('''CREATE TRIGGER descriptions_fts_update AFTER UPDATE OF term ON descriptions BEGIN
+				INSERT INTO descriptions_fts (descriptions_fts, rowid, term) VALUES ('delete', old.concept_id, old.term);
+				INSERT INTO descriptions_fts (rowid, term) VALUES (new.concept_id, new.term);
+			END''')
+		handle.commit()
+	
+	@classmethod
+	def build_isa_closure(cls):
+		""" Materializes the transitive closure of active "is a" relationships
+		into `isa_closure`, one (descendant_id, ancestor_id) row for every
+		direct or indirect ancestor, so that subsumption checks become a
+		single primary key probe. Replaces an existing closure.
+		
+		Computed by a recursive query inside SQLite; for the International
+		release this takes a few minutes and grows the database by a few
+		hundred MB.
+		"""
+		if cls.sqlite_handle is None:
+			cls.sqlite_handle = SQLite.get(cls.database_path())
+		handle = cls.sqlite_handle
+		start = time.time()
+		handle.execute('DROP TABLE IF EXISTS isa_closure')
+		handle.execute('''CREATE TABLE isa_closure (
+				descendant_id INT,
+				ancestor_id INT,
+				PRIMARY KEY (descendant_id, ancestor_id)
+			) WITHOUT ROWID''')
+		handle.execute('''INSERT INTO isa_closure (descendant_id, ancestor_id)
+			WITH RECURSIVE ancestors (descendant_id, ancestor_id) AS (
+				SELECT source_id, destination_id FROM relationships
+				WHERE rel_text = 'isa' AND active = 1
+				UNION
+				SELECT ancestors.descendant_id, relationships.destination_id
+				FROM ancestors JOIN relationships ON relationships.source_id = ancestors.ancestor_id
+				WHERE relationships.rel_text = 'isa' AND relationships.active = 1
+			)
+			SELECT descendant_id, ancestor_id FROM ancestors ORDER BY descendant_id, ancestor_id''')
+		handle.execute('CREATE INDEX isa_closure_ancestor_index ON isa_closure (ancestor_id)')
+		handle.commit()
+		num = handle.executeOne('SELECT COUNT(*) FROM isa_closure', ())[0]
+		logging.info('Built is-a closure with {} rows in {:.1f} s'.format(num, time.time() - start))
 
 
 class SNOMEDLookup(object):
@@ -192,8 +515,11 @@ class SNOMEDLookup(object):
 	
 	sqlite = None
 	
-	def __init__(self):
-		self.sqlite = SQLite.get(SNOMED.database_path())
+	def __init__(self, database=None):
+		self.sqlite = SQLite.get(database or SNOMED.database_path())
+		self.hierarchy = None
+		self._has_closure = None
+		self._has_search_index = False
 	
 	def lookup_code_meaning(self, snomed_id, preferred=True, no_html=True):
 		""" Returns HTML for all matches of the given SNOMED id.
@@ -216,50 +542,588 @@ class SNOMEDLookup(object):
 			return ", ".join(names) if len(names) > 0 else ''
 		return "<br/>\n".join(names) if len(names) > 0 else ''
 	
-	def lookup_if_isa(self, child_id, parent_id, checked=None):
+	def lookup_code_meanings(self, snomed_ids):
+		""" Batch variant of `lookup_code_meaning` without HTML, looking up
+		all terms in few queries.
+		
+		:param snomed_ids: An iterable of SNOMED ids
+		:returns: A dict of id (as string) to term, '' for unknown ids
+		"""
+		ids = list(set(str(snomed_id) for snomed_id in snomed_ids if snomed_id))
+		meanings = dict((snomed_id, '') for snomed_id in ids)
+		sql = 'SELECT concept_id, term FROM descriptions WHERE concept_id IN ({})'
+		for res in self.sqlite.executeIn(sql, ids):
+			meanings[str(res[0])] = res[1]
+		return meanings
+	
+	def lookup_code_for_name(self, name, active_only=True, isa=None, limit=20, offset=0):
+		""" Searches description terms for all of the given words, each
+		matching as a prefix, so "metast brea" finds "Metastasis from
+		malignant tumor of breast". Uses the full-text index built by
+		:meth:`SNOMED.build_search_index`.
+		
+		:param bool active_only: Only return active descriptions
+		:param str isa: Only return "full" names or "synonym" descriptions
+		:param int limit: The maximum number of results to return
+		:param int offset: The number of results to skip, for paging
+		:returns: A list of (concept_id, term, isa) tuples, best matches first
+		"""
+		words = re.findall(r'\w+', name or '')
+		if 0 == len(words):
+			return []
+		if not self.has_search_index():
+			raise Exception('SNOMED search needs the full-text index, run `SNOMED.build_search_index()` first')
+		
+		match = ' '.join('"{}"*'.format(word) for word in words)
+		sql = '''SELECT descriptions.concept_id, descriptions.term, descriptions.isa
+			FROM descriptions_fts JOIN descriptions ON descriptions.concept_id = descriptions_fts.rowid
+			WHERE descriptions_fts MATCH ?'''
+		params = [match]
+		if active_only:
+			sql += ' AND descriptions.active = 1'
+		if isa is not None:
+			sql += ' AND descriptions.isa = ?'
+			params.append(isa)
+		sql += ' ORDER BY descriptions_fts.rank LIMIT ? OFFSET ?'
+		params.extend([limit, offset])
+		
+		return [(str(res[0]), res[1], res[2]) for res in self.sqlite.execute(sql, params)]
+	
+	def has_search_index(self):
+		""" Whether the database contains the full-text index built by
+		:meth:`SNOMED.build_search_index`; checked until it is found.
+		"""
+		if not self._has_search_index:
+			self._has_search_index = self.sqlite.hasTable('descriptions_fts')
+		return self._has_search_index
+	
+	def has_isa_closure(self):
+		""" Whether the database contains the `isa_closure` table built by
+		:meth:`SNOMED.build_isa_closure`; checked only once.
+		"""
+		if self._has_closure is None:
+			self._has_closure = self.sqlite.hasTable('isa_closure')
+		return self._has_closure
+	
+	def lookup_if_isa(self, child_id, parent_id):
 		""" Determines if a child concept is refining a parent concept, i.e.
 		if there is a (direct or indirect) "is a" (116680003) relationship from
 		child to parent.
+		
+		Uses the in-memory hierarchy if :meth:`load_hierarchy` was called,
+		the precomputed `isa_closure` table if it exists, otherwise walks up
+		the hierarchy one query per ancestor.
 		"""
 		if not child_id or not parent_id:
 			return False
-		if checked is not None and child_id in checked:
-			return False
 		
-		parents = self.lookup_parents_of(child_id)
-		if parent_id in parents:
-			return True
+		if self.hierarchy is not None:
+			return self.hierarchy.isa(child_id, parent_id)
+		
+		if self.has_isa_closure():
+			sql = 'SELECT 1 FROM isa_closure WHERE descendant_id = ? AND ancestor_id = ?'
+			return self.sqlite.executeOne(sql, (child_id, parent_id)) is not None
 		
-		chkd = checked or []
-		chkd.append(child_id)
-		for parent in parents:
-			flag = self.lookup_if_isa(parent, parent_id, chkd)
-			if flag:
+		parent_id = str(parent_id)
+		checked = set()
+		pending = [str(child_id)]
+		while len(pending) > 0:
+			current = pending.pop()
+			if current in checked:
+				continue
+			checked.add(current)
+			parents = self.lookup_parents_of(current)
+			if parent_id in parents:
 				return True
+			pending.extend(parents)
 		return False
 	
+	def lookup_children_of(self, snomed_id):
+		""" Returns a list of concept ids that are direct, active "is a"
+		(116680003) children of the given id.
+		"""
+		ids = []
+		if snomed_id:
+			sql = 'SELECT source_id, rel_text, active FROM relationships WHERE destination_id = ?'
+			for res in self.sqlite.execute(sql, (snomed_id,)):
+				if 'isa' == res[1] and 1 == res[2]:
+					ids.append(str(res[0]))
+		return ids
+	
+	def lookup_ancestors_of(self, snomed_id, max_depth=None):
+		""" Generator yielding all "is a" ancestors of the given concept
+		breadth-first, as (concept_id, depth) tuples where direct parents have
+		depth 1. Every ancestor is yielded once, at its shortest depth, and
+		every level is fetched in one batched query.
+		"""
+		sql = "SELECT source_id, destination_id FROM relationships WHERE rel_text = 'isa' AND active = 1 AND source_id IN ({})"
+		return self._breadth_first(snomed_id, sql, max_depth)
+	
+	def lookup_descendants_of(self, snomed_id, max_depth=None):
+		""" Generator yielding all "is a" descendants of the given concept
+		breadth-first, as (concept_id, depth) tuples where direct children
+		have depth 1, see :meth:`lookup_ancestors_of`.
+		"""
+		sql = "SELECT destination_id, source_id FROM relationships WHERE rel_text = 'isa' AND active = 1 AND destination_id IN ({})"
+		return self._breadth_first(snomed_id, sql, max_depth)
+	
+	def _breadth_first(self, snomed_id, sql, max_depth):
+		if not snomed_id:
+			return
+		seen = set([str(snomed_id)])
+		level = [str(snomed_id)]
+		depth = 0
+		while len(level) > 0 and (max_depth is None or depth < max_depth):
+			depth += 1
+			next_level = []
+			for res in self.sqlite.executeIn(sql, level):
+				concept_id = str(res[1])
+				if concept_id not in seen:
+					seen.add(concept_id)
+					next_level.append(concept_id)
+			for concept_id in next_level:
+				yield (concept_id, depth)
+			level = next_level
+	
+	def expand_descendants(self, snomed_id, include_self=True, temp_table=None):
+		""" Expands a concept into the value set of all its "is a"
+		descendants in a single query, using the closure table if available.
+		
+		:param bool include_self: Whether the concept itself is part of the
+			value set
+		:param str temp_table: If given, the value set is stored into a
+			temporary table of this name, with one `concept_id` column, for
+			joining in further queries; the table is replaced if it exists
+		:returns: A set of concept ids (as strings), or the number of
+			concepts stored into `temp_table`
+		"""
+		if self.has_isa_closure():
+			select = 'SELECT descendant_id FROM isa_closure WHERE ancestor_id = :id'
+		else:
+			select = '''WITH RECURSIVE descendants (concept_id) AS (
+					SELECT :id
+					UNION
+					SELECT relationships.source_id FROM relationships JOIN descendants ON relationships.destination_id = descendants.concept_id
+					WHERE relationships.rel_text = 'isa' AND relationships.active = 1
+				)
+				SELECT concept_id FROM descendants WHERE concept_id != :id'''
+		if include_self:
+			select += ' UNION SELECT :id'
+		params = {'id': int(snomed_id)}
+		
+		if temp_table is None:
+			return set(str(res[0]) for res in self.sqlite.execute(select, params))
+		
+		if not re.match(r'^\w+$', temp_table):
+			raise Exception('Invalid table name "{}"'.format(temp_table))
+		self.sqlite.execute('DROP TABLE IF EXISTS temp.{}'.format(temp_table))
+		self.sqlite.execute('CREATE TEMP TABLE {} (concept_id INTEGER PRIMARY KEY)'.format(temp_table))
+		num = self.sqlite.executeUpdate('INSERT OR IGNORE INTO temp.{} (concept_id) {}'.format(temp_table, select), params)
+		self.sqlite.commit()		# don't keep the implicit transaction, and our lock on the database, open
+		return num
+	
+	def isa_many(self, child_ids, parent_ids, as_matrix=False):
+		""" Determines for many children at once which of the given parents
+		they are (direct or indirect) "is a" children of.
+		
+		Work is shared across children: with a loaded hierarchy this is one
+		sweep over the parents' intervals, with the closure table one join,
+		otherwise a breadth-first walk up the hierarchy that queries and
+		resolves every ancestor only once.
+		
+		:param list child_ids: The concept ids to classify
+		:param list parent_ids: The concept ids to test against
+		:param bool as_matrix: If True, return a list of lists of bools
+			aligned with `child_ids` and `parent_ids`
+		:returns: A dict mapping every child id (as string) to the set of
+			matching parent ids (as strings), or the matrix
+		"""
+		children = [str(c) for c in child_ids]
+		parents = [str(p) for p in parent_ids]
+		if self.hierarchy is not None:
+			found = self.hierarchy.isa_many(children, parents)
+		elif self.has_isa_closure():
+			found = self._isa_many_closure(children, parents)
+		else:
+			found = self._isa_many_walk(children, parents)
+		
+		if as_matrix:
+			return [[parent in found[child] for parent in parents] for child in children]
+		return found
+	
+	def _isa_many_closure(self, children, parents):
+		found = {child: set() for child in children}
+		self.sqlite.execute('CREATE TEMP TABLE IF NOT EXISTS isa_many_children (concept_id INTEGER PRIMARY KEY)')
+		self.sqlite.execute('CREATE TEMP TABLE IF NOT EXISTS isa_many_parents (concept_id INTEGER PRIMARY KEY)')
+		try:
+			self.sqlite.executeMany('INSERT OR IGNORE INTO isa_many_children VALUES (?)', ((c,) for c in found))
+			self.sqlite.executeMany('INSERT OR IGNORE INTO isa_many_parents VALUES (?)', ((p,) for p in set(parents)))
+			self.sqlite.commit()		# don't keep the implicit transaction, and our lock on the database, open
+			sql = '''SELECT isa_closure.descendant_id, isa_closure.ancestor_id
+				FROM isa_many_children JOIN isa_closure ON isa_closure.descendant_id = isa_many_children.concept_id
+				WHERE isa_closure.ancestor_id IN isa_many_parents'''
+			for res in self.sqlite.execute(sql):
+				found[str(res[0])].add(str(res[1]))
+		finally:
+			self.sqlite.execute('DELETE FROM isa_many_children')
+			self.sqlite.execute('DELETE FROM isa_many_parents')
+			self.sqlite.commit()
+		return found
+	
+	def _isa_many_walk(self, children, parents):
+		# fetch parents level by level, batching the queries
+		parents_of = {}
+		frontier = set(children)
+		while len(frontier) > 0:
+			for node in frontier:
+				parents_of[node] = []
+			sql = "SELECT source_id, destination_id FROM relationships WHERE rel_text = 'isa' AND active = 1 AND source_id IN ({})"
+			for res in self.sqlite.executeIn(sql, list(frontier)):
+				parents_of[str(res[0])].append(str(res[1]))
+			frontier = set(p for node in frontier for p in parents_of[node] if p not in parents_of)
+		
+		# resolve the matching ancestors of every node once, parents first
+		targets = set(parents)
+		hits = {}
+		visiting = set()			# guards against cycles
+		for child in children:
+			stack = [child]
+			while len(stack) > 0:
+				node = stack[-1]
+				if node in hits:
+					stack.pop()
+					continue
+				pending = [p for p in parents_of[node] if p not in hits and p not in visiting]
+				if node not in visiting and len(pending) > 0:
+					visiting.add(node)
+					stack.extend(pending)
+					continue
+				found = set()
+				for p in parents_of[node]:
+					if p in targets:
+						found.add(p)
+					found |= hits.get(p, set())
+				hits[node] = found
+				visiting.discard(node)
+				stack.pop()
+		return {child: set(hits[child]) for child in children}
+	
+	def load_hierarchy(self):
+		""" Loads the is-a hierarchy into memory, see :class:`SNOMEDHierarchy`,
+		to answer `lookup_if_isa` without SQL from now on. Call this on
+		`SNOMEDConcept.uplooker` to speed up :meth:`SNOMEDConcept.isa`.
+		"""
+		self.hierarchy = SNOMEDHierarchy.load(self)
+		return self.hierarchy
+	
 	def lookup_parents_of(self, snomed_id):
-		""" Returns a list of concept ids that have a direct "is a" (116680003)
-		relationship with the given id.
+		""" Returns a list of concept ids that have a direct, active "is a"
+		(116680003) relationship with the given id.
 		"""
 		ids = []
 		if snomed_id:
 			#sql = 'SELECT destination_id FROM relationships WHERE source_id = ? AND rel_type = 116680003'	# Too slow!!
-			sql = 'SELECT destination_id, rel_text FROM relationships WHERE source_id = ?'
+			sql = 'SELECT destination_id, rel_text, active FROM relationships WHERE source_id = ?'
 			for res in self.sqlite.execute(sql, (snomed_id,)):
-				if 'isa' == res[1]:
+				if 'isa' == res[1] and 1 == res[2]:
 					ids.append(str(res[0]))
 		return ids
 
 
+class SNOMEDHierarchy(object):
+	""" In-memory "is a" hierarchy answering subsumption without SQL.
+	
+	Active "is a" relationships are loaded into integer arrays and every
+	concept is labeled with the post-order number it gets in a depth-first
+	spanning tree, plus a list of non-overlapping post-order intervals that
+	together contain exactly its descendants (interval labeling for
+	poly-hierarchies). `isa(child, parent)` then is a dictionary lookup and a
+	binary search over the parent's few intervals, answering exactly like
+	:meth:`SNOMEDLookup.lookup_if_isa`. Should the relationships contain
+	cycles, every strongly connected component is labeled as one node, and
+	its concepts are "is a" children of each other.
+	
+	Loading takes one pass over the is-a relationships plus time linear in
+	the number of edges and intervals; memory is a dict from concept id to
+	index plus four integer arrays. `load()` logs both, `nbytes()` returns
+	the array size.
+	"""
+	
+	def __init__(self, edges):
+		""" Builds the labels from (child_id, parent_id) tuples.
+		"""
+		self.index = {}
+		concept_parents = []
+		for child, parent in edges:
+			c = self._index_for(int(child), concept_parents)
+			p = self._index_for(int(parent), concept_parents)
+			concept_parents[c].append(p)
+		
+		# collapse cycles: from here on, nodes are the strongly connected
+		# components of the concepts, which form a DAG
+		component, num = _strongly_connected(concept_parents)
+		for concept_id, c in self.index.items():
+			self.index[concept_id] = component[c]
+		self.cyclic = bytearray(num)
+		parents_of = [set() for _ in range(num)]
+		for c, parents in enumerate(concept_parents):
+			for p in parents:
+				if component[c] == component[p]:
+					self.cyclic[component[c]] = 1
+				else:
+					parents_of[component[c]].add(component[p])
+		
+		children_of = [[] for _ in range(num)]
+		for c, parents in enumerate(parents_of):
+			for p in parents:
+				children_of[p].append(c)
+		
+		# depth-first numbering: the tree descendants of node n have post-order
+		# numbers in [low[n], post[n]), and every node finishes after all
+		# nodes reachable from it
+		self.post = array('i', [0]) * num
+		low = array('i', [0]) * num
+		visited = bytearray(num)
+		finished = []
+		counter = 0
+		roots = [n for n in range(num) if 0 == len(parents_of[n])]
+		for root in roots + list(range(num)):
+			if visited[root]:
+				continue
+			visited[root] = 1
+			low[root] = counter
+			stack = [(root, iter(children_of[root]))]
+			while len(stack) > 0:
+				node, children = stack[-1]
+				for child in children:
+					if not visited[child]:
+						visited[child] = 1
+						low[child] = counter
+						stack.append((child, iter(children_of[child])))
+						break
+				else:
+					stack.pop()
+					self.post[node] = counter
+					counter += 1
+					finished.append(node)
+		
+		# merge interval lists bottom-up, children always come first
+		intervals = [None] * num
+		for node in finished:
+			ivs = [(low[node], self.post[node])]
+			for child in children_of[node]:
+				ivs.extend(intervals[child])
+			intervals[node] = _merge_intervals(ivs)
+		
+		# flatten: intervals of node n are at offsets[n]:offsets[n+1]
+		self.offsets = array('i', [0]) * (num + 1)
+		self.starts = array('i')
+		self.ends = array('i')
+		for node in range(num):
+			for start, end in intervals[node]:
+				self.starts.append(start)
+				self.ends.append(end)
+			self.offsets[node + 1] = len(self.starts)
+	
+	def isa_many(self, child_ids, parent_ids):
+		""" Determines for all children at once which of the parents they are
+		"is a" children of, in one sweep over the children's post-order
+		numbers and the parents' intervals.
+		
+		:returns: A dict mapping every child id (as string) to the set of
+			matching parent ids (as strings)
+		"""
+		found = {}
+		events = []			# (position, 0 = interval opens / 1 = child / 2 = interval closes, id)
+		for parent_id in set(str(p) for p in parent_ids):
+			p = self._node_for(parent_id)
+			if p is not None:
+				for i in range(self.offsets[p], self.offsets[p + 1]):
+					events.append((self.starts[i], 0, parent_id))
+					events.append((self.ends[i], 2, parent_id))
+		for child_id in set(str(c) for c in child_ids):
+			c = self._node_for(child_id)
+			if c is None:
+				found[child_id] = set()
+			else:
+				events.append((self.post[c], 1, child_id))
+		
+		events.sort(key=lambda event: event[:2])
+		active = set()
+		for pos, kind, concept_id in events:
+			if 0 == kind:
+				active.add(concept_id)
+			elif 2 == kind:
+				active.discard(concept_id)
+			elif self.cyclic[self._node_for(concept_id)]:
+				found[concept_id] = set(active)
+			else:
+				found[concept_id] = active - {concept_id}
+		return found
+	
+	def _node_for(self, concept_id):
+		""" The node of the given concept id, None for unknown or
+		non-numeric ids.
+		"""
+		try:
+			return self.index.get(int(concept_id))
+		except (TypeError, ValueError):
+			return None
+	
+	def _index_for(self, concept_id, parents_of):
+		idx = self.index.get(concept_id)
+		if idx is None:
+			idx = self.index[concept_id] = len(parents_of)
+			parents_of.append([])
+		return idx
+	
+	@classmethod
+	def load(cls, lookup=None):
+		""" Loads the hierarchy from the database of the given
+		:class:`SNOMEDLookup`, or from our default database.
+		"""
+		sqlite = (lookup or SNOMEDLookup()).sqlite
+		start = time.time()
+		sql = "SELECT source_id, destination_id FROM relationships WHERE rel_text = 'isa' AND active = 1"
+		hierarchy = cls(sqlite.execute(sql))
+		logging.info('Loaded is-a hierarchy of {} concepts with {} intervals ({:.1f} MB) in {:.1f} s'
+			.format(len(hierarchy), len(hierarchy.starts), hierarchy.nbytes() / 1024 / 1024, time.time() - start))
+		return hierarchy
+	
+	def __len__(self):
+		return len(self.index)
+	
+	def __contains__(self, concept_id):
+		return self._node_for(concept_id) is not None
+	
+	def nbytes(self):
+		""" Size of the label arrays in bytes; the concept id dictionary adds
+		about 100 bytes per concept.
+		"""
+		return sum(a.itemsize * len(a) for a in (self.post, self.offsets, self.starts, self.ends)) + len(self.cyclic)
+	
+	def isa(self, child_id, parent_id):
+		""" Whether `child_id` is a direct or indirect "is a" child of
+		`parent_id`. Unknown concepts are not children of anything.
+		"""
+		child = self._node_for(child_id)
+		parent = self._node_for(parent_id)
+		if child is None or parent is None:
+			return False
+		if child == parent:
+			return 1 == self.cyclic[child]
+		pos = self.post[child]
+		i = bisect.bisect_right(self.starts, pos, self.offsets[parent], self.offsets[parent + 1]) - 1
+		return i >= self.offsets[parent] and self.ends[i] >= pos
+
+
+def _strongly_connected(successors):
+	""" Tarjan's algorithm, without recursion: finds the strongly connected
+	components of the graph given as a list of successor lists per node.
+	
+	:returns: A tuple with a list of the component number of every node and
+		the number of components
+	"""
+	num = len(successors)
+	component = [-1] * num
+	number = [-1] * num
+	lowlink = [0] * num
+	on_stack = bytearray(num)
+	stack = []
+	counter = 0
+	count = 0
+	for start in range(num):
+		if number[start] >= 0:
+			continue
+		number[start] = lowlink[start] = counter
+		counter += 1
+		stack.append(start)
+		on_stack[start] = 1
+		work = [(start, iter(successors[start]))]
+		while len(work) > 0:
+			node, nexts = work[-1]
+			for succ in nexts:
+				if number[succ] < 0:
+					number[succ] = lowlink[succ] = counter
+					counter += 1
+					stack.append(succ)
+					on_stack[succ] = 1
+					work.append((succ, iter(successors[succ])))
+					break
+				if on_stack[succ] and number[succ] < lowlink[node]:
+					lowlink[node] = number[succ]
+			else:
+				work.pop()
+				if len(work) > 0 and lowlink[node] < lowlink[work[-1][0]]:
+					lowlink[work[-1][0]] = lowlink[node]
+				if lowlink[node] == number[node]:
+					while True:
+						member = stack.pop()
+						on_stack[member] = 0
+						component[member] = count
+						if member == node:
+							break
+					count += 1
+	return component, count
+
+
+def _merge_intervals(intervals):
+	""" Sorts and merges overlapping or adjacent integer intervals, given
+	as inclusive (start, end) tuples.
+	"""
+	intervals.sort()
+	merged = [intervals[0]]
+	for start, end in intervals[1:]:
+		last_start, last_end = merged[-1]
+		if start <= last_end + 1:
+			if end > last_end:
+				merged[-1] = (last_start, end)
+		else:
+			merged.append((start, end))
+	return merged
+
+
 class SNOMEDConcept(object):
 	""" Represents a SNOMED concept.
+	
+	Concepts are interned by code: as long as a concept for a code is alive,
+	`SNOMEDConcept(code)` returns that same instance, so its term is looked
+	up at most once. Use `prefetch()` to look up the terms of many concepts
+	at once.
 	"""
 	uplooker = SNOMEDLookup()
 	
-	def __init__(self, code):
-		self.code = code
-		self._term = None
+	__slots__ = ('code', '_term', '__weakref__')
+	
+	_interned = weakref.WeakValueDictionary()
+	
+	def __new__(cls, code):
+		code = str(code)
+		concept = cls._interned.get(code)
+		if concept is None:
+			concept = super().__new__(cls)
+			concept.code = code
+			concept._term = None
+			cls._interned[code] = concept
+		return concept
+	
+	def __reduce__(self):
+		return (self.__class__, (self.code,))
+	
+	@classmethod
+	def prefetch(cls, concepts):
+		""" Looks up the terms of all given concepts that don't have theirs
+		yet, in bulk.
+		
+		:param concepts: An iterable of :class:`SNOMEDConcept` instances
+		:returns: The number of concepts whose term was looked up
+		"""
+		missing = [concept for concept in concepts if concept._term is None]
+		if len(missing) > 0:
+			meanings = cls.uplooker.lookup_code_meanings(concept.code for concept in missing)
+			for concept in missing:
+				concept._term = meanings.get(concept.code, '')
+		return len(missing)
 	
 	@property
 	def term(self):
@@ -297,26 +1161,61 @@ def _find_files(directory, prefix):
 # running this as a script does the database setup/check
 if '__main__' == __name__:
 	logging.basicConfig(level=logging.DEBUG)
+	usage = [
+		"Provide the path to the extracted SNOMED (RF2) directory as first argument.",
+		"Add `--full` to import from the Full instead of the Snapshot files, `--active-only` to skip inactive rows.",
+		"To update an existing database, pass a Delta release directory with `--delta`.",
+		"Download SNOMED from http://www.nlm.nih.gov/research/umls/licensedcontent/snomedctfiles.html",
+	]
+	
+	# apply a Delta release to an existing database
+	if '--delta' in sys.argv:
+		args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+		if len(args) < 1:
+			print("Provide the path to the extracted SNOMED (RF2) Delta directory as first argument.")
+			sys.exit(0)
+		try:
+			SNOMED.check_database()
+		except SNOMEDDBNotPresentException as e:
+			print("There is no SNOMED database to apply the Delta release to yet.")
+			print("\n".join(usage))
+			sys.exit(1)
+		try:
+			found = SNOMED.find_needed_files(args[0], 'Delta')
+			SNOMED.setup_tables()
+			SNOMED.import_from_files(found, active_only='--active-only' in sys.argv, delta=True)
+		except Exception as e:
+			print("SNOMED Delta import failed: {}".format(e))
+			sys.exit(1)
+		sys.exit(0)
 	
 	# if the database check fails, run import commands
 	try:
 		SNOMED.check_database()
 	except SNOMEDDBNotPresentException as e:
-		if len(sys.argv) < 2:
-			print("Provide the path to the extracted SNOMED (RF2) directory as first argument.")
-			print("Download SNOMED from http://www.nlm.nih.gov/research/umls/licensedcontent/snomedctfiles.html""")
+		args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+		if len(args) < 1:
+			print("\n".join(usage))
 			sys.exit(0)
 		
 		# import from files
 		try:
-			found = SNOMED.find_needed_files(sys.argv[1])
+			found = SNOMED.find_needed_files(args[0], 'Full' if '--full' in sys.argv else None)
 			SNOMED.sqlite_handle = None
 			SNOMED.setup_tables()
-			SNOMED.import_from_files(found)
+			SNOMED.import_from_files(found, active_only='--active-only' in sys.argv)
 		except Exception as e:
 			print("SNOMED import failed: {}".format(e))
 		sys.exit(0)
 	
+	# databases imported before we had the is-a closure or search index
+	if not SNOMEDLookup().has_isa_closure():
+		print("Building the is-a closure table, this takes a few minutes")
+		SNOMED.build_isa_closure()
+	if not SNOMEDLookup().has_search_index():
+		print("Building the search index")
+		SNOMED.build_search_index()
+	
 	# examples
 	cpt = SNOMEDConcept('215350009')
 	print('SNOMED code "{0}":  {1}'.format(cpt.code, cpt.term))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	Evaluate a subset of the SNOMED CT Expression Constraint Language (ECL)
+#	against our SNOMED database.
+#
+#	Supported are concept references (with optional |term|), the wildcard
+#	"*", the constraint operators "<", "<<", ">", ">>", "<!" and ">!",
+#	conjunction ("AND" or ","), disjunction ("OR"), exclusion ("MINUS"),
+#	parentheses and attribute refinements (":") with "=" and "!=", where the
+#	attribute can be a concept expression or a `rel_text` name known to our
+#	importer, like "finding_site". Example:
+#
+#	    << 404684003 : 363698007 = << 39057004
+#	    << 404684003 : finding_site = << 39057004
+#
+#	Queries need the `isa_closure` table, see `SNOMED.build_isa_closure()`.
+
+import re
+import sys
+import os.path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from snomed import SNOMEDLookup
+
+
+class ECLSyntaxError(Exception):
+	pass
+
+
+_token_re = re.compile(r'\s*(?:(<<|<!|<|>>|>!|>|!=|=|\(|\)|:|,|\*)|(\|[^|]*\|)|(\d+)|([A-Za-z_]\w*))')
+
+
+def _tokenize(expression):
+	tokens = []
+	pos = 0
+	expression = expression.rstrip()
+	while pos < len(expression):
+		match = _token_re.match(expression, pos)
+		if match is None:
+			raise ECLSyntaxError('Unexpected character "{}" at position {}'.format(expression[pos:].strip()[:1], pos))
+		symbol, term, number, word = match.groups()
+		if symbol is not None:
+			tokens.append(('symbol', symbol))
+		elif number is not None:
+			tokens.append(('concept', int(number)))
+		elif word is not None:
+			if word.upper() in ('AND', 'OR', 'MINUS'):
+				tokens.append(('symbol', word.upper()))
+			else:
+				tokens.append(('name', word))
+		# terms are for humans only, we skip them
+		pos = match.end()
+	return tokens
+
+
+class ECLQuery(object):
+	""" A parsed ECL expression that compiles into a single SQL query.
+	
+	Expressions are parsed into nested tuples and compiled into compound
+	SELECTs returning concept ids: constraint operators become probes into
+	the indexed `isa_closure` table (or the relationships table for "<!" and
+	">!"), AND/OR/MINUS become INTERSECT/UNION/EXCEPT and refinements filter
+	on `relationships` by `rel_type` or `rel_text` and destination.
+	"""
+	
+	constraint_operators = ('<<', '<!', '<', '>>', '>!', '>')
+	
+	def __init__(self, expression):
+		self.expression = expression
+		self._tokens = _tokenize(expression)
+		self._pos = 0
+		self.tree = self._parse_expression()
+		if self._pos < len(self._tokens):
+			raise ECLSyntaxError('Unexpected "{}" in "{}"'.format(self._tokens[self._pos][1], expression))
+		del self._tokens
+	
+	
+	# MARK: - Parsing
+	
+	def _peek(self):
+		return self._tokens[self._pos] if self._pos < len(self._tokens) else (None, None)
+	
+	def _next(self):
+		token = self._peek()
+		if token[0] is None:
+			raise ECLSyntaxError('Unexpected end of "{}"'.format(self.expression))
+		self._pos += 1
+		return token
+	
+	def _expect(self, symbol):
+		token = self._next()
+		if ('symbol', symbol) != token:
+			raise ECLSyntaxError('Expected "{}" but found "{}" in "{}"'.format(symbol, token[1], self.expression))
+	
+	def _parse_binary(self, parse_operand, operators=('AND', ',', 'OR', 'MINUS')):
+		""" Parses operands joined by any of `operators`; like ECL requires,
+		different operators must not be mixed without parentheses.
+		"""
+		left = parse_operand()
+		operator = None
+		while 'symbol' == self._peek()[0] and self._peek()[1] in operators:
+			kind = self._next()[1]
+			kind = 'AND' if ',' == kind else kind
+			if operator is not None and kind != operator:
+				raise ECLSyntaxError('Use parentheses when mixing {} and {} in "{}"'.format(operator, kind, self.expression))
+			operator = kind
+			left = (kind, left, parse_operand())
+		return left
+	
+	def _parse_expression(self):
+		return self._parse_binary(self._parse_refined)
+	
+	def _parse_refined(self):
+		sub = self._parse_sub()
+		if ('symbol', ':') == self._peek():
+			self._next()
+			return ('refine', sub, self._parse_binary(self._parse_attribute, ('AND', ',', 'OR')))
+		return sub
+	
+	def _parse_attribute(self):
+		if ('symbol', '(') == self._peek():
+			self._next()
+			refinement = self._parse_binary(self._parse_attribute, ('AND', ',', 'OR'))
+			self._expect(')')
+			return refinement
+		
+		if 'name' == self._peek()[0]:
+			attribute = ('name', self._next()[1])
+		else:
+			attribute = self._parse_sub()
+		comparator = self._next()
+		if comparator not in (('symbol', '='), ('symbol', '!=')):
+			raise ECLSyntaxError('Expected "=" or "!=" but found "{}" in "{}"'.format(comparator[1], self.expression))
+		return ('attribute', attribute, comparator[1], self._parse_sub())
+	
+	def _parse_sub(self):
+		operator = None
+		if 'symbol' == self._peek()[0] and self._peek()[1] in self.__class__.constraint_operators:
+			operator = self._next()[1]
+		
+		kind, value = self._next()
+		if ('symbol', '(') == (kind, value):
+			focus = self._parse_expression()
+			self._expect(')')
+		elif ('symbol', '*') == (kind, value):
+			focus = ('any',)
+		elif 'concept' == kind:
+			focus = ('concept', value)
+		else:
+			raise ECLSyntaxError('Expected a concept but found "{}" in "{}"'.format(value, self.expression))
+		return (operator, focus) if operator else focus
+	
+	
+	# MARK: - Compiling
+	
+	def sql(self):
+		""" The SQL query returning the ids of all matching concepts.
+		"""
+		return 'SELECT DISTINCT id FROM ({})'.format(self._compile(self.tree))
+	
+	def _compile(self, node):
+		kind = node[0]
+		if 'concept' == kind:
+			return 'SELECT {:d} AS id'.format(node[1])
+		if 'any' == kind:
+			return 'SELECT concept_id AS id FROM descriptions'
+		if kind in ('AND', 'OR', 'MINUS'):
+			compound = {'AND': 'INTERSECT', 'OR': 'UNION', 'MINUS': 'EXCEPT'}[kind]
+			return 'SELECT id FROM ({}) {} SELECT id FROM ({})'.format(self._compile(node[1]), compound, self._compile(node[2]))
+		if 'refine' == kind:
+			return 'SELECT id FROM ({}) WHERE id IN ({})'.format(self._compile(node[1]), self._compile_refinement(node[2]))
+		
+		# constraint operators
+		inner = self._compile(node[1])
+		if '<<' == kind:
+			return 'SELECT descendant_id AS id FROM isa_closure WHERE ancestor_id IN ({0}) UNION SELECT id FROM ({0})'.format(inner)
+		if '<' == kind:
+			return 'SELECT descendant_id AS id FROM isa_closure WHERE ancestor_id IN ({})'.format(inner)
+		if '>>' == kind:
+			return 'SELECT ancestor_id AS id FROM isa_closure WHERE descendant_id IN ({0}) UNION SELECT id FROM ({0})'.format(inner)
+		if '>' == kind:
+			return 'SELECT ancestor_id AS id FROM isa_closure WHERE descendant_id IN ({})'.format(inner)
+		if '<!' == kind:
+			return "SELECT source_id AS id FROM relationships WHERE rel_text = 'isa' AND active = 1 AND destination_id IN ({})".format(inner)
+		if '>!' == kind:
+			return "SELECT destination_id AS id FROM relationships WHERE rel_text = 'isa' AND active = 1 AND source_id IN ({})".format(inner)
+		raise ECLSyntaxError('Unsupported node {}'.format(node))
+	
+	def _compile_refinement(self, node):
+		""" Compiles a refinement into a query for the ids of the concepts
+		(relationship sources) satisfying it.
+		"""
+		kind = node[0]
+		if kind in ('AND', 'OR'):
+			compound = 'INTERSECT' if 'AND' == kind else 'UNION'
+			return 'SELECT id FROM ({}) {} SELECT id FROM ({})'.format(self._compile_refinement(node[1]), compound, self._compile_refinement(node[2]))
+		
+		attribute, comparator, value = node[1:]
+		if 'name' == attribute[0]:
+			condition = "rel_text = '{}'".format(attribute[1])		# tokenizer only allows \w+
+		else:
+			condition = 'rel_type IN ({})'.format(self._compile(attribute))
+		return 'SELECT source_id AS id FROM relationships WHERE active = 1 AND {} AND destination_id {} ({})'.format(
+			condition, 'IN' if '=' == comparator else 'NOT IN', self._compile(value))
+	
+	
+	# MARK: - Evaluating
+	
+	def evaluate(self, lookup=None):
+		""" Generator yielding the ids (as strings) of all concepts matching
+		the expression, streamed from the database.
+		
+		:param lookup: The :class:`SNOMEDLookup` whose database to query,
+			uses our default database if omitted
+		"""
+		lookup = lookup or SNOMEDLookup()
+		if not lookup.has_isa_closure():
+			raise Exception('ECL queries need the is-a closure, run `SNOMED.build_isa_closure()` first')
+		
+		# own cursor, so other lookups can run while we stream
+		lookup.sqlite.connect()
+		cursor = lookup.sqlite.handle.cursor()
+		try:
+			for res in cursor.execute(self.sql()):
+				yield str(res[0])
+		finally:
+			cursor.close()
+
+
+def evaluate(expression, lookup=None):
+	""" Parses and evaluates the ECL `expression`, see
+	:meth:`ECLQuery.evaluate`.
+	"""
+	return ECLQuery(expression).evaluate(lookup)
+
+
+# running this as a script evaluates the ECL expression given as argument
+if '__main__' == __name__:
+	if len(sys.argv) < 2:
+		print('Provide an ECL expression as first argument, e.g. "<< 404684003 : finding_site = << 39057004"')
+		sys.exit(0)
+	
+	for concept_id in evaluate(sys.argv[1]):
+		print(concept_id)
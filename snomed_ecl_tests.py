@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	SNOMED ECL unit testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import unittest
+from snomed_ecl import *
+from snomed_tests import SNOMEDFixtureTestCase
+
+
+class ECLQueryTest(SNOMEDFixtureTestCase):
+	""" Test :class:`ECLQuery` on the fixture release.
+	"""
+	def ecl(self, expression):
+		return set(evaluate(expression, self.lookup()))
+	
+	def test_constraint_operators(self):
+		self.assertEqual({'363346000'}, self.ecl('363346000 |Malignant neoplastic disease|'))
+		self.assertEqual({'128462008', '254837009', '315004001', '408643008'}, self.ecl('< 363346000'))
+		self.assertEqual({'363346000', '128462008', '254837009', '315004001', '408643008'}, self.ecl('<< 363346000'))
+		self.assertEqual({'128462008', '254837009'}, self.ecl('<! 363346000'))
+		self.assertEqual({'128462008', '254837009'}, self.ecl('>! 315004001'))
+		self.assertEqual({'123037004', '138875005'}, self.ecl('> 76752008'))
+		self.assertEqual({'76752008', '123037004', '138875005'}, self.ecl('>> 76752008'))
+	
+	def test_compound(self):
+		self.assertEqual({'315004001'}, self.ecl('< 128462008 AND < 254837009'))
+		self.assertEqual({'315004001'}, self.ecl('< 128462008, < 254837009'))
+		self.assertEqual({'315004001', '408643008'}, self.ecl('< 128462008 OR < 254837009'))
+		self.assertEqual({'408643008'}, self.ecl('< 254837009 MINUS < 128462008'))
+		self.assertEqual({'254837009', '408643008'}, self.ecl('(< 363346000 MINUS < 128462008) MINUS 128462008'))
+		with self.assertRaises(ECLSyntaxError):
+			ECLQuery('< 1 AND < 2 OR < 3')
+	
+	def test_refinement(self):
+		self.assertEqual({'315004001', '408643008'}, self.ecl('<< 404684003 : 363698007 = << 123037004'))
+		self.assertEqual({'315004001', '408643008'}, self.ecl('<< 404684003 : finding_site = << 76752008'))
+		self.assertEqual({'315004001'}, self.ecl('< 128462008 : finding_site = 76752008'))
+		self.assertEqual(set(), self.ecl('<< 404684003 : finding_site != << 123037004'))
+		self.assertEqual({'315004001', '408643008'}, self.ecl('< 363346000 : (finding_site = 76752008 OR 116680003 = 128462008)'))
+	
+	def test_syntax_errors(self):
+		for expression in ('<< ', '<< 1 :', '(< 1', '< 1 : finding_site 2', '< 1 : finding_site = 2 MINUS 3 = 4', '< abc', '1 $ 2'):
+			with self.assertRaises(ECLSyntaxError):
+				ECLQuery(expression)
@@ -11,10 +11,92 @@ thismodule = os.path.abspath(os.path.dirname(__file__))
 if thismodule not in sys.path:
 	sys.path.insert(0, thismodule)
 
+import random
+import shutil
+import tempfile
 import unittest
 from snomed import *
 
 
+# a tiny RF2 release: (id, effectiveTime, active, source, destination, type)
+FIXTURE_RELATIONSHIPS = [
+	(1001, '20140131', 1, 404684003, 138875005, 116680003),		# Clinical finding isa SNOMED CT Concept
+	(1002, '20140131', 1, 64572001, 404684003, 116680003),		# Disease isa Clinical finding
+	(1003, '20140131', 1, 55342001, 64572001, 116680003),		# Neoplasia isa Disease
+	(1004, '20140131', 1, 363346000, 55342001, 116680003),		# Malignant neoplastic disease isa Neoplasia
+	(1005, '20140131', 1, 128462008, 363346000, 116680003),		# Metastatic neoplasm isa Malignant neoplastic disease
+	(1006, '20140131', 1, 254837009, 363346000, 116680003),		# Malignant neoplasm of breast isa Malignant neoplastic disease
+	(1007, '20140131', 1, 315004001, 128462008, 116680003),		# Metastasis from breast isa Metastatic neoplasm
+	(1008, '20140131', 1, 315004001, 254837009, 116680003),		# Metastasis from breast isa Malignant neoplasm of breast
+	(1009, '20140131', 1, 408643008, 254837009, 116680003),		# Infiltrating duct carcinoma of breast isa Malignant neoplasm of breast
+	(1010, '20140131', 1, 123037004, 138875005, 116680003),		# Body structure isa SNOMED CT Concept
+	(1011, '20140131', 1, 76752008, 123037004, 116680003),		# Breast structure isa Body structure
+	(1012, '20140131', 1, 315004001, 76752008, 363698007),		# Metastasis from breast finding_site Breast structure
+	(1013, '20140131', 1, 408643008, 76752008, 363698007),		# Infiltrating duct carcinoma finding_site Breast structure
+	(1014, '20140131', 0, 215350009, 55342001, 116680003),		# inactive: Tram accident isa Neoplasia
+	(1015, '20140131', 1, 215350009, 138875005, 116680003),		# Tram accident isa SNOMED CT Concept
+]
+
+# (id, effectiveTime, active, concept, type, term)
+FIXTURE_DESCRIPTIONS = [
+	(2001, '20140131', 1, 138875005, '900000000000003001', 'SNOMED CT Concept'),
+	(2002, '20140131', 1, 404684003, '900000000000003001', 'Clinical finding (finding)'),
+	(2003, '20140131', 1, 64572001, '900000000000003001', 'Disease (disorder)'),
+	(2004, '20140131', 1, 55342001, '900000000000003001', 'Neoplasia'),
+	(2005, '20140131', 1, 363346000, '900000000000003001', 'Malignant neoplastic disease (disorder)'),
+	(2006, '20140131', 1, 128462008, '900000000000003001', 'Metastatic neoplasm (disease)'),
+	(2007, '20140131', 1, 254837009, '900000000000003001', 'Malignant neoplasm of breast (disorder)'),
+	(2008, '20140131', 1, 315004001, '900000000000013009', 'Metastasis from malignant tumor of breast'),
+	(2009, '20140131', 1, 408643008, '900000000000003001', 'Infiltrating duct carcinoma of breast (disorder)'),
+	(2010, '20140131', 1, 123037004, '900000000000003001', 'Body structure (body structure)'),
+	(2011, '20140131', 1, 76752008, '900000000000003001', 'Breast structure (body structure)'),
+	(2012, '20140131', 1, 215350009, '900000000000003001', 'Accident involving being caught in door of road vehicle NEC, occupant of tram injured (event)'),
+]
+
+
+def write_rf2(directory, relationships, descriptions, release='Full', date='20140131'):
+	""" Writes RF2 relationship and description files in the layout of the
+	SNOMED CT distribution, returns the table to file mapping.
+	"""
+	rel_path = os.path.join(directory, 'sct2_Relationship_{}_INT_{}.txt'.format(release, date))
+	with open(rel_path, 'w', encoding='utf-8') as handle:
+		handle.write('id\teffectiveTime\tactive\tmoduleId\tsourceId\tdestinationId\trelationshipGroup\ttypeId\tcharacteristicTypeId\tmodifierId\r\n')
+		for rid, eff, active, src, dst, typ in relationships:
+			handle.write('{}\t{}\t{}\t900000000000207008\t{}\t{}\t0\t{}\t900000000000011006\t900000000000451002\r\n'.format(rid, eff, active, src, dst, typ))
+	
+	desc_path = os.path.join(directory, 'sct2_Description_{}-en_INT_{}.txt'.format(release, date))
+	with open(desc_path, 'w', encoding='utf-8') as handle:
+		handle.write('id\teffectiveTime\tactive\tmoduleId\tconceptId\tlanguageCode\ttypeId\tterm\tcaseSignificanceId\r\n')
+		for did, eff, active, concept, typ, term in descriptions:
+			handle.write('{}\t{}\t{}\t900000000000207008\t{}\ten\t{}\t{}\t900000000000448009\r\n'.format(did, eff, active, concept, typ, term))
+	
+	return {'descriptions': desc_path, 'relationships': rel_path}
+
+
+class SNOMEDFixtureTestCase(unittest.TestCase):
+	""" Imports the fixture release into a temporary database.
+	"""
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.db_path = os.path.join(self.tmpdir, 'snomed.db')
+		self.rf2_dir = os.path.join(self.tmpdir, 'rf2')
+		os.mkdir(self.rf2_dir)
+		self.files = write_rf2(self.rf2_dir, FIXTURE_RELATIONSHIPS, FIXTURE_DESCRIPTIONS)
+		self._previous_handle = SNOMED.sqlite_handle
+		SNOMED.sqlite_handle = SQLite(self.db_path)
+		SNOMED.setup_tables()
+		SNOMED.import_from_files(self.files)
+	
+	def lookup(self):
+		""" A lookup instance on the fixture database. """
+		return SNOMEDLookup(self.db_path)
+	
+	def tearDown(self):
+		SNOMED.sqlite_handle.close()
+		SNOMED.sqlite_handle = self._previous_handle
+		shutil.rmtree(self.tmpdir)
+
+
 class SNOMEDLookupTest(unittest.TestCase):
 	""" Test :class:`SNOMEDLookup`.
 	"""
@@ -41,4 +123,366 @@ class SNOMEDLookupTest(unittest.TestCase):
 		self.assertTrue(cpt.isa(child.code))
 		child = SNOMEDConcept('408643008')      # Infiltrating duct carcinoma of breast
 		self.assertFalse(cpt.isa(child.code))
+
+
+class SNOMEDImportTest(SNOMEDFixtureTestCase):
+	""" Test :class:`SNOMED` importing.
+	"""
+	def test_bulk_import(self):
+		""" Test that all rows are imported, named and indexed.
+		"""
+		handle = SNOMED.sqlite_handle
+		self.assertEqual(len(FIXTURE_RELATIONSHIPS), handle.executeOne('SELECT COUNT(*) FROM relationships', ())[0])
+		self.assertEqual(len(FIXTURE_DESCRIPTIONS), handle.executeOne('SELECT COUNT(*) FROM descriptions', ())[0])
+		self.assertEqual(13, handle.executeOne("SELECT COUNT(*) FROM relationships WHERE rel_text = 'isa'", ())[0])
+		self.assertEqual(2, handle.executeOne("SELECT COUNT(*) FROM relationships WHERE rel_text = 'finding_site'", ())[0])
+		indexes = [r[0] for r in handle.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+		self.assertIn('source_index', indexes)
+		self.assertIn('destination_index', indexes)
+	
+	def test_pragmas_restored(self):
+		""" Test that relaxed load settings don't outlive the import.
+		"""
+		handle = SNOMED.sqlite_handle
+		self.assertNotEqual('off', handle.executeOne('PRAGMA journal_mode', ())[0])
+		self.assertNotEqual(0, handle.executeOne('PRAGMA synchronous', ())[0])
+
+	def test_latest_version_wins(self):
+		""" Test that a Full release collapses to the latest version per id.
+		"""
+		handle = SNOMED.sqlite_handle
+		handle.execute('DELETE FROM relationships')
+		handle.execute('DELETE FROM descriptions')
+		handle.commit()
+		files = write_rf2(self.rf2_dir,
+			[(1, '20150131', 0, 10, 20, 116680003), (1, '20140131', 1, 10, 20, 116680003), (2, '20140131', 1, 10, 30, 116680003)],
+			[(5, '20140131', 1, 10, '900000000000003001', 'Old term'), (5, '20150131', 1, 10, '900000000000003001', 'New term')],
+			date='20150131')
+		SNOMED.import_from_files(files)
+		self.assertEqual((0, 20150131), handle.executeOne('SELECT active, effective_time FROM relationships WHERE relationship_id = 1', ()))
+		self.assertEqual(('New term',), handle.executeOne('SELECT term FROM descriptions WHERE concept_id = 10', ()))
+	
+	def test_active_only(self):
+		""" Test that inactive rows can be dropped.
+		"""
+		handle = SNOMED.sqlite_handle
+		handle.execute('DELETE FROM relationships')
+		handle.execute('DELETE FROM descriptions')
+		handle.commit()
+		SNOMED.import_from_files(self.files, active_only=True)
+		self.assertIsNone(handle.executeOne('SELECT * FROM relationships WHERE relationship_id = 1014', ()))
+		self.assertEqual(len(FIXTURE_RELATIONSHIPS) - 1, handle.executeOne('SELECT COUNT(*) FROM relationships', ())[0])
+	
+	def test_prefers_snapshot_files(self):
+		""" Test that Snapshot files are picked over Full files.
+		"""
+		snapshot = write_rf2(self.rf2_dir, FIXTURE_RELATIONSHIPS, FIXTURE_DESCRIPTIONS, release='Snapshot')
+		self.assertEqual(snapshot, SNOMED.find_needed_files(self.rf2_dir))
+		self.assertEqual(self.files, SNOMED.find_needed_files(self.rf2_dir, 'Full'))
+
+
+class SNOMEDClosureTest(SNOMEDFixtureTestCase):
+	""" Test the is-a closure.
+	"""
+	def test_closure_matches_walk(self):
+		""" Test that closure probes answer like walking the hierarchy.
+		"""
+		closure = self.lookup()
+		self.assertTrue(closure.has_isa_closure())
+		walk = self.lookup()
+		walk._has_closure = False
+		
+		concepts = set(str(r[3]) for r in FIXTURE_RELATIONSHIPS) | set(str(r[4]) for r in FIXTURE_RELATIONSHIPS)
+		for child in concepts:
+			for parent in concepts:
+				self.assertEqual(walk.lookup_if_isa(child, parent), closure.lookup_if_isa(child, parent), '{} isa {}'.format(child, parent))
+	
+	def test_isa(self):
+		""" Test hierarchical lookup through the closure.
+		"""
+		lookup = self.lookup()
+		self.assertTrue(lookup.lookup_if_isa('315004001', '55342001'))
+		self.assertTrue(lookup.lookup_if_isa('315004001', '254837009'))
+		self.assertFalse(lookup.lookup_if_isa('315004001', '408643008'))
+		self.assertFalse(lookup.lookup_if_isa('215350009', '55342001'))		# inactive relationship
+		self.assertFalse(lookup.lookup_if_isa('315004001', '76752008'))		# finding site, not is-a
+
+
+class SNOMEDHierarchyTest(SNOMEDFixtureTestCase):
+	""" Test :class:`SNOMEDHierarchy`.
+	"""
+	def test_matches_lookup(self):
+		""" Test that the in-memory hierarchy answers like `lookup_if_isa`.
+		"""
+		lookup = self.lookup()
+		hierarchy = SNOMEDHierarchy.load(lookup)
+		concepts = set(str(r[3]) for r in FIXTURE_RELATIONSHIPS) | set(str(r[4]) for r in FIXTURE_RELATIONSHIPS)
+		for child in concepts:
+			for parent in concepts:
+				self.assertEqual(lookup.lookup_if_isa(child, parent), hierarchy.isa(child, parent), '{} isa {}'.format(child, parent))
+		self.assertFalse(hierarchy.isa('315004001', '999999'))
+	
+	def test_random_polyhierarchy(self):
+		""" Test interval labels against a brute-force closure on random DAGs.
+		"""
+		rnd = random.Random(42)
+		for _ in range(5):
+			num = 200
+			edges = set()
+			for child in range(1, num):
+				for _ in range(rnd.choice([1, 1, 2, 3])):
+					edges.add((child, rnd.randrange(0, child)))
+			
+			ancestors = {}
+			for child in range(num):
+				anc = set()
+				for c, p in edges:
+					if c == child:
+						anc.add(p)
+						anc |= ancestors[p]
+				ancestors[child] = anc
+			
+			hierarchy = SNOMEDHierarchy(rnd.sample(sorted(edges), len(edges)))
+			for child in range(num):
+				for parent in range(num):
+					self.assertEqual(parent in ancestors[child], hierarchy.isa(child, parent))
+	
+	def test_random_cycles(self):
+		""" Test random graphs with cycles against brute-force reachability,
+		which is what `lookup_if_isa` walks.
+		"""
+		rnd = random.Random(7)
+		for _ in range(5):
+			num = 120
+			edges = set()
+			for child in range(1, num):
+				for _ in range(rnd.choice([1, 1, 2])):
+					edges.add((child, rnd.randrange(0, child)))
+			for _ in range(8):
+				child = rnd.randrange(0, num)
+				edges.add((child, rnd.randrange(child, num)))		# back-edges and self-loops
+			
+			parents = {}
+			for c, p in edges:
+				parents.setdefault(c, set()).add(p)
+			ancestors = {}
+			for child in range(num):
+				anc = set()
+				pending = list(parents.get(child, ()))
+				while len(pending) > 0:
+					current = pending.pop()
+					if current not in anc:
+						anc.add(current)
+						pending.extend(parents.get(current, ()))
+				ancestors[child] = anc
+			
+			hierarchy = SNOMEDHierarchy(rnd.sample(sorted(edges), len(edges)))
+			for child in range(num):
+				for parent in range(num):
+					self.assertEqual(parent in ancestors[child], hierarchy.isa(child, parent), '{} isa {}'.format(child, parent))
+			concepts = [str(n) for n in range(num)]
+			self.assertEqual({str(c): set(str(p) for p in ancestors[c]) for c in range(num)}, hierarchy.isa_many(concepts, concepts))
+	
+	def test_cycle_and_invalid_ids(self):
+		hierarchy = SNOMEDHierarchy([(1, 2), (2, 1), (3, 1)])
+		self.assertTrue(hierarchy.isa(1, 2))
+		self.assertTrue(hierarchy.isa(2, 1))
+		self.assertTrue(hierarchy.isa(1, 1))
+		self.assertTrue(hierarchy.isa(3, 2))
+		self.assertFalse(hierarchy.isa(3, 3))
+		self.assertFalse(hierarchy.isa(1, 3))
+		self.assertFalse(hierarchy.isa('abc', 1))
+		self.assertFalse(hierarchy.isa(3, None))
+		self.assertNotIn('abc', hierarchy)
+		self.assertEqual({'3': {'1'}, 'abc': set()}, hierarchy.isa_many(['3', 'abc'], ['1', 'abc']))
+	
+	def test_lookup_uses_hierarchy(self):
+		lookup = self.lookup()
+		lookup.load_hierarchy()
+		lookup.sqlite = None		# no more SQL
+		self.assertTrue(lookup.lookup_if_isa('408643008', '363346000'))
+
+
+class SNOMEDIsaManyTest(SNOMEDFixtureTestCase):
+	""" Test :meth:`SNOMEDLookup.isa_many`.
+	"""
+	def test_all_strategies_agree(self):
+		""" Test hierarchy, closure and walk against single lookups.
+		"""
+		concepts = sorted(set(str(r[3]) for r in FIXTURE_RELATIONSHIPS) | set(str(r[4]) for r in FIXTURE_RELATIONSHIPS))
+		single = self.lookup()
+		expected = {c: set(p for p in concepts if single.lookup_if_isa(c, p)) for c in concepts}
+		
+		with_hierarchy = self.lookup()
+		with_hierarchy.load_hierarchy()
+		with_closure = self.lookup()
+		with_walk = self.lookup()
+		with_walk._has_closure = False
+		for lookup in (with_hierarchy, with_closure, with_walk):
+			self.assertEqual(expected, lookup.isa_many(concepts, concepts))
+			self.assertFalse(lookup.sqlite.handle.in_transaction)
+	
+	def test_matrix(self):
+		lookup = self.lookup()
+		matrix = lookup.isa_many(['315004001', 408643008, '999'], ['254837009', '128462008'], as_matrix=True)
+		self.assertEqual([[True, True], [True, False], [False, False]], matrix)
+
+
+class SNOMEDTraversalTest(SNOMEDFixtureTestCase):
+	""" Test ancestor/descendant enumeration and expansion.
+	"""
+	def test_ancestors(self):
+		lookup = self.lookup()
+		ancestors = list(lookup.lookup_ancestors_of('315004001'))
+		self.assertEqual({'128462008', '254837009'}, set(c for c, d in ancestors if 1 == d))
+		self.assertEqual([('363346000', 2), ('55342001', 3), ('64572001', 4), ('404684003', 5), ('138875005', 6)], [a for a in ancestors if a[1] > 1])
+		self.assertEqual(3, len(list(lookup.lookup_ancestors_of('315004001', max_depth=2))))
+	
+	def test_descendants(self):
+		lookup = self.lookup()
+		descendants = dict(lookup.lookup_descendants_of('363346000'))
+		self.assertEqual({'128462008': 1, '254837009': 1, '315004001': 2, '408643008': 2}, descendants)
+		self.assertEqual(['55342001'], [c for c, d in lookup.lookup_descendants_of('64572001', max_depth=1)])
+	
+	def test_expansion(self):
+		""" Test expansion with and without the closure, into a set and a table.
+		"""
+		expected = {'55342001', '363346000', '128462008', '254837009', '315004001', '408643008'}
+		with_closure = self.lookup()
+		without_closure = self.lookup()
+		without_closure._has_closure = False
+		for lookup in (with_closure, without_closure):
+			self.assertEqual(expected, lookup.expand_descendants('55342001'))
+			self.assertEqual(expected - {'55342001'}, lookup.expand_descendants(55342001, include_self=False))
+			self.assertEqual(6, lookup.expand_descendants('55342001', temp_table='neoplasms'))
+			self.assertFalse(lookup.sqlite.handle.in_transaction)
+			self.assertEqual(6, lookup.sqlite.executeOne('SELECT COUNT(*) FROM neoplasms', ())[0])
+
+
+class SNOMEDSearchTest(SNOMEDFixtureTestCase):
+	""" Test term search.
+	"""
+	def test_prefix_search(self):
+		lookup = self.lookup()
+		found = lookup.lookup_code_for_name('metast brea')
+		self.assertEqual([('315004001', 'Metastasis from malignant tumor of breast', 'synonym')], found)
+		found = [r[0] for r in lookup.lookup_code_for_name('breast')]
+		self.assertEqual({'315004001', '254837009', '408643008', '76752008'}, set(found))
+		self.assertEqual([], lookup.lookup_code_for_name('"*'))
+		
+		# the index is looked up once, not for every search
+		queries = []
+		lookup.sqlite.handle.set_trace_callback(queries.append)
+		lookup.lookup_code_for_name('breast')
+		lookup.sqlite.handle.set_trace_callback(None)
+		self.assertEqual([], [q for q in queries if 'sqlite_master' in q])
+	
+	def test_filters_and_paging(self):
+		lookup = self.lookup()
+		self.assertEqual(3, len(lookup.lookup_code_for_name('breast', isa='full')))
+		self.assertEqual(2, len(lookup.lookup_code_for_name('breast', limit=2)))
+		all_ids = [r[0] for r in lookup.lookup_code_for_name('breast')]
+		self.assertEqual(all_ids[2:], [r[0] for r in lookup.lookup_code_for_name('breast', offset=2)])
+	
+	def test_index_follows_updates(self):
+		handle = SNOMED.sqlite_handle
+		handle.execute("UPDATE descriptions SET term = 'Secondary breast cancer' WHERE concept_id = 315004001")
+		handle.commit()
+		lookup = self.lookup()
+		self.assertEqual(['315004001'], [r[0] for r in lookup.lookup_code_for_name('secondary')])
+		self.assertEqual([], lookup.lookup_code_for_name('metastasis'))
+
+
+class SNOMEDDeltaImportTest(SNOMEDFixtureTestCase):
+	""" Test applying Delta releases.
+	"""
+	def apply_delta(self):
+		delta_dir = os.path.join(self.tmpdir, 'delta')
+		os.mkdir(delta_dir)
+		write_rf2(delta_dir,
+			[(1014, '20140731', 1, 215350009, 55342001, 116680003),		# tram accident isa Neoplasia again
+			(1007, '20140731', 0, 315004001, 128462008, 116680003),		# no longer isa Metastatic neoplasm
+			(1016, '20140731', 1, 408643008, 123037004, 363698007),		# new, not an isa
+			(1003, '20130131', 0, 55342001, 64572001, 116680003)],		# older than what we have
+			[(2008, '20140731', 1, 315004001, '900000000000013009', 'Secondary malignant neoplasm of breast'),
+			(2013, '20140731', 1, 99999001, '900000000000003001', 'New concept')],
+			release='Delta', date='20140731')
+		SNOMED.import_from_files(SNOMED.find_needed_files(delta_dir, 'Delta'), delta=True)
+	
+	def test_upserts(self):
+		self.apply_delta()
+		handle = SNOMED.sqlite_handle
+		self.assertEqual(len(FIXTURE_RELATIONSHIPS) + 1, handle.executeOne('SELECT COUNT(*) FROM relationships', ())[0])
+		self.assertEqual((1, 'isa'), handle.executeOne('SELECT active, rel_text FROM relationships WHERE relationship_id = 1014', ()))
+		self.assertEqual((1, 20140131), handle.executeOne('SELECT active, effective_time FROM relationships WHERE relationship_id = 1003', ()))
+		self.assertEqual(len(FIXTURE_DESCRIPTIONS) + 1, handle.executeOne('SELECT COUNT(*) FROM descriptions', ())[0])
+		
+		lookup = self.lookup()
+		self.assertEqual(['315004001'], [r[0] for r in lookup.lookup_code_for_name('secondary breast')])
+		self.assertEqual([], lookup.lookup_code_for_name('metastasis'))
+		self.assertEqual(['99999001'], [r[0] for r in lookup.lookup_code_for_name('new concept')])
+	
+	def test_old_database(self):
+		""" Test that databases without Delta support are refused clearly.
+		"""
+		handle = SNOMED.sqlite_handle
+		handle.execute('DROP TABLE descriptions')
+		handle.execute('CREATE TABLE descriptions (concept_id INTEGER PRIMARY KEY, lang TEXT, term TEXT, isa VARCHAR, active INT)')
+		with self.assertRaisesRegex(Exception, 'lacks description_id, effective_time'):
+			self.apply_delta()
+	
+	def test_closure_matches_rebuild(self):
+		self.apply_delta()
+		handle = SNOMED.sqlite_handle
+		query = 'SELECT descendant_id, ancestor_id FROM isa_closure ORDER BY descendant_id, ancestor_id'
+		updated = list(handle.execute(query))
+		SNOMED.build_isa_closure()
+		self.assertEqual(list(handle.execute(query)), updated)
+		
+		lookup = self.lookup()
+		self.assertTrue(lookup.lookup_if_isa('215350009', '64572001'))
+		self.assertFalse(lookup.lookup_if_isa('315004001', '128462008'))
+		self.assertTrue(lookup.lookup_if_isa('315004001', '363346000'))
+	
+	def test_description_replacement(self):
+		""" Test that an active description replaces an inactivated one.
+		"""
+		delta_dir = os.path.join(self.tmpdir, 'delta')
+		os.mkdir(delta_dir)
+		write_rf2(delta_dir, [],
+			[(2004, '20140731', 0, 55342001, '900000000000003001', 'Neoplasia'),
+			(2050, '20140731', 1, 55342001, '900000000000003001', 'Neoplasm')],
+			release='Delta', date='20140731')
+		SNOMED.import_from_files(SNOMED.find_needed_files(delta_dir, 'Delta'), delta=True)
+		self.assertEqual((2050, 'Neoplasm', 1), SNOMED.sqlite_handle.executeOne('SELECT description_id, term, active FROM descriptions WHERE concept_id = 55342001', ()))
+
+
+class SNOMEDConceptTest(SNOMEDFixtureTestCase):
+	""" Test :class:`SNOMEDConcept` on the fixture database.
+	"""
+	def setUp(self):
+		super().setUp()
+		self._previous_uplooker = SNOMEDConcept.uplooker
+		SNOMEDConcept.uplooker = self.lookup()
+	
+	def tearDown(self):
+		SNOMEDConcept.uplooker = self._previous_uplooker
+		super().tearDown()
+	
+	def test_interned(self):
+		cpt = SNOMEDConcept('315004001')
+		self.assertIs(cpt, SNOMEDConcept(315004001))
+		self.assertFalse(hasattr(cpt, '__dict__'))
+		self.assertEqual('Metastasis from malignant tumor of breast', cpt.term)
 	
+	def test_prefetch(self):
+		concepts = [SNOMEDConcept(code) for code in ('315004001', '55342001', '76752008', '1')]
+		queries = []
+		SNOMEDConcept.uplooker.sqlite.connect()
+		SNOMEDConcept.uplooker.sqlite.handle.set_trace_callback(queries.append)
+		self.assertEqual(4, SNOMEDConcept.prefetch(concepts))
+		self.assertEqual(0, SNOMEDConcept.prefetch(concepts))
+		self.assertEqual(['Metastasis from malignant tumor of breast', 'Neoplasia', 'Breast structure (body structure)', ''],
+			[cpt.term for cpt in concepts])
+		SNOMEDConcept.uplooker.sqlite.handle.set_trace_callback(None)
+		self.assertEqual(1, len(queries))
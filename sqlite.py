@@ -93,6 +93,32 @@ class SQLite(object):
 		return 0
 
 
+	def executeMany(self, sql, seq_of_params):
+		""" Executes an SQL command against all parameter tuples in the given
+		sequence or iterator and returns the number of affected rows.
+		"""
+		if not sql or 0 == len(sql):
+			raise Exception('No SQL to execute')
+		if not self.cursor:
+			self.connect()
+		
+		self.cursor.executemany(sql, seq_of_params)
+		return self.cursor.rowcount
+
+
+	def executeIn(self, sql, values, chunk_size=500, params=()):
+		""" Executes an SQL command with one "IN ({})" placeholder for chunks
+		of `chunk_size` of the given values, staying below SQLite's limit of
+		bound parameters, and yields all rows returned.
+		`params` are bound after the values, for placeholders following the
+		IN clause.
+		"""
+		for i in range(0, len(values), chunk_size):
+			chunk = values[i:i + chunk_size]
+			for row in self.execute(sql.format(', '.join('?' * len(chunk))), list(chunk) + list(params)):
+				yield row
+
+
 	def executeOne(self, sql, params):
 		""" Returns the first row returned by executing the command
 		"""
@@ -8,9 +8,12 @@
 #
 
 
+import re
 import sys
 import os.path
 import logging
+import unicodedata
+import collections
 
 from sqlite import SQLite			# for py-umls standalone
 
@@ -32,6 +35,70 @@ class UMLS (object):
 		if not os.path.exists(umls_db):
 			raise Exception("The UMLS database at {} does not exist. Run the import script `databases/umls.sh`."
 				.format(os.path.abspath(umls_db)))
+	
+	@classmethod
+	def build_search_index(cls, sqlite):
+		""" Creates `descriptions_fts`, a full-text index over the names in
+		`descriptions` using the trigram tokenizer, so that substring searches
+		don't have to scan the table. `databases/umls.sh` creates it for new
+		databases. Replaces an existing index.
+		
+		:param sqlite: The :class:`SQLite` instance of the UMLS database
+		"""
+		sqlite.execute('DROP TABLE IF EXISTS descriptions_fts')
+		sqlite.execute('''CREATE VIRTUAL TABLE descriptions_fts USING fts5(
+				STR,
+				content='descriptions', tokenize='trigram'
+			)''')
+		sqlite.execute("INSERT INTO descriptions_fts (descriptions_fts) VALUES ('rebuild')")
+		sqlite.commit()
+	
+	@classmethod
+	def build_code_map(cls, sqlite):
+		""" Creates `code_cui`, mapping every source code (SAB, CODE) in
+		MRCONSO to its CUIs, with indexes for both directions, so codes can be
+		translated between vocabularies with indexed joins.
+		`databases/umls.sh` creates it for new databases. Replaces an existing
+		table.
+		
+		:param sqlite: The :class:`SQLite` instance of the UMLS database
+		"""
+		sqlite.execute('DROP TABLE IF EXISTS code_cui')
+		sqlite.execute('CREATE TABLE code_cui (SAB TEXT, CODE TEXT, CUI TEXT, PRIMARY KEY (SAB, CODE, CUI)) WITHOUT ROWID')
+		sqlite.execute("INSERT OR IGNORE INTO code_cui SELECT SAB, CODE, CUI FROM MRCONSO WHERE CODE != 'NOCODE' ORDER BY SAB, CODE, CUI")
+		sqlite.execute('CREATE INDEX X_CUI_code_cui ON code_cui (CUI, SAB, CODE)')
+		sqlite.commit()
+	
+	@classmethod
+	def build_normalized_index(cls, sqlite, chunk_size=50000):
+		""" Creates `normalized_names`, mapping the normalized form of every
+		English name in MRCONSO (see `normalize_name()`) to CUI and SAB, so
+		that spelling variants of a name are found with a single index probe.
+		`databases/umls.sh` creates it for new databases. Replaces an
+		existing table.
+		
+		:param sqlite: The :class:`SQLite` instance of the UMLS database
+		"""
+		sqlite.execute('DROP TABLE IF EXISTS normalized_names')
+		sqlite.execute('CREATE TABLE normalized_names (NSTR TEXT, CUI TEXT, SAB TEXT, PRIMARY KEY (NSTR, CUI, SAB)) WITHOUT ROWID')
+		
+		# own cursor, we're streaming all names
+		sqlite.connect()
+		cursor = sqlite.handle.cursor()
+		insert = 'INSERT OR IGNORE INTO normalized_names VALUES (?, ?, ?)'
+		try:
+			chunk = []
+			for cui, sab, name in cursor.execute("SELECT CUI, SAB, STR FROM MRCONSO WHERE LAT = 'ENG'"):
+				normalized = normalize_name(name)
+				if normalized:
+					chunk.append((normalized, cui, sab))
+				if len(chunk) >= chunk_size:
+					sqlite.executeMany(insert, chunk)
+					chunk = []
+			sqlite.executeMany(insert, chunk)
+		finally:
+			cursor.close()
+		sqlite.commit()
 
 
 
@@ -41,10 +108,23 @@ class UMLSLookup (object):
 	sqlite = None
 	did_check_dbs = False
 	preferred_sources = ['"SNOMEDCT"', '"MTH"']	
+	cache_size = 10000		# number of CUIs whose descriptions we keep around
 	
-	def __init__(self):
+	def __init__(self, database=None):
 		absolute = os.path.dirname(os.path.realpath(__file__))
-		self.sqlite = SQLite.get(os.path.join(absolute, 'databases/umls.db'))
+		self.sqlite = SQLite.get(database or os.path.join(absolute, 'databases/umls.db'))
+		self._has_search_index = None
+		self._has_code_map = None
+		self._has_relations = None
+		self._code_cache = collections.OrderedDict()
+	
+	def has_search_index(self):
+		""" Whether the database has the full-text index built by
+		:meth:`UMLS.build_search_index`.
+		"""
+		if self._has_search_index is None:
+			self._has_search_index = self.sqlite.hasTable('descriptions_fts')
+		return self._has_search_index
 	
 	def lookup_code(self, cui, preferred=True):
 		""" Return a list with triples that contain:
@@ -59,39 +139,77 @@ class UMLSLookup (object):
 		
 		:returns: A list of triples with (name, sab, sty)
 		"""
-		if cui is None or len(cui) < 1:
-			return []
-		
-		# lazy UMLS db checking
-		if not UMLSLookup.did_check_dbs:
-			UMLS.check_database()
-			UMLSLookup.did_check_dbs = True
+		return self.lookup_code_many([cui], preferred)[0]
+	
+	def lookup_code_many(self, cuis, preferred=True):
+		""" Batch variant of `lookup_code`: looks up a list of CUIs, which
+		may be negated ("-C0002962") and carry "@" suffixes, and returns a
+		list with the result `lookup_code` would return for each, in the same
+		order.
 		
-		# take care of negations
-		negated = '-' == cui[0]
-		if negated:
-			cui = cui[1:]
+		CUIs are de-duplicated and those not found in our LRU cache of the
+		last `cache_size` CUIs are looked up together.
+		"""
+		# take care of negations and "@" suffixes
+		parsed = []
+		for cui in cuis:
+			if cui is None or len(cui) < 1:
+				parsed.append((None, False))
+				continue
+			negated = '-' == cui[0]
+			parsed.append(((cui[1:] if negated else cui).split('@', 1)[0], negated))
 		
-		parts = cui.split('@', 1)
-		lookup_cui = parts[0]
+		# use cached rows, look up the rest
+		cache = self._code_cache
+		rows = {}
+		for lookup_cui, negated in parsed:
+			if lookup_cui is None or lookup_cui in rows:
+				continue
+			key = (lookup_cui, preferred)
+			if key in cache:
+				cache.move_to_end(key)
+				rows[lookup_cui] = cache[key]
+			else:
+				rows[lookup_cui] = None
+		missing = [lookup_cui for lookup_cui, found in rows.items() if found is None]
+		if len(missing) > 0:
+			# lazy UMLS db checking
+			if not UMLSLookup.did_check_dbs:
+				UMLS.check_database()
+				UMLSLookup.did_check_dbs = True
+			
+			rows.update(self._lookup_descriptions(missing, preferred))
+			for lookup_cui in missing:
+				cache[(lookup_cui, preferred)] = rows[lookup_cui]
+			while len(cache) > self.cache_size:
+				cache.popitem(last=False)
 		
+		# return as lists aligned with the input
+		results = []
+		for lookup_cui, negated in parsed:
+			if lookup_cui is None:
+				results.append([])
+			elif negated:
+				results.append(["[NEGATED] {}".format(res[0]) for res in rows[lookup_cui]])
+			else:
+				results.append(list(rows[lookup_cui]))
+		return results
+	
+	def _lookup_descriptions(self, cuis, preferred):
+		""" Returns a dict of CUI to a tuple of (STR, SAB, STY) triples for
+		all given CUIs, queried in chunks by `SQLite.executeIn`.
+		"""
 		# STR: Name
 		# SAB: Abbreviated Source Name
 		# STY: Semantic Type
+		sql = 'SELECT CUI, STR, SAB, STY FROM descriptions WHERE CUI IN ({})'
 		if preferred:
-			sql = 'SELECT STR, SAB, STY FROM descriptions WHERE CUI = ? AND SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
-		else:
-			sql = 'SELECT STR, SAB, STY FROM descriptions WHERE CUI = ?'
+			sql += ' AND SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
 		
-		# return as list
-		arr = []
-		for res in self.sqlite.execute(sql, (lookup_cui,)):
-			if negated:
-				arr.append(("[NEGATED] {}".format(res[0], res[1], res[2])))
-			else:
-				arr.append(res)
-		
-		return arr
+		found = dict((cui, []) for cui in cuis)
+		for res in self.sqlite.executeIn(sql, cuis):
+			found[res[0]].append(res[1:])
+		return dict((cui, tuple(rows)) for cui, rows in found.items())
 	
 	
 	def lookup_code_meaning(self, cui, preferred=True, no_html=True):
@@ -113,11 +231,16 @@ class UMLSLookup (object):
 		return comp.join(names) if len(names) > 0 else ''
 	
 	
-	def lookup_code_for_name(self, name, preferred=True):
+	def lookup_code_for_name(self, name, preferred=True, limit=None):
 		""" Tries to find a good concept code for the given concept name.
 		
-		Uses our indexed `descriptions` table.
+		Finds all names containing `name` (case-insensitive), best matches
+		first, using the trigram index on our `descriptions` table if it has
+		one; names shorter than three characters can't use the index and are
+		looked up with LIKE.
 		
+		:param bool preferred: Only return names from `preferred_sources`
+		:param int limit: The maximum number of results to return
 		:returns: A list of triples with (cui, sab, sty)
 		"""
 		if name is None or len(name) < 1:
@@ -132,26 +255,333 @@ class UMLSLookup (object):
 		# STR: Name
 		# SAB: Abbreviated Source Name
 		# STY: Semantic Type
-		if preferred:
-			sql = 'SELECT CUI, SAB, STY FROM descriptions WHERE STR LIKE ? AND SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
+		if len(name) >= 3 and self.has_search_index():
+			sql = '''SELECT descriptions.CUI, descriptions.SAB, descriptions.STY
+				FROM descriptions_fts JOIN descriptions ON descriptions.rowid = descriptions_fts.rowid
+				WHERE descriptions_fts MATCH ?'''
+			params = ['"{}"'.format(name.replace('"', '""'))]
+			if preferred:
+				sql += ' AND descriptions.SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
+			sql += ' ORDER BY descriptions_fts.rank'
 		else:
-			sql = 'SELECT CUI, SAB, STY FROM descriptions WHERE STR LIKE ?'
+			if preferred:
+				sql = 'SELECT CUI, SAB, STY FROM descriptions WHERE STR LIKE ? AND SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
+			else:
+				sql = 'SELECT CUI, SAB, STY FROM descriptions WHERE STR LIKE ?'
+			params = ['%' + name + '%']
+		if limit is not None:
+			sql += ' LIMIT ?'
+			params.append(limit)
 		
 		# return as list
 		arr = []
-		for res in self.sqlite.execute(sql, ('%' + name + '%',)):
+		for res in self.sqlite.execute(sql, params):
 			arr.append(res)
 		
 		return arr
+	
+	
+	def lookup_code_for_normalized_name(self, name, preferred=True):
+		""" Finds concepts with a name that has the same normalized form as
+		`name`, which tolerates differences in case, punctuation, word order,
+		plurals and stop words, e.g. "Hypertension, Pulmonary" finds
+		"Pulmonary hypertension". Uses the `normalized_names` index, see
+		:meth:`UMLS.build_normalized_index`.
+		
+		:returns: A list of tuples with (cui, sab)
+		"""
+		normalized = normalize_name(name)
+		if not normalized:
+			return []
+		
+		# lazy UMLS db checking
+		if not UMLSLookup.did_check_dbs:
+			UMLS.check_database()
+			UMLSLookup.did_check_dbs = True
+		
+		sql = 'SELECT CUI, SAB FROM normalized_names WHERE NSTR = ?'
+		if preferred:
+			sql += ' AND SAB IN ({})'.format(", ".join(UMLSLookup.preferred_sources))
+		return [res for res in self.sqlite.execute(sql, (normalized,))]
+	
+	
+	# MARK: - Code Mapping
+	
+	def cuis_for_codes(self, sab, codes):
+		""" Maps codes of one vocabulary to CUIs, e.g. SNOMED CT concept ids
+		with `sab` "SNOMEDCT_US".
+		
+		:param str sab: The source vocabulary of `codes`
+		:param codes: A list of codes
+		:returns: A list aligned with `codes`, holding a list of CUIs for
+			every code
+		"""
+		sql = '''SELECT DISTINCT mapping_input.pos, code_cui.CUI
+			FROM mapping_input JOIN {} AS code_cui ON code_cui.SAB = ? AND code_cui.CODE = mapping_input.value'''
+		return self._map_codes(sql, codes, (sab,))
+	
+	def codes_for_cuis(self, cuis, sab):
+		""" Maps CUIs to the codes of one vocabulary, e.g. to RxNorm RXCUIs
+		with `sab` "RXNORM".
+		
+		:param cuis: A list of CUIs
+		:param str sab: The target vocabulary
+		:returns: A list aligned with `cuis`, holding a list of codes for
+			every CUI
+		"""
+		sql = '''SELECT DISTINCT mapping_input.pos, code_cui.CODE
+			FROM mapping_input JOIN {} AS code_cui ON code_cui.CUI = mapping_input.value AND code_cui.SAB = ?
+			WHERE code_cui.CODE != 'NOCODE'
+		'''
+		return self._map_codes(sql, cuis, (sab,))
+	
+	def translate_codes(self, codes, from_sab, to_sab):
+		""" Translates codes between vocabularies through their CUIs, e.g.
+		SNOMED CT concept ids ("SNOMEDCT_US") to LOINC codes ("LNC").
+		
+		:param codes: A list of codes from `from_sab`
+		:returns: A list aligned with `codes`, holding a list of `to_sab`
+			codes for every code
+		"""
+		sql = '''SELECT DISTINCT mapping_input.pos, target.CODE
+			FROM mapping_input
+			JOIN {0} AS source ON source.SAB = ? AND source.CODE = mapping_input.value
+			JOIN {0} AS target ON target.CUI = source.CUI AND target.SAB = ?
+			WHERE target.CODE != 'NOCODE'
+		'''
+		return self._map_codes(sql, codes, (from_sab, to_sab))
+	
+	def _map_codes(self, sql, values, params):
+		""" Runs a mapping query joining `values`, loaded into the temporary
+		`mapping_input` table, against `code_cui` (or MRCONSO in databases
+		without it) and collects the results by position.
+		"""
+		values = list(values)
+		found = [[] for value in values]
+		if 0 == len(values):
+			return found
+		
+		# lazy UMLS db checking
+		if not UMLSLookup.did_check_dbs:
+			UMLS.check_database()
+			UMLSLookup.did_check_dbs = True
+		if self._has_code_map is None:
+			self._has_code_map = self.sqlite.hasTable('code_cui')
+		
+		self.sqlite.execute('CREATE TEMP TABLE IF NOT EXISTS mapping_input (pos INTEGER PRIMARY KEY, value TEXT)')
+		try:
+			self.sqlite.executeMany('INSERT INTO mapping_input VALUES (?, ?)', ((i, value) for i, value in enumerate(values) if value))
+			self.sqlite.commit()		# don't keep the implicit transaction, and our lock on the database, open
+			for pos, res in self.sqlite.execute(sql.format('code_cui' if self._has_code_map else 'MRCONSO'), params):
+				found[pos].append(res)
+		finally:
+			self.sqlite.execute('DELETE FROM mapping_input')
+			self.sqlite.commit()
+		return found
+	
+	
+	# MARK: - Relationships
+	
+	def lookup_related(self, cui, rel=None, rela=None, sab=None):
+		""" Returns the concepts related to the given CUI via MRREL, which
+		must have been imported (run `databases/umls.sh` with
+		UMLS_RELATIONS=1).
+		
+		Relationships are read as in MRREL: the returned CUI has relationship
+		`rel` to `cui`, so "PAR" and "RB" find broader, "CHD" and "RN"
+		narrower concepts.
+		
+		:param rel: Only these relationships, e.g. "PAR" or ["PAR", "RB"]
+		:param rela: Only these relationship attributes, e.g. "isa"
+		:param sab: Only relationships asserted by these sources
+		:returns: A set of tuples (cui, rel, rela, sab)
+		"""
+		if cui is None:
+			return None
+		return self.lookup_related_many([cui], rel, rela, sab)[0]
+	
+	def lookup_related_many(self, cuis, rel=None, rela=None, sab=None, chunk_size=500):
+		""" Batch variant of `lookup_related`, returning a list of sets
+		aligned with `cuis`.
+		"""
+		if self._has_relations is None:
+			self._has_relations = self.sqlite.hasTable('MRREL')
+		if not self._has_relations:
+			raise Exception('MRREL has not been imported, run `databases/umls.sh` with UMLS_RELATIONS=1')
+		
+		sql = 'SELECT CUI1, CUI2, REL, RELA, SAB FROM MRREL WHERE CUI1 IN ({})'
+		params = []
+		for column, values in (('REL', rel), ('RELA', rela), ('SAB', sab)):
+			values = _as_tuple(values)
+			if values is not None:
+				sql += ' AND {} IN ({})'.format(column, ', '.join('?' * len(values)))
+				params.extend(values)
+		
+		found = dict((cui, set()) for cui in cuis if cui)
+		for res in self.sqlite.executeIn(sql, list(found.keys()), chunk_size, params):
+			found[res[0]].add(res[1:])
+		return [found.get(cui, set()) if cui else set() for cui in cuis]
+	
+	def traverse_related(self, cui, rel=None, rela=None, sab=None, max_depth=3):
+		""" Generator following relationships (filtered like in
+		`lookup_related`) breadth-first from `cui`, yielding (cui, depth)
+		tuples for every concept reached within `max_depth` hops, at its
+		shortest depth. Every level is fetched in one batched query.
+		"""
+		return _traverse_related(self, cui, rel, rela, sab, max_depth)
+	
+	def load_relations(self, rel=None, rela=None, sab=None):
+		""" Loads all relationships matching the filters into memory, for
+		hot traversals without SQL; mind that all of MRREL takes several
+		GB of RAM.
+		
+		:returns: A :class:`UMLSRelations` instance
+		"""
+		self.lookup_related_many([])			# checks for MRREL
+		sql = 'SELECT CUI1, CUI2, REL, RELA, SAB FROM MRREL'
+		params = []
+		conditions = []
+		for column, values in (('REL', rel), ('RELA', rela), ('SAB', sab)):
+			values = _as_tuple(values)
+			if values is not None:
+				conditions.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+				params.extend(values)
+		if len(conditions) > 0:
+			sql += ' WHERE ' + ' AND '.join(conditions)
+		return UMLSRelations(self.sqlite.execute(sql, params))
+
+
+class UMLSRelations (object):
+	""" UMLS relationships held in memory, answering the relationship
+	lookups of :class:`UMLSLookup` from a dictionary. Create instances with
+	:meth:`UMLSLookup.load_relations`.
+	"""
+	
+	def __init__(self, rows):
+		""" Takes (cui1, cui2, rel, rela, sab) rows. """
+		self.adjacency = {}
+		for cui1, cui2, rel, rela, sab in rows:
+			self.adjacency.setdefault(cui1, set()).add((sys.intern(cui2), sys.intern(rel or ''), sys.intern(rela or ''), sys.intern(sab or '')))
+	
+	def lookup_related(self, cui, rel=None, rela=None, sab=None):
+		if cui is None:
+			return None
+		return self.lookup_related_many([cui], rel, rela, sab)[0]
+	
+	def lookup_related_many(self, cuis, rel=None, rela=None, sab=None):
+		rel, rela, sab = _as_tuple(rel), _as_tuple(rela), _as_tuple(sab)
+		found = []
+		for cui in cuis:
+			edges = self.adjacency.get(cui, set())
+			if rel is not None or rela is not None or sab is not None:
+				edges = set(edge for edge in edges
+					if (rel is None or edge[1] in rel) and (rela is None or edge[2] in rela) and (sab is None or edge[3] in sab))
+			found.append(edges)
+		return found
+	
+	def traverse_related(self, cui, rel=None, rela=None, sab=None, max_depth=3):
+		return _traverse_related(self, cui, rel, rela, sab, max_depth)
+
+
+_word_re = re.compile(r"[^\W_]+")
+
+# words dropped from normalized names, like those dropped by the LVG "norm" tool
+_stop_words = frozenset(['a', 'an', 'and', 'by', 'for', 'in', 'nos', 'of', 'on', 'the', 'to', 'unspecified', 'with', 'without'])
+
+# words ending in "s" that are singular or have no singular
+_invariant_words = frozenset(['ascites', 'atlas', 'bias', 'biceps', 'caries', 'diabetes', 'erysipelas', 'facies',
+	'faeces', 'feces', 'forceps', 'herpes', 'lens', 'measles', 'menses', 'mumps', 'news', 'pancreas', 'pubes',
+	'rabies', 'rickets', 'scabies', 'series', 'shingles', 'species', 'triceps'])
+
+# singulars ending in "-use" and "-ose", whose plurals are not those of "-us" and "-osis"
+_use_words = frozenset(['abuse', 'accuse', 'amuse', 'confuse', 'diffuse', 'disuse', 'excuse', 'fuse', 'infuse',
+	'misuse', 'muse', 'overuse', 'peruse', 'recluse', 'refuse', 'ruse', 'suffuse', 'transfuse', 'use'])
+_ose_words = frozenset(['close', 'dose', 'hose', 'lose', 'nose', 'rose', 'ribose', 'dextrose', 'sucrose', 'mannose'])
+
+def normalize_name(name):
+	""" Normalizes a concept name in the spirit of the UMLS normalized
+	string index (MRXNS_ENG): lowercases, strips diacritics, punctuation,
+	possessives and stop words, reduces plurals to their singular and sorts
+	the unique remaining words.
+	
+	:returns: The normalized name as a string, '' if nothing remains
+	"""
+	if not name:
+		return ''
+	name = name.lower()
+	if not name.isascii():
+		name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+	name = name.replace("'s ", ' ').replace("'s,", ',')
+	if name.endswith("'s"):
+		name = name[:-2]
+	words = set(_singular(word) for word in _word_re.findall(name) if word not in _stop_words)
+	return ' '.join(sorted(words))
+
+def _singular(word):
+	""" Strips regular English plural endings, a rough stand-in for LVG's
+	lexicon-based uninflection. """
+	if len(word) <= 3 or not word.endswith('s') or word.endswith(('ss', 'us', 'is')) or word in _invariant_words:
+		return word
+	if word.endswith('uses'):
+		if word[:-1] in _use_words or word[-5:-4] in 'aeiou':		# causes, houses
+			return word[:-1]
+		return word[:-2]		# viruses
+	if word.endswith('oses'):
+		if word[:-1] in _ose_words or word[:-1].endswith(('cose', 'lose', 'pose', 'tose')):		# glucoses, purposes
+			return word[:-1]
+		return word[:-2] + 'is'		# diagnoses, stenoses
+	if word.endswith('ies') and len(word) > 4:
+		return word[:-3] + 'y'
+	if word.endswith(('sses', 'xes', 'zes', 'ches', 'shes')):
+		return word[:-2]
+	return word[:-1]
+
+def _as_tuple(values):
+	""" Turns a single string into a tuple, None stays None. """
+	if values is None:
+		return None
+	return (values,) if isinstance(values, str) else tuple(values)
+
+def _traverse_related(lookup, cui, rel, rela, sab, max_depth):
+	if not cui:
+		return
+	seen = set([cui])
+	level = [cui]
+	depth = 0
+	while len(level) > 0 and (max_depth is None or depth < max_depth):
+		depth += 1
+		next_level = []
+		for edges in lookup.lookup_related_many(level, rel, rela, sab):
+			for edge in edges:
+				if edge[0] not in seen:
+					seen.add(edge[0])
+					next_level.append(edge[0])
+		for related in next_level:
+			yield (related, depth)
+		level = next_level
 
 
 
 # running this as a script does the database setup/check
 if '__main__' == __name__:
+	# build derived tables and indexes, called by `databases/umls.sh`
+	builders = {
+		'--code-map': UMLS.build_code_map,
+		'--normalized-index': UMLS.build_normalized_index,
+		'--search-index': UMLS.build_search_index,
+	}
+	if len(sys.argv) > 2 and sys.argv[1] in builders:
+		builders[sys.argv[1]](SQLite(sys.argv[2]))
+		sys.exit(0)
+	
 	UMLS.check_database()
 	
 	# examples
 	look = UMLSLookup()
+	if not look.has_search_index():
+		print("Building the search index, this takes a few minutes")
+		UMLS.build_search_index(look.sqlite)
+		look._has_search_index = True
 	code = 'C0002962'
 	meaning = look.lookup_code_meaning(code)
 	print('UMLS code "{0}":  {1}'.format(code, meaning))
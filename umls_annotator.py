@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	Dictionary-based annotation of free text with UMLS concepts.
+#
+#	The names in our UMLS `descriptions` table, optionally restricted to some
+#	sources (SAB) and semantic types (TUI), are compiled into a trie over
+#	normalized tokens, held in flat integer arrays. Scanning a text walks
+#	that trie from every token that can start a name and reports the longest
+#	names found, together with their CUI, SAB and STY. Building the trie takes
+#	a while, so it can be saved to and loaded from a file:
+#
+#	    annotator = UMLSAnnotator.build(semantic_types=['T047', 'T184'])
+#	    annotator.save('annotator.bin')
+#	    annotator = UMLSAnnotator.load('annotator.bin')
+#	    for span, cui, sab, sty in annotator.annotate(text):
+#	        ...
+
+import re
+import sys
+import json
+import time
+import bisect
+import logging
+import os.path
+import operator
+import unicodedata
+from array import array
+sys.path.insert(0, os.path.dirname(__file__))
+
+from umls import UMLSLookup
+
+
+_token_re = re.compile(r'\w+')
+
+
+def normalize_token(token):
+	""" Normalizes a token for matching: lowercases and strips diacritics.
+	"""
+	token = token.lower()
+	if not token.isascii():
+		token = ''.join(c for c in unicodedata.normalize('NFKD', token) if not unicodedata.combining(c))
+	return token
+
+
+class UMLSAnnotator(object):
+	""" Finds UMLS concept names in text.
+	
+	Tokens are mapped to integer ids through `vocabulary` and names to token
+	id sequences, which are compiled into a trie held in flat integer arrays:
+	the edges leaving node `n` are `labels[offsets[n]:offsets[n + 1]]`,
+	sorted token ids, leading to the nodes in `targets` at the same
+	positions, with node 0 being the root. The names ending at node `n` are
+	`outputs[output_offsets[n]:output_offsets[n + 1]]`, indexes into the
+	`concepts` list of (CUI, SAB, STY) tuples. That's about 20 bytes per
+	node, `nbytes()` returns the exact array size.
+	
+	Names added with `add()` are collected and compiled into the arrays the
+	next time the annotator is used or saved.
+	"""
+	
+	file_format = 2
+	magic = b'UMLSAnnotator\n'
+	
+	def __init__(self):
+		self.vocabulary = {}
+		self.concepts = []
+		self.offsets = array('i', [0, 0])
+		self.labels = array('i')
+		self.targets = array('i')
+		self.output_offsets = array('i', [0, 0])
+		self.outputs = array('i')
+		self._concept_ids = None
+		self._pending = []
+		self._root = None
+	
+	@classmethod
+	def build(cls, lookup=None, sources=None, semantic_types=None, min_length=3):
+		""" Compiles the names in the `descriptions` table of the UMLS
+		database into a new annotator.
+		
+		:param lookup: The :class:`UMLSLookup` whose database to read, uses
+			our default database if omitted
+		:param sources: Only use names from these SABs, e.g. ["SNOMEDCT"]
+		:param semantic_types: Only use concepts with one of these TUIs
+		:param int min_length: Skip names shorter than this many characters
+			after normalization, which are mostly noise
+		"""
+		lookup = lookup or UMLSLookup()
+		start = time.time()
+		annotator = cls()
+		
+		sql = 'SELECT CUI, SAB, STY, STR FROM descriptions'
+		params = []
+		if sources:
+			sql += ' WHERE SAB IN ({})'.format(', '.join('?' * len(sources)))
+			params.extend(sources)
+		semantic_types = set(semantic_types) if semantic_types else None
+		
+		# own cursor, we're streaming all names
+		lookup.sqlite.connect()
+		cursor = lookup.sqlite.handle.cursor()
+		num = 0
+		try:
+			for cui, sab, sty, name in cursor.execute(sql, params):
+				if semantic_types is not None and semantic_types.isdisjoint((sty or '').split('|')):
+					continue
+				if annotator.add(name, cui, sab, sty, min_length):
+					num += 1
+		finally:
+			cursor.close()
+		annotator.compile()
+		
+		logging.info('Compiled {} names into {} trie nodes, {:.1f} MB of arrays, in {:.1f} s'
+			.format(num, len(annotator), annotator.nbytes() / 1024 / 1024, time.time() - start))
+		return annotator
+	
+	def __len__(self):
+		""" The number of trie nodes, not counting names not yet compiled. """
+		return len(self.offsets) - 1
+	
+	def nbytes(self):
+		""" Size of the trie arrays in bytes; vocabulary and concepts come on
+		top of that.
+		"""
+		return sum(a.itemsize * len(a) for a in (self.offsets, self.labels, self.targets, self.output_offsets, self.outputs))
+	
+	def add(self, name, cui, sab, sty, min_length=0):
+		""" Adds a name for the given concept, returns whether it was added.
+		"""
+		tokens = [normalize_token(token) for token in _token_re.findall(name or '')]
+		if 0 == len(tokens) or sum(len(token) for token in tokens) + len(tokens) - 1 < min_length:
+			return False
+		
+		vocabulary = self.vocabulary
+		key = []
+		for token in tokens:
+			token_id = vocabulary.get(token)
+			if token_id is None:
+				token_id = vocabulary[token] = len(vocabulary)
+			key.append(token_id)
+		
+		if self._concept_ids is None:
+			self._concept_ids = {concept: i for i, concept in enumerate(self.concepts)}
+		concept = (sys.intern(cui), sys.intern(sab or ''), sys.intern(sty or ''))
+		concept_id = self._concept_ids.get(concept)
+		if concept_id is None:
+			concept_id = self._concept_ids[concept] = len(self.concepts)
+			self.concepts.append(concept)
+		self._pending.append((tuple(key), concept_id))
+		return True
+	
+	def compile(self):
+		""" Compiles names added since the last call into the trie arrays.
+		
+		Names are sorted by their token ids, so walking them in order creates
+		nodes in depth-first order and every node's children in increasing
+		token id order; the edge arrays are then filled by counting children
+		per node. The sort is stable, keeping the concepts of a name in the
+		order they were added.
+		"""
+		if not self._pending:
+			return
+		names = list(self._names())
+		names.extend(self._pending)
+		names.sort(key=operator.itemgetter(0))
+		self._pending = []
+		self._concept_ids = None
+		
+		parents = array('i')
+		node_labels = array('i')
+		output_nodes = array('i')
+		outputs = array('i')
+		path = []
+		path_nodes = [0]
+		seen = set()
+		num = 1
+		for key, concept_id in names:
+			common = 0
+			while common < len(path) and common < len(key) and path[common] == key[common]:
+				common += 1
+			del path[common:]
+			del path_nodes[common + 1:]
+			for token_id in key[common:]:
+				parents.append(path_nodes[-1])
+				node_labels.append(token_id)
+				path.append(token_id)
+				path_nodes.append(num)
+				num += 1
+			
+			node = path_nodes[-1]
+			if 0 == len(output_nodes) or output_nodes[-1] != node:
+				seen.clear()
+			if concept_id not in seen:
+				seen.add(concept_id)
+				output_nodes.append(node)
+				outputs.append(concept_id)
+		del names
+		
+		# node n > 0 is the only child of parents[n - 1] labeled node_labels[n - 1]
+		self.offsets = self._offsets(parents, num)
+		self.labels = array('i', [0]) * len(parents)
+		self.targets = array('i', [0]) * len(parents)
+		fill = self.offsets[:-1]
+		for child, parent in enumerate(parents, 1):
+			pos = fill[parent]
+			self.labels[pos] = node_labels[child - 1]
+			self.targets[pos] = child
+			fill[parent] = pos + 1
+		self.output_offsets = self._offsets(output_nodes, num)
+		self.outputs = outputs
+		self._root = None
+	
+	@staticmethod
+	def _offsets(nodes, num):
+		""" Offsets into an array grouped by the node ids in `nodes`. """
+		offsets = array('i', [0]) * (num + 1)
+		for node in nodes:
+			offsets[node + 1] += 1
+		for n in range(num):
+			offsets[n + 1] += offsets[n]
+		return offsets
+	
+	def _names(self):
+		""" Generator over (token ids, concept index) for the names already
+		compiled, recovered by walking the trie.
+		"""
+		offsets, labels, targets = self.offsets, self.labels, self.targets
+		output_offsets, outputs = self.output_offsets, self.outputs
+		stack = [(0, ())]
+		while stack:
+			node, key = stack.pop()
+			for i in range(output_offsets[node], output_offsets[node + 1]):
+				yield key, outputs[i]
+			for i in range(offsets[node], offsets[node + 1]):
+				stack.append((targets[i], key + (labels[i],)))
+	
+	def _root_targets(self):
+		""" The child of the root for every token id, -1 for tokens that
+		don't start a name, so scanning needs no search for the first token.
+		Derived from the edge arrays on first use and not saved.
+		"""
+		if self._root is None:
+			root = array('i', [-1]) * len(self.vocabulary)
+			for i in range(self.offsets[0], self.offsets[1]):
+				root[self.labels[i]] = self.targets[i]
+			self._root = root
+		return self._root
+	
+	def annotate(self, text, overlapping=False):
+		""" Generator yielding ((start, end), CUI, SAB, STY) for concept names
+		found in `text`, in text order.
+		
+		:param bool overlapping: By default, only the longest name starting
+			at a token is reported and scanning continues after it; if True,
+			all names found are reported
+		"""
+		self.compile()
+		get = self.vocabulary.get
+		offsets, labels, targets = self.offsets, self.labels, self.targets
+		output_offsets, outputs, concepts = self.output_offsets, self.outputs, self.concepts
+		root = self._root_targets()
+		bisect_left = bisect.bisect_left
+		
+		# lowercasing all at once is faster but may change offsets outside ASCII;
+		# unknown tokens get id -1, which no edge has
+		if text.isascii():
+			tokens = [(match.start(), match.end(), get(match.group(), -1)) for match in _token_re.finditer(text.lower())]
+		else:
+			tokens = [(match.start(), match.end(), get(normalize_token(match.group()), -1)) for match in _token_re.finditer(text)]
+		
+		# only tokens starting a name can start a match
+		num = len(tokens)
+		end = 0
+		for i in [i for i, token in enumerate(tokens) if token[2] >= 0 and root[token[2]] >= 0]:
+			if i < end:
+				continue
+			node = root[tokens[i][2]]
+			j = i + 1
+			longest = None
+			while True:
+				if output_offsets[node] != output_offsets[node + 1]:
+					if overlapping:
+						for k in range(output_offsets[node], output_offsets[node + 1]):
+							cui, sab, sty = concepts[outputs[k]]
+							yield ((tokens[i][0], tokens[j - 1][1]), cui, sab, sty)
+					else:
+						longest = (j, node)
+				if j == num:
+					break
+				token_id = tokens[j][2]
+				lo, hi = offsets[node], offsets[node + 1]
+				k = bisect_left(labels, token_id, lo, hi)
+				if k == hi or labels[k] != token_id:
+					break
+				node = targets[k]
+				j += 1
+			
+			if longest is not None:
+				end, node = longest
+				for k in range(output_offsets[node], output_offsets[node + 1]):
+					cui, sab, sty = concepts[outputs[k]]
+					yield ((tokens[i][0], tokens[end - 1][1]), cui, sab, sty)
+	
+	
+	# MARK: - Serialization
+	
+	def save(self, path):
+		""" Writes the annotator to the file at `path`: a magic line, a JSON
+		line with vocabulary, concepts and array lengths, then the raw arrays.
+		"""
+		self.compile()
+		vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+		arrays = self._arrays()
+		header = {
+			'format': self.__class__.file_format,
+			'byteorder': sys.byteorder,
+			'itemsize': array('i').itemsize,
+			'vocabulary': vocabulary,
+			'concepts': self.concepts,
+			'arrays': [len(a) for a in arrays],
+		}
+		with open(path, 'wb') as handle:
+			handle.write(self.__class__.magic)
+			handle.write(json.dumps(header, ensure_ascii=False).encode('utf-8'))
+			handle.write(b'\n')
+			for a in arrays:
+				a.tofile(handle)
+	
+	@classmethod
+	def load(cls, path):
+		""" Reads an annotator written by `save()`.
+		"""
+		with open(path, 'rb') as handle:
+			if handle.readline() != cls.magic:
+				raise Exception('The file at {} is not an annotator file'.format(path))
+			header = json.loads(handle.readline().decode('utf-8'))
+			if header.get('format') != cls.file_format:
+				raise Exception('The annotator file at {} has an unsupported format, build it again'.format(path))
+			if header['itemsize'] != array('i').itemsize:
+				raise Exception('The annotator file at {} was written on a platform with other integer sizes, build it again'.format(path))
+			
+			annotator = cls()
+			annotator.vocabulary = {token: i for i, token in enumerate(header['vocabulary'])}
+			annotator.concepts = [tuple(sys.intern(value) for value in concept) for concept in header['concepts']]
+			arrays = annotator._arrays()
+			for a, length in zip(arrays, header['arrays']):
+				del a[:]
+				a.fromfile(handle, length)
+				if header['byteorder'] != sys.byteorder:
+					a.byteswap()
+		return annotator
+	
+	def _arrays(self):
+		return (self.offsets, self.labels, self.targets, self.output_offsets, self.outputs)
+
+
+# running this as a script annotates the text file given as second argument
+if '__main__' == __name__:
+	logging.basicConfig(level=logging.INFO)
+	if len(sys.argv) < 3:
+		print('Usage: umls_annotator.py <annotator file> <text file>')
+		print('The annotator file is built from the UMLS database if it does not exist.')
+		sys.exit(0)
+	
+	if os.path.exists(sys.argv[1]):
+		annotator = UMLSAnnotator.load(sys.argv[1])
+	else:
+		annotator = UMLSAnnotator.build()
+		annotator.save(sys.argv[1])
+	
+	with open(sys.argv[2], encoding='utf-8') as handle:
+		text = handle.read()
+	for span, cui, sab, sty in annotator.annotate(text):
+		print('{}-{}\t{}\t{}\t{}\t{}'.format(span[0], span[1], text[span[0]:span[1]], cui, sab, sty))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	UMLS annotator unit testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import unittest
+from umls_annotator import *
+from umls_tests import UMLSFixtureTestCase
+
+
+class UMLSAnnotatorTest(UMLSFixtureTestCase):
+	""" Test :class:`UMLSAnnotator` on the fixture database.
+	"""
+	text = 'Pt with pulmonary  ARTERIAL hypertension and anginá pectoris, no asthma.'
+	
+	def annotations(self, annotator, **kwargs):
+		return [(self.text[span[0]:span[1]], cui, sab) for span, cui, sab, sty in annotator.annotate(self.text, **kwargs)]
+	
+	def test_longest_match(self):
+		annotator = UMLSAnnotator.build(self.lookup())
+		self.assertEqual([
+			('pulmonary  ARTERIAL hypertension', 'C2973725', 'SNOMEDCT'),
+			('anginá pectoris', 'C0002962', 'MTH'),
+			('anginá pectoris', 'C0002962', 'SNOMEDCT'),
+			('anginá pectoris', 'C0002962', 'MSH'),
+			('asthma', 'C0004096', 'MTH'),
+		], self.annotations(annotator))
+	
+	def test_filters(self):
+		annotator = UMLSAnnotator.build(self.lookup(), sources=['SNOMEDCT'], semantic_types=['T047'])
+		self.assertEqual([('pulmonary  ARTERIAL hypertension', 'C2973725', 'SNOMEDCT')], self.annotations(annotator))
+	
+	def test_overlapping(self):
+		annotator = UMLSAnnotator()
+		annotator.add('Pulmonary', 'C0024109', 'MTH', 'T023')
+		annotator.add('pulmonary arterial hypertension', 'C2973725', 'SNOMEDCT', 'T047')
+		self.assertEqual(['C0024109', 'C2973725'], [res[1] for res in annotator.annotate(self.text, overlapping=True)])
+		self.assertEqual(['C2973725'], [res[1] for res in annotator.annotate(self.text)])
+	
+	def test_save_and_load(self):
+		annotator = UMLSAnnotator.build(self.lookup())
+		path = os.path.join(self.tmpdir, 'annotator.bin')
+		annotator.save(path)
+		loaded = UMLSAnnotator.load(path)
+		self.assertEqual(list(annotator.annotate(self.text)), list(loaded.annotate(self.text)))
+		self.assertEqual(annotator.nbytes(), loaded.nbytes())
+		
+		with open(path, 'wb') as handle:
+			handle.write(b'\x80\x04not an annotator')
+		with self.assertRaises(Exception):
+			UMLSAnnotator.load(path)
+	
+	def test_add_after_compile(self):
+		annotator = UMLSAnnotator()
+		annotator.add('pulmonary arterial hypertension', 'C2973725', 'SNOMEDCT', 'T047')
+		annotator.add('angina pectoris', 'C0002962', 'MTH', 'T184')
+		self.assertEqual(['C2973725', 'C0002962'], [res[1] for res in annotator.annotate(self.text)])
+		nodes = len(annotator)
+		
+		annotator.add('Pulmonary', 'C0024109', 'MTH', 'T023')
+		annotator.add('angina pectoris', 'C0002962', 'MTH', 'T184')
+		annotator.add('asthma', 'C0004096', 'MTH', 'T047')
+		self.assertEqual(['C0024109', 'C2973725', 'C0002962', 'C0004096'], [res[1] for res in annotator.annotate(self.text, overlapping=True)])
+		self.assertEqual(nodes + 1, len(annotator))
+		self.assertEqual(len(annotator) - 1, len(annotator.labels))
+
+
+if '__main__' == __name__:
+	unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#	UMLS unit testing
+
+import sys
+import os.path
+thismodule = os.path.abspath(os.path.dirname(__file__))
+if thismodule not in sys.path:
+	sys.path.insert(0, thismodule)
+
+import shutil
+import tempfile
+import unittest
+from sqlite import SQLite
+from umls import UMLS, UMLSLookup, normalize_name
+from rrfimporter import create_table_sql
+
+
+# (CUI, LAT, SAB, TTY, STR, STY)
+FIXTURE_DESCRIPTIONS = [
+	('C0002962', 'ENG', 'MTH', 'PN', 'Angina Pectoris', 'T184'),
+	('C0002962', 'ENG', 'SNOMEDCT', 'PT', 'Angina pectoris', 'T184'),
+	('C0002962', 'ENG', 'MSH', 'MH', 'Angina Pectoris', 'T184'),
+	('C0020542', 'ENG', 'MTH', 'PN', 'Pulmonary Hypertension', 'T047'),
+	('C2973725', 'ENG', 'SNOMEDCT', 'PT', 'Pulmonary arterial hypertension', 'T047'),
+	('C0020538', 'ENG', 'SNOMEDCT', 'PT', 'Hypertensive disorder, systemic arterial', 'T047'),
+	('C0004096', 'ENG', 'MTH', 'PN', 'Asthma', 'T047'),
+	('C0004096', 'ENG', 'MSH', 'MH', 'Asthma "bronchial"', 'T047'),
+]
+
+# (CUI, SAB, CODE)
+FIXTURE_CODES = [
+	('C0002962', 'MTH', 'NOCODE'),
+	('C0002962', 'SNOMEDCT_US', '194828000'),
+	('C0002962', 'MSH', 'D000787'),
+	('C0004096', 'SNOMEDCT_US', '195967001'),
+	('C0004096', 'MSH', 'D001249'),
+	('C0004096', 'LNC', 'LP20716-4'),
+	('C0155502', 'SNOMEDCT_US', '195967001'),		# a code with two CUIs
+	('C0155502', 'LNC', 'LP20716-4'),
+]
+
+# (CUI1, REL, CUI2, RELA, SAB): CUI2 has relationship REL to CUI1
+FIXTURE_RELATIONS = [
+	('C2973725', 'PAR', 'C0020542', 'inverse_isa', 'SNOMEDCT_US'),		# pulmonary arterial hypertension
+	('C0020542', 'CHD', 'C2973725', 'isa', 'SNOMEDCT_US'),
+	('C0020542', 'PAR', 'C0020538', 'inverse_isa', 'SNOMEDCT_US'),		# pulmonary hypertension
+	('C0020542', 'RB', 'C0020538', '', 'MSH'),
+	('C0020538', 'CHD', 'C0020542', 'isa', 'SNOMEDCT_US'),
+	('C0020538', 'PAR', 'C0012634', 'inverse_isa', 'SNOMEDCT_US'),		# hypertensive disorder
+	('C0020538', 'RO', 'C0002962', '', 'MTH'),
+]
+
+
+class UMLSFixtureTestCase(unittest.TestCase):
+	""" Base class creating a small UMLS database with the layout created by
+	`databases/umls.sh`.
+	"""
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.db_path = os.path.join(self.tmpdir, 'umls.db')
+		sqlite = SQLite(self.db_path)
+		sqlite.execute('CREATE TABLE descriptions (CUI varchar, LAT varchar, SAB varchar, TTY varchar, STR text, STY text)')
+		sqlite.executeMany('INSERT INTO descriptions VALUES (?, ?, ?, ?, ?, ?)', FIXTURE_DESCRIPTIONS)
+		sqlite.execute('CREATE INDEX X_CUI_desc ON descriptions (CUI)')
+		sqlite.execute('CREATE TABLE MRCONSO (CUI TEXT, LAT TEXT, SAB TEXT, CODE TEXT, STR TEXT)')
+		sqlite.executeMany("INSERT INTO MRCONSO VALUES (?, 'ENG', ?, ?, NULL)", FIXTURE_CODES)
+		sqlite.executeMany('INSERT INTO MRCONSO VALUES (?, ?, ?, NULL, ?)', [row[:3] + row[4:5] for row in FIXTURE_DESCRIPTIONS])
+		sqlite.execute("INSERT INTO MRCONSO VALUES ('C0020542', 'ENG', 'MSH', NULL, 'Hypertensions, Pulmonary')")
+		sqlite.execute(create_table_sql('MRREL'))
+		sqlite.executeMany('INSERT INTO MRREL (CUI1, REL, CUI2, RELA, SAB) VALUES (?, ?, ?, ?, ?)', FIXTURE_RELATIONS)
+		sqlite.execute('CREATE INDEX X_CUI1_MRREL ON MRREL (CUI1, REL)')
+		UMLS.build_search_index(sqlite)
+		UMLS.build_code_map(sqlite)
+		UMLS.build_normalized_index(sqlite)
+		sqlite.close()
+		self._did_check_dbs = UMLSLookup.did_check_dbs
+		UMLSLookup.did_check_dbs = True
+	
+	def lookup(self):
+		""" A lookup instance on the fixture database. """
+		return UMLSLookup(self.db_path)
+	
+	def tearDown(self):
+		UMLSLookup.did_check_dbs = self._did_check_dbs
+		SQLite.get(self.db_path).close()
+		shutil.rmtree(self.tmpdir)
+
+
+class UMLSLookupTest(UMLSFixtureTestCase):
+	""" Test :class:`UMLSLookup`.
+	"""
+	def test_lookup_code(self):
+		lookup = self.lookup()
+		self.assertEqual([('Angina Pectoris', 'MTH', 'T184'), ('Angina pectoris', 'SNOMEDCT', 'T184')], sorted(lookup.lookup_code('C0002962')))
+		self.assertEqual(3, len(lookup.lookup_code('C0002962', preferred=False)))
+	
+	def test_lookup_code_many(self):
+		""" Test batch lookups, aligned with the input and cached.
+		"""
+		lookup = self.lookup()
+		cuis = ['C0002962', '-C0004096', None, 'C0002962@1', 'C9999999', '-C0002962']
+		found = lookup.lookup_code_many(cuis, preferred=False)
+		self.assertEqual([lookup.lookup_code(cui, preferred=False) if cui else [] for cui in cuis], found)
+		self.assertEqual(3, len(found[0]))
+		self.assertEqual(['[NEGATED] Asthma', '[NEGATED] Asthma "bronchial"'], sorted(found[1]))
+		self.assertEqual([], found[2])
+		self.assertEqual(found[0], found[3])
+		self.assertEqual([], found[4])
+		self.assertEqual(3, len(found[5]))
+		
+		queries = []
+		lookup.sqlite.handle.set_trace_callback(queries.append)
+		self.assertEqual(found, lookup.lookup_code_many(cuis, preferred=False))
+		self.assertEqual([], queries)
+		self.assertEqual(2, len(lookup.lookup_code('C0002962')))
+		self.assertEqual(1, len(queries))
+		lookup.sqlite.handle.set_trace_callback(None)
+	
+	def test_lookup_code_cache_bound(self):
+		lookup = self.lookup()
+		lookup.cache_size = 2
+		lookup.lookup_code_many(['C0002962', 'C0004096', 'C0020542', 'C0004096'])
+		self.assertEqual([('C0004096', True), ('C0020542', True)], list(lookup._code_cache.keys()))
+		lookup.lookup_code_many(['C0004096', 'C0002962'])
+		self.assertEqual([('C0004096', True), ('C0002962', True)], list(lookup._code_cache.keys()))
+	
+	def test_code_mapping(self):
+		lookup = self.lookup()
+		self.assertEqual([['C0002962'], [], ['C0004096', 'C0155502'], []],
+			[sorted(cuis) for cuis in lookup.cuis_for_codes('SNOMEDCT_US', ['194828000', 'D000787', '195967001', None])])
+		self.assertEqual([['D001249'], [], ['D000787']], lookup.codes_for_cuis(['C0004096', 'C0155502', 'C0002962'], 'MSH'))
+		self.assertEqual([['LP20716-4'], [], []], lookup.translate_codes(['195967001', '194828000', 'nonsense'], 'SNOMEDCT_US', 'LNC'))
+		self.assertEqual([[]], lookup.codes_for_cuis(['C0002962'], 'MTH'))
+		self.assertFalse(lookup.sqlite.handle.in_transaction)
+		
+		# databases without `code_cui` use MRCONSO
+		sqlite = SQLite.get(self.db_path)
+		sqlite.execute('DROP TABLE code_cui')
+		sqlite.commit()
+		self.assertEqual([['LP20716-4'], [], []], self.lookup().translate_codes(['195967001', '194828000', 'nonsense'], 'SNOMEDCT_US', 'LNC'))
+		self.assertEqual([[]], self.lookup().codes_for_cuis(['C0002962'], 'MTH'))
+	
+	def test_code_mapping_fallback(self):
+		""" Test that the MRCONSO fallback, with one row per atom, reports
+		every code and CUI once.
+		"""
+		sqlite = SQLite.get(self.db_path)
+		sqlite.executeMany("INSERT INTO MRCONSO VALUES (?, 'ENG', ?, ?, ?)", [
+			('C0002962', 'MSH', 'D000787', 'Angina Pectoris, Stable'),
+			('C0002962', 'MSH', 'D000787', 'Stenocardia'),
+		])
+		sqlite.execute('DROP TABLE code_cui')
+		sqlite.commit()
+		lookup = self.lookup()
+		self.assertEqual([['D000787']], lookup.codes_for_cuis(['C0002962'], 'MSH'))
+		self.assertEqual([['C0002962']], lookup.cuis_for_codes('MSH', ['D000787']))
+		self.assertEqual([['D000787']], lookup.translate_codes(['194828000'], 'SNOMEDCT_US', 'MSH'))
+	
+	def test_related(self):
+		lookup = self.lookup()
+		self.assertEqual({('C0020538', 'PAR', 'inverse_isa', 'SNOMEDCT_US'), ('C0020538', 'RB', '', 'MSH')}, lookup.lookup_related('C0020542', rel=['PAR', 'RB']))
+		self.assertEqual({('C0020538', 'RB', '', 'MSH')}, lookup.lookup_related('C0020542', sab='MSH'))
+		self.assertEqual([{('C2973725', 'CHD', 'isa', 'SNOMEDCT_US')}, set(), {('C0020542', 'CHD', 'isa', 'SNOMEDCT_US')}],
+			lookup.lookup_related_many(['C0020542', 'C9999999', 'C0020538'], rela='isa'))
+		
+		broader = [('C0020542', 1), ('C0020538', 2), ('C0012634', 3)]
+		self.assertEqual(broader, list(lookup.traverse_related('C2973725', rel='PAR')))
+		self.assertEqual(broader[:2], list(lookup.traverse_related('C2973725', rel='PAR', max_depth=2)))
+		self.assertEqual([('C0020542', 1), ('C2973725', 2)], list(lookup.traverse_related('C0020538', rel='CHD')))
+		
+		in_memory = lookup.load_relations(rel=['PAR', 'CHD'])
+		self.assertEqual(broader, list(in_memory.traverse_related('C2973725', rel='PAR')))
+		self.assertEqual(lookup.lookup_related('C0020542', rel='CHD'), in_memory.lookup_related('C0020542', rel='CHD'))
+		self.assertEqual(set(), in_memory.lookup_related('C0020538', rel='RO'))
+	
+	def test_normalize_name(self):
+		self.assertEqual('hypertension pulmonary', normalize_name('Pulmonary Hypertension'))
+		self.assertEqual('hypertension pulmonary', normalize_name('Hypertensions, Pulmonary'))
+		self.assertEqual('angina pectoris', normalize_name('angina pectoris'))
+		self.assertEqual('disorder hypertensive', normalize_name("Hypertensive disorders, NOS"))
+		self.assertEqual('disease parkinson', normalize_name("Parkinson's disease"))
+		self.assertEqual('ulcer', normalize_name('Ulcers of the Ulcer'))
+		self.assertEqual('', normalize_name(' of the '))
+	
+	def test_normalize_plurals(self):
+		""" Test that singular and plural forms end up with the same key,
+		and that words without a plural are left alone.
+		"""
+		for singular, plural in (('virus', 'viruses'), ('sinus', 'sinuses'), ('diagnosis', 'diagnoses'), ('stenosis', 'stenoses'),
+				('kidney', 'kidneys'), ('stone', 'stones'), ('artery', 'arteries'), ('fly', 'flies'), ('abscess', 'abscesses'),
+				('cause', 'causes'), ('abuse', 'abuses'), ('dose', 'doses'), ('glucose', 'glucoses'), ('purpose', 'purposes')):
+			self.assertEqual(singular, normalize_name(plural))
+			self.assertEqual(singular, normalize_name(singular))
+		for word in ('series', 'species', 'diabetes', 'herpes', 'rabies', 'caries', 'measles', 'pancreas', 'lens', 'mellitus', 'pelvis'):
+			self.assertEqual(word, normalize_name(word))
+		self.assertEqual('diabetes mellitus', normalize_name('Diabetes Mellitus'))
+	
+	def test_normalized_name_lookup(self):
+		lookup = self.lookup()
+		self.assertEqual([('C0020542', 'MTH')], lookup.lookup_code_for_normalized_name('hypertension (pulmonary)'))
+		self.assertEqual([('C0020542', 'MSH'), ('C0020542', 'MTH')], lookup.lookup_code_for_normalized_name('PULMONARY HYPERTENSIONS', preferred=False))
+		self.assertEqual([('C0020538', 'SNOMEDCT')], lookup.lookup_code_for_normalized_name('systemic arterial hypertensive disorder'))
+		self.assertEqual([], lookup.lookup_code_for_normalized_name('of'))
+	
+	def test_name_search(self):
+		""" Test substring name search via the full-text index.
+		"""
+		lookup = self.lookup()
+		self.assertTrue(lookup.has_search_index())
+		found = lookup.lookup_code_for_name('hypertension')
+		self.assertEqual({'C0020542', 'C2973725'}, set(res[0] for res in found))
+		self.assertEqual('C0020542', found[0][0])		# shorter name ranks first
+		
+		found = lookup.lookup_code_for_name('arterial hyper')
+		self.assertEqual([('C2973725', 'SNOMEDCT', 'T047')], found)
+		self.assertEqual(1, len(lookup.lookup_code_for_name('hypertens', limit=1)))
+		self.assertEqual([('C0004096', 'MTH', 'T047')], lookup.lookup_code_for_name('asthma'))
+		self.assertEqual([('C0004096', 'MSH', 'T047')], lookup.lookup_code_for_name('"bronchial"', preferred=False))
+		self.assertEqual({'C0002962'}, set(res[0] for res in lookup.lookup_code_for_name('ct', preferred=False)))
+	
+	def test_name_search_without_index(self):
+		""" Test that databases without the index fall back to LIKE.
+		"""
+		sqlite = SQLite.get(self.db_path)
+		sqlite.execute('DROP TABLE descriptions_fts')
+		sqlite.commit()
+		lookup = self.lookup()
+		found = lookup.lookup_code_for_name('hypertension')
+		self.assertEqual({'C0020542', 'C2973725'}, set(res[0] for res in found))
+
+
+if '__main__' == __name__:
+	unittest.main()